@@ -0,0 +1,269 @@
+#!/usr/bin/env python2
+# To measure the broker of BalancedDynamicReqRep.py we used to run its req_function threads: send a
+# request, wait for the reply, send the next one. That is a closed loop. When the broker stalls, the
+# clients stall with it and stop sending, so the requests that would have waited during the stall are
+# never sent, and never measured. The latencies look fine exactly when they aren't (the 'coordinated
+# omission' problem).
+#
+# This tool is an open loop: the requests are sent at a fixed rate, or with Poisson arrivals, whatever
+# the broker does. Every request knows when it *should* have been sent, and its latency is measured
+# from that intended time, so if the generator itself gets delayed by a slow broker, the delay is
+# counted. The latencies go to the HDR-style LatencyHistogram of Instrumentation.py. A request without
+# reply after --timeout seconds is a timeout, and it is recorded too, with the time it waited: leaving
+# it out would hide the worst latencies again.
+#
+# The requests go through DEALER sockets, with [sequence, intended time] in front of the empty
+# delimiter frame. The REP sockets see it as an envelope and send it back untouched, so the tool works
+# against any ROUTER frontend without changing the workers:
+#
+#       python LoadGenerator.py --uri tcp://broker:5559 --rate 2000 --duration 30
+#
+# --sweep runs one step per rate and finds the knee: the first rate where the broker can't keep up
+# with the offered load or the p99 jumps. --soak runs for hours, printing one line per --interval:
+#
+#       python LoadGenerator.py --uri tcp://broker:5559 --sweep 500,1000,2000,4000,8000
+#       python LoadGenerator.py --uri tcp://broker:5559 --rate 1000 --duration 86400 --soak --interval 60
+#
+# --serve N starts, in this process, the QUEUE broker of BalancedDynamicReqRep.py bound to --uri with
+# N REP sockets, to try the tool without anything else running. Remember they share the GIL with the
+# generator.
+
+import argparse
+import collections
+import json
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import zmq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ImprovingBasicExamples"))
+from Instrumentation import LatencyHistogram
+
+KEY = struct.Struct("!Qd")                  # sequence, intended send time
+KNEE_THROUGHPUT = 0.95                      # below this fraction of the offered rate, it's saturated
+KNEE_P99_FACTOR = 10                        # or when the p99 gets this many times the one of the first step
+
+def arrival_gaps(rate, arrival):
+    """ Seconds between two intended send times.
+    """
+    if arrival == "poisson":
+        while True:
+            yield random.expovariate(rate)
+    while True:
+        yield 1.0 / rate
+
+def run_step(context, uri, rate, duration, arrival="fixed", payload="", connections=4, timeout=1.0,
+             interval=None, report=None):
+    """ Send requests at the rate for duration seconds, and wait up to timeout for the last replies.
+
+        Every interval seconds, report(histogram, counters) is called with the ones of the interval.
+        Returns the histogram of all the latencies and the counters of the whole step.
+    """
+    sockets = []
+    poller = zmq.Poller()
+    for i in range(connections):
+        dealer_sock = context.socket(zmq.DEALER)
+        dealer_sock.setsockopt(zmq.LINGER, 0)
+        dealer_sock.setsockopt(zmq.SNDHWM, 0)
+        dealer_sock.setsockopt(zmq.RCVHWM, 0)
+        dealer_sock.connect(uri)
+        sockets.append(dealer_sock)
+        poller.register(dealer_sock, zmq.POLLIN)
+    time.sleep(0.2)                         # Let them connect
+
+    histogram = LatencyHistogram()
+    interval_histogram = LatencyHistogram()
+    counters = {"sent": 0, "received": 0, "timeouts": 0, "max_lag_ms": 0.0}
+    interval_counters = dict(counters)
+    outstanding = collections.OrderedDict()                 # sequence -> intended send time, oldest first
+    gaps = arrival_gaps(rate, arrival)
+    start = time.time()
+    end = start + duration
+    next_send = start
+    next_report = start + interval if interval else None
+    last_reply = start
+    sequence = 0
+    while True:
+        now = time.time()
+        if next_send < end and now >= next_send:
+            # Late or not, the request keeps its intended time: the lag counts in its latency
+            counters["max_lag_ms"] = max(counters["max_lag_ms"], (now - next_send) * 1000)
+            interval_counters["max_lag_ms"] = max(interval_counters["max_lag_ms"], (now - next_send) * 1000)
+            sockets[sequence % connections].send_multipart([KEY.pack(sequence, next_send), "", payload])
+            outstanding[sequence] = next_send
+            counters["sent"] = counters["sent"] + 1
+            interval_counters["sent"] = interval_counters["sent"] + 1
+            sequence = sequence + 1
+            next_send = next_send + next(gaps)
+        elif next_send >= end and (not outstanding or now >= end + timeout):
+            break
+
+        wait = next_send - now if next_send < end else end + timeout - now
+        for dealer_sock, event in poller.poll(max(0, wait) * 1000):
+            while True:
+                try:
+                    key, empty, reply = dealer_sock.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                received_at = time.time()
+                reply_sequence, intended = KEY.unpack(key)
+                if outstanding.pop(reply_sequence, None) is None:
+                    continue                # Already counted as a timeout
+                last_reply = received_at
+                histogram.record(received_at - intended)
+                interval_histogram.record(received_at - intended)
+                counters["received"] = counters["received"] + 1
+                interval_counters["received"] = interval_counters["received"] + 1
+
+        while outstanding and next(iter(outstanding.itervalues())) < now - timeout:
+            reply_sequence, intended = outstanding.popitem(last=False)   # Memory stays bounded in a soak
+            histogram.record(now - intended)
+            interval_histogram.record(now - intended)
+            counters["timeouts"] = counters["timeouts"] + 1
+            interval_counters["timeouts"] = interval_counters["timeouts"] + 1
+
+        if next_report is not None and now >= next_report:
+            report(interval_histogram, interval_counters)
+            interval_histogram = LatencyHistogram()
+            interval_counters = {"sent": 0, "received": 0, "timeouts": 0, "max_lag_ms": 0.0}
+            next_report = next_report + interval
+
+    now = time.time()
+    for intended in outstanding.itervalues():
+        histogram.record(max(timeout, now - intended))
+    counters["timeouts"] = counters["timeouts"] + len(outstanding)
+    counters["sent_rate"] = counters["sent"] / duration               # Poisson arrivals don't hit the exact rate
+    counters["achieved_rate"] = counters["received"] / max(duration, last_reply - start)
+    for dealer_sock in sockets:
+        dealer_sock.close()
+    return histogram, counters
+
+def step_result(rate, histogram, counters):
+    result = dict(counters, offered_rate=rate)
+    result.update(histogram.as_dict())
+    return result
+
+def print_header(soak=False):
+    if soak:
+        print "%9s" % "elapsed",
+    print "%10s %10s %10s %10s %10s %10s %9s %10s" % ("offered/s", "achieved/s", "p50 ms", "p99 ms", "p999 ms",
+                                                    "max ms", "timeouts", "max lag ms")
+
+def print_result(result):
+    print "%10.0f %10.0f %10.2f %10.2f %10.2f %10.2f %9d %10.1f" % (
+        result["offered_rate"], result["achieved_rate"], result["p50_us"] / 1000, result["p99_us"] / 1000,
+        result["p999_us"] / 1000, result["max_us"] / 1000, result["timeouts"], result["max_lag_ms"])
+    sys.stdout.flush()
+
+def find_knee(results):
+    """ The first step that couldn't keep up with the offered rate, or whose p99 jumped.
+    """
+    base_p99 = max(results[0]["p99_us"], 1)
+    for result in results:
+        if result["achieved_rate"] < KNEE_THROUGHPUT * result["sent_rate"] or \
+           result["p99_us"] > KNEE_P99_FACTOR * base_p99 or result["timeouts"]:
+            return result
+    return None
+
+def serve(context, uri, workers, work_time):
+    """ The broker and the REP sockets of BalancedDynamicReqRep.py, to have something to load.
+    """
+    def broker():
+        frontend = context.socket(zmq.ROUTER)
+        frontend.bind(uri)
+        backend = context.socket(zmq.DEALER)
+        backend.bind("inproc://load_generator_backend")
+        try:
+            zmq.device(zmq.QUEUE, frontend, backend)
+        except zmq.ContextTerminated:
+            frontend.close()
+            backend.close()
+
+    def rep_function(identifier):
+        rep_sock = context.socket(zmq.REP)
+        rep_sock.connect("inproc://load_generator_backend")
+        try:
+            while True:
+                message = rep_sock.recv()
+                if work_time:
+                    time.sleep(work_time)
+                rep_sock.send("RepSocket " + str(identifier) + " says: Hi!")
+        except zmq.ContextTerminated:
+            rep_sock.close()
+
+    for target, args in [(broker, ())] + [(rep_function, (i, )) for i in range(workers)]:
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+
+def parse_rates(value):
+    return [float(item) for item in value.split(",")]
+
+if __name__ == "__main__":                          # Start the logic
+
+    parser = argparse.ArgumentParser(description="Open-loop load generator for ROUTER frontends")
+    parser.add_argument("--uri", default="tcp://127.0.0.1:5559", help="frontend of the broker")
+    parser.add_argument("--rate", type=float, default=1000, help="requests per second")
+    parser.add_argument("--sweep", type=parse_rates, help="comma separated rates, one step each")
+    parser.add_argument("--arrival", choices=["fixed", "poisson"], default="poisson")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of every step")
+    parser.add_argument("--payload", type=int, default=32, help="request size in bytes")
+    parser.add_argument("--connections", type=int, default=4, help="DEALER sockets sending the requests")
+    parser.add_argument("--timeout", type=float, default=1.0, help="seconds before a request is a timeout")
+    parser.add_argument("--soak", action="store_true", help="print the latencies of every interval")
+    parser.add_argument("--interval", type=float, default=10, help="seconds between the soak reports")
+    parser.add_argument("--serve", type=int, metavar="N", help="start a broker with N REP sockets on --uri")
+    parser.add_argument("--work-time", type=float, default=0.0, help="seconds per request of --serve")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    context = zmq.Context()
+    context.setsockopt(zmq.LINGER, 0)
+    results = []
+    try:
+        if args.serve:
+            serve(context, args.uri, args.serve, args.work_time)
+        payload = "x" * args.payload
+        print_header(args.soak)
+        if args.soak:
+            started = time.time()
+            def report(histogram, counters):
+                result = step_result(args.rate, histogram, counters)
+                result["achieved_rate"] = counters["received"] / args.interval
+                print "%8.0fs" % (time.time() - started),
+                print_result(result)
+            histogram, counters = run_step(context, args.uri, args.rate, args.duration, args.arrival, payload,
+                                           args.connections, args.timeout, args.interval, report)
+            print "%9s" % "whole",
+            results.append(step_result(args.rate, histogram, counters))
+            print_result(results[-1])
+        else:
+            for rate in args.sweep or [args.rate]:
+                histogram, counters = run_step(context, args.uri, rate, args.duration, args.arrival, payload,
+                                               args.connections, args.timeout)
+                results.append(step_result(rate, histogram, counters))
+                print_result(results[-1])
+            if args.sweep:
+                knee = find_knee(results)
+                if knee is None:
+                    print "No knee found: the broker kept up with every rate"
+                else:
+                    print "Knee at %.0f requests/sec" % knee["offered_rate"]
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        context.term()                                      # End the ZeroMQ context before to leave
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "uri": args.uri,
+                "arrival": args.arrival,
+                "duration": args.duration,
+                "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+        print "Results written to " + args.output
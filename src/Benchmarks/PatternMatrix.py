@@ -0,0 +1,383 @@
+#!/usr/bin/env python2
+# The examples in BasicSocketPatterns and ImprovingBasicExamples print strings and sleep for a fixed
+# time, so they tell us how the sockets behave but not how fast they are. This benchmark runs the same
+# topologies at full speed and measures them.
+#
+# Every run is one cell of a matrix:
+#
+#       topology  x  transport  x  payload size  x  number of clients
+#
+#   topologies:  reqrep     one REP socket answering every REQ client           (ReqRep.py)
+#                pushpull   one PUSH socket fanning out to the PULL clients     (PushPull.py)
+#                pubsub     one PUB socket broadcasting to the SUB clients      (PubSub.py)
+#                balanced   every REQ client connected to three REP sockets     (BalancedReqRep.py)
+#                dynamic    REQ clients -> ROUTER/DEALER broker -> REP sockets  (BalancedDynamicReqRep.py)
+#
+#   transports:  inproc://, ipc:// and tcp://127.0.0.1
+#
+# For every cell we report msgs/sec, MB/sec and the p50/p99/p999 latency. In the request-reply
+# topologies the latency is the round trip seen by the client. In PUSH/PULL and PUB/SUB it is the one way
+# delay: the sender writes its clock in the first 8 bytes of the payload and the receiver subtracts it
+# from its own clock (both run in this process, so they share the clock).
+#
+# The results can be written to a JSON file with --output. Passing a previous file with --baseline
+# compares both runs and exits with an error when any cell lost more throughput than --tolerance, so
+# a regression between two versions is easy to catch:
+#
+#       python PatternMatrix.py --output before.json
+#       (upgrade pyzmq / libzmq / the code)
+#       python PatternMatrix.py --output after.json --baseline before.json
+#
+
+import argparse
+import json
+import os
+import platform
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zmq
+
+TOPOLOGIES = ["reqrep", "pushpull", "pubsub", "balanced", "dynamic"]
+TRANSPORTS = ["inproc", "ipc", "tcp"]
+NUMBER_OF_REP_SOCKETS = 3                   # REP sockets used by the balanced and dynamic topologies
+STAMP = struct.Struct("!d")                 # send time written at the beginning of the one way payloads
+POLL_TIMEOUT = 100                          # ms, how often the servers check if the run has finished
+
+def make_payload(size):
+    """ Build a payload of the given size with room for a timestamp at the beginning.
+    """
+    return STAMP.pack(time.time()) + "x" * max(0, size - STAMP.size)
+
+def stamp_payload(payload):
+    """ Overwrite the timestamp of a payload with the current time.
+    """
+    return STAMP.pack(time.time()) + payload[STAMP.size:]
+
+def percentile(sorted_values, fraction):
+    """ Return the value below which the given fraction of the sorted values falls.
+    """
+    if not sorted_values:
+        return 0.0
+    index = int(fraction * len(sorted_values) + 0.5) - 1
+    return sorted_values[min(max(index, 0), len(sorted_values) - 1)]
+
+class Endpoints(object):
+    """ Hands out a fresh endpoint for the chosen transport every time a socket binds.
+
+        ipc endpoints live in a temporary directory that is removed at the end of the run and
+        tcp endpoints use a random free port of 127.0.0.1.
+    """
+    def __init__(self, transport):
+        self.transport = transport
+        self.counter = 0
+        self.directory = tempfile.mkdtemp(prefix="zmq-bench-") if transport == "ipc" else None
+
+    def bind(self, sock, name):
+        """ Bind the socket and return the endpoint the peers must connect to.
+        """
+        self.counter = self.counter + 1
+        if self.transport == "inproc":
+            endpoint = "inproc://%s-%d" % (name, self.counter)
+            sock.bind(endpoint)
+        elif self.transport == "ipc":
+            endpoint = "ipc://" + os.path.join(self.directory, "%s-%d" % (name, self.counter))
+            sock.bind(endpoint)
+        else:
+            port = sock.bind_to_random_port("tcp://127.0.0.1")
+            endpoint = "tcp://127.0.0.1:" + str(port)
+        return endpoint
+
+    def cleanup(self):
+        if self.directory:
+            for name in os.listdir(self.directory):
+                os.remove(os.path.join(self.directory, name))
+            os.rmdir(self.directory)
+
+def new_socket(context, socket_type):
+    """ Create a socket that never blocks the context termination and never drops benchmark messages.
+    """
+    sock = context.socket(socket_type)
+    sock.setsockopt(zmq.LINGER, 0)
+    sock.setsockopt(zmq.SNDHWM, 0)
+    sock.setsockopt(zmq.RCVHWM, 0)
+    sock.setsockopt(zmq.RCVTIMEO, POLL_TIMEOUT)
+    return sock
+
+def rep_loop(rep_sock, stop):
+    """ Answer every request with the same payload until the run finishes.
+    """
+    while not stop.is_set():
+        try:
+            message = rep_sock.recv()
+        except zmq.Again:
+            continue
+        rep_sock.send(message)
+    rep_sock.close()
+
+def req_loop(context, endpoints, payload, messages, latencies):
+    """ Send the requests one after another, measuring the round trip of each of them.
+    """
+    req_sock = new_socket(context, zmq.REQ)
+    req_sock.setsockopt(zmq.RCVTIMEO, -1)
+    for endpoint in endpoints:
+        req_sock.connect(endpoint)
+    for i in range(messages):
+        sent = time.time()
+        req_sock.send(payload)
+        req_sock.recv()
+        latencies.append(time.time() - sent)
+    req_sock.close()
+
+def one_way_receiver(sock, expected, latencies, ready):
+    """ Receive the expected messages computing the one way latency of each of them.
+
+        The messages of the 'sync' topic are only used to know the socket is connected.
+    """
+    received = 0
+    while received < expected:
+        try:
+            frames = sock.recv_multipart()
+        except zmq.Again:
+            continue
+        now = time.time()
+        if frames[0] == "sync":
+            ready.set()
+            continue
+        latencies.append(now - STAMP.unpack_from(frames[-1])[0])
+        received = received + 1
+    sock.close()
+
+def run_request_reply(context, endpoints, clients, payload, messages, rep_sockets, broker):
+    """ Shared driver of the reqrep, balanced and dynamic topologies.
+    """
+    stop = threading.Event()
+    servers = []
+    client_endpoints = []
+    proxy = None
+    if broker:
+        frontend = new_socket(context, zmq.ROUTER)
+        backend = new_socket(context, zmq.DEALER)
+        client_endpoints.append(endpoints.bind(frontend, "frontend"))
+        backend_endpoint = endpoints.bind(backend, "backend")
+        proxy = threading.Thread(target=proxy_loop, args=(frontend, backend))
+        proxy.start()
+    for i in range(rep_sockets):
+        rep_sock = new_socket(context, zmq.REP)
+        if broker:
+            rep_sock.connect(backend_endpoint)
+        else:
+            client_endpoints.append(endpoints.bind(rep_sock, "rep"))
+        servers.append(threading.Thread(target=rep_loop, args=(rep_sock, stop)))
+    for server in servers:
+        server.start()
+
+    latencies = [[] for i in range(clients)]
+    threads = [threading.Thread(target=req_loop,
+                                args=(context, client_endpoints, payload, messages, latencies[i]))
+               for i in range(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    stop.set()
+    for server in servers:                    # the proxy ends when run_cell terminates the context
+        server.join()
+    return elapsed, sum(latencies, [])
+
+def proxy_loop(frontend, backend):
+    """ The same QUEUE device used by BalancedDynamicReqRep.py, ended by terminating the context.
+    """
+    try:
+        zmq.proxy(frontend, backend)
+    except zmq.ContextTerminated:
+        pass
+    frontend.close()
+    backend.close()
+
+def run_reqrep(context, endpoints, clients, payload, messages):
+    return run_request_reply(context, endpoints, clients, payload, messages, 1, False)
+
+def run_balanced(context, endpoints, clients, payload, messages):
+    return run_request_reply(context, endpoints, clients, payload, messages, NUMBER_OF_REP_SOCKETS, False)
+
+def run_dynamic(context, endpoints, clients, payload, messages):
+    return run_request_reply(context, endpoints, clients, payload, messages, NUMBER_OF_REP_SOCKETS, True)
+
+def run_pushpull(context, endpoints, clients, payload, messages):
+    """ One PUSH socket sends messages*clients messages, load balanced among the PULL clients.
+
+        PUSH only balances among the PULL sockets already connected, so the pusher sends 'sync'
+        messages until every PULL socket has received one before the measure starts.
+    """
+    push_sock = new_socket(context, zmq.PUSH)
+    endpoint = endpoints.bind(push_sock, "push-pull")
+    total = messages * clients
+    counts = [total // clients + (1 if i < total % clients else 0) for i in range(clients)]
+    latencies = [[] for i in range(clients)]
+    ready = [threading.Event() for i in range(clients)]
+    threads = []
+    for i in range(clients):
+        pull_sock = new_socket(context, zmq.PULL)
+        pull_sock.connect(endpoint)
+        threads.append(threading.Thread(target=one_way_receiver,
+                                        args=(pull_sock, counts[i], latencies[i], ready[i])))
+    for thread in threads:
+        thread.start()
+    while not all(event.is_set() for event in ready):
+        push_sock.send_multipart(["sync", ""])
+        time.sleep(0.01)
+
+    start = time.time()
+    for i in range(total):
+        push_sock.send_multipart(["data", stamp_payload(payload)])
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    push_sock.close()
+    return elapsed, sum(latencies, [])
+
+def run_pubsub(context, endpoints, clients, payload, messages):
+    """ One PUB socket broadcasts 'messages' messages, every SUB client receives all of them.
+
+        To avoid the slow joiner problem explained in PubSub.py, the publisher sends 'sync'
+        messages until every subscriber has received one.
+    """
+    pub_sock = new_socket(context, zmq.PUB)
+    endpoint = endpoints.bind(pub_sock, "pub-sub")
+    latencies = [[] for i in range(clients)]
+    ready = [threading.Event() for i in range(clients)]
+    threads = []
+    for i in range(clients):
+        sub_sock = new_socket(context, zmq.SUB)
+        sub_sock.setsockopt(zmq.SUBSCRIBE, "")
+        sub_sock.connect(endpoint)
+        threads.append(threading.Thread(target=one_way_receiver,
+                                        args=(sub_sock, messages, latencies[i], ready[i])))
+    for thread in threads:
+        thread.start()
+    while not all(event.is_set() for event in ready):
+        pub_sock.send_multipart(["sync", ""])
+        time.sleep(0.01)
+
+    start = time.time()
+    for i in range(messages):
+        pub_sock.send_multipart(["data", stamp_payload(payload)])
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    pub_sock.close()
+    return elapsed, sum(latencies, [])
+
+RUNNERS = {
+    "reqrep": run_reqrep,
+    "pushpull": run_pushpull,
+    "pubsub": run_pubsub,
+    "balanced": run_balanced,
+    "dynamic": run_dynamic,
+}
+
+def run_cell(topology, transport, payload_size, clients, messages):
+    """ Run one cell of the matrix in its own context and return its figures.
+    """
+    context = zmq.Context()
+    endpoints = Endpoints(transport)
+    try:
+        elapsed, latencies = RUNNERS[topology](context, endpoints, clients,
+                                               make_payload(payload_size), messages)
+    finally:
+        context.term()
+        endpoints.cleanup()
+    latencies.sort()
+    delivered = len(latencies)
+    return {
+        "topology": topology,
+        "transport": transport,
+        "payload_size": payload_size,
+        "clients": clients,
+        "messages": delivered,
+        "elapsed": elapsed,
+        "msgs_per_sec": delivered / elapsed,
+        "mb_per_sec": delivered * payload_size / elapsed / 1e6,
+        "p50_us": percentile(latencies, 0.50) * 1e6,
+        "p99_us": percentile(latencies, 0.99) * 1e6,
+        "p999_us": percentile(latencies, 0.999) * 1e6,
+    }
+
+def cell_key(result):
+    return (result["topology"], result["transport"], result["payload_size"], result["clients"])
+
+def compare(results, baseline_file, tolerance):
+    """ Print the throughput change of every cell against a previous run.
+
+        Returns the number of cells that got slower than the tolerance allows.
+    """
+    with open(baseline_file) as f:
+        baseline = dict((cell_key(result), result) for result in json.load(f)["results"])
+    regressions = 0
+    print
+    print "Comparison against " + baseline_file
+    for result in results:
+        previous = baseline.get(cell_key(result))
+        if previous is None:
+            continue
+        change = result["msgs_per_sec"] / previous["msgs_per_sec"] - 1.0
+        mark = ""
+        if change < -tolerance:
+            mark = "  <-- REGRESSION"
+            regressions = regressions + 1
+        print "%-9s %-7s %8d B %3d clients  %+7.1f%% msgs/sec%s" % (cell_key(result) + (change * 100, mark))
+    return regressions
+
+def parse_list(value):
+    return [int(item) for item in value.split(",")]
+
+if __name__ == "__main__":                          # Start the logic
+
+    parser = argparse.ArgumentParser(description="Throughput and latency matrix of the example topologies")
+    parser.add_argument("--topologies", default=",".join(TOPOLOGIES))
+    parser.add_argument("--transports", default=",".join(TRANSPORTS))
+    parser.add_argument("--sizes", type=parse_list, default=[64, 1024, 65536], help="payload sizes in bytes")
+    parser.add_argument("--clients", type=parse_list, default=[1, 4], help="number of clients")
+    parser.add_argument("--messages", type=int, default=2000, help="messages sent by every client")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed throughput loss (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    results = []
+    print "%-9s %-7s %10s %7s %12s %10s %10s %10s %10s" % ("topology", "transp.", "payload", "clients",
+                                                          "msgs/sec", "MB/sec", "p50 us", "p99 us", "p999 us")
+    try:
+        for topology in args.topologies.split(","):
+            for transport in args.transports.split(","):
+                for payload_size in args.sizes:
+                    for clients in args.clients:
+                        result = run_cell(topology, transport, payload_size, clients, args.messages)
+                        results.append(result)
+                        print "%-9s %-7s %10d %7d %12.0f %10.2f %10.1f %10.1f %10.1f" % (
+                            topology, transport, payload_size, clients, result["msgs_per_sec"],
+                            result["mb_per_sec"], result["p50_us"], result["p99_us"], result["p999_us"])
+                        sys.stdout.flush()
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "zmq_version": zmq.zmq_version(),
+                "pyzmq_version": zmq.__version__,
+                "python_version": platform.python_version(),
+                "host": platform.node(),
+                "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "messages_per_client": args.messages,
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+        print "Results written to " + args.output
+
+    if args.baseline and compare(results, args.baseline, args.tolerance) > 0:
+        sys.exit(1)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python2
+# This example expands the features of the previous PubSub exercise for high message rates.
+#
+# pub_function in PubSub.py sends every message as its own two-part message (topic + body). When we
+# publish hundreds of thousands of tiny messages per second, most of the time goes to the per-message
+# work: one python call, one ZeroMQ message and one trip through the pipes per part.
+#
+# Here the publisher coalesces the messages of the same topic in one batch and sends the whole batch
+# as a single two-part message:
+#
+#       [topic | len body1, body1, len body2, body2, ...]
+#
+# A batch is sent when it reaches max_batch_bytes, or when its oldest message has waited max_delay
+# seconds, so batching adds at most max_delay of latency. As every batch carries a single topic in its
+# first part, the SUB sockets keep filtering by topic exactly as before, and the subscriber only has to
+# split the batch back into messages.
+#
+#                          pub_sock
+#                     (BatchingPublisher)
+#                         /       \
+#               [Important|b1 b2 b3]  [Useless|b1 b2]
+#                       /           \
+#                  sub_sock1     sub_sock2
+#                  (unbatch)     (unbatch)
+#
+# Running 'python BatchedPubSub.py bench' compares msgs/sec and latency with and without batching.
+
+import struct
+import sys
+import threading
+import time
+import zmq
+
+LENGTH = struct.Struct("!I")                # length prefix of every body inside a batch
+
+class BatchingPublisher(object):
+    """ Coalesces the messages of every topic and publishes them in batches.
+
+        max_batch_bytes: a batch is sent as soon as its bodies add up to this size.
+        max_delay:       seconds the first message of a batch can wait before the batch is sent.
+    """
+    def __init__(self, pub_sock, max_batch_bytes=8192, max_delay=0.005):
+        self.pub_sock = pub_sock
+        self.max_batch_bytes = max_batch_bytes
+        self.max_delay = max_delay
+        self.batches = {}                   # topic -> [deadline, size, list of prefixed bodies]
+        self.stats = {"messages": 0, "batches": 0}
+
+    def publish(self, topic, body):
+        batch = self.batches.get(topic)
+        if batch is None:
+            batch = self.batches[topic] = [time.time() + self.max_delay, 0, []]
+        batch[2].append(LENGTH.pack(len(body)))
+        batch[2].append(body)
+        batch[1] = batch[1] + LENGTH.size + len(body)
+        self.stats["messages"] = self.stats["messages"] + 1
+        if batch[1] >= self.max_batch_bytes or time.time() >= batch[0]:
+            self.flush(topic)
+
+    def flush(self, topic):
+        """ Send the batch of the topic right now.
+        """
+        batch = self.batches.pop(topic, None)
+        if batch is not None:
+            self.pub_sock.send_multipart([topic, "".join(batch[2])])
+            self.stats["batches"] = self.stats["batches"] + 1
+
+    def flush_expired(self):
+        """ Send the batches whose deadline has passed. Call it when there is nothing to publish.
+
+            Returns the seconds until the next deadline, or None if there isn't any batch waiting.
+        """
+        now = time.time()
+        for topic, batch in self.batches.items():
+            if now >= batch[0]:
+                self.flush(topic)
+        if not self.batches:
+            return None
+        return max(0, min(batch[0] for batch in self.batches.values()) - now)
+
+    def flush_all(self):
+        for topic in self.batches.keys():
+            self.flush(topic)
+
+def unbatch(batch):
+    """ Split a batch back into the list of bodies it carries.
+    """
+    bodies = []
+    offset = 0
+    while offset < len(batch):
+        length = LENGTH.unpack_from(batch, offset)[0]
+        offset = offset + LENGTH.size
+        bodies.append(batch[offset:offset + length])
+        offset = offset + length
+    return bodies
+
+def recv_batch(sub_sock):
+    """ Receive a batch and return its topic and its bodies.
+    """
+    topic, batch = sub_sock.recv_multipart()
+    return topic, unbatch(batch)
+
+def pub_function(pub_uri):
+    """ Definition of the pub socket. The same messages of PubSub.py, but batched.
+    """
+    pub_sock = context.socket(zmq.PUB)
+    pub_sock.bind(pub_uri)
+    publisher = BatchingPublisher(pub_sock, max_batch_bytes=4096, max_delay=0.5)
+    time.sleep(0.5)                          # Let the subscribers connect
+    for i in range(5):
+        print "P: Publishing two messages about the Time Machine and one about Brawndo"
+        publisher.publish("Important", "Find Time Machine")
+        publisher.publish("Important", "Fix Time Machine")
+        publisher.publish("Useless", "Drink Brawndo")
+        time.sleep(0.2)
+        publisher.flush_expired()            # The batches wait up to half a second
+    publisher.flush_all()
+    print "P: " + str(publisher.stats["messages"]) + " messages sent in " + str(publisher.stats["batches"]) + " batches"
+    time.sleep(0.5)
+    pub_sock.close()
+
+def sub_function(pub_uri, num, subs_message, times):
+    """ Definition of the SUB socket. It splits every batch into its messages.
+    """
+    sub_sock = context.socket(zmq.SUB)
+    sub_sock.setsockopt(zmq.SUBSCRIBE, subs_message)
+    sub_sock.connect(pub_uri)
+    received = 0
+    while received < times:
+        topic, bodies = recv_batch(sub_sock)
+        print "S" + str(num) + ": batch of " + str(len(bodies)) + " messages with topic " + topic + ": " + str(bodies)
+        received = received + len(bodies)
+    sub_sock.close()
+
+def bench_subscriber(sub_sock, expected, batched, latencies):
+    received = 0
+    while received < expected:
+        if batched:
+            topic, bodies = recv_batch(sub_sock)
+        else:
+            topic, body = sub_sock.recv_multipart()
+            bodies = [body]
+        if topic == "sync":
+            continue
+        now = time.time()
+        for body in bodies:
+            latencies.append(now - float(body))
+        received = received + len(bodies)
+
+def bench(messages, max_batch_bytes, max_delay):
+    """ Publish tiny messages at full speed and return msgs/sec and the latencies.
+
+        max_batch_bytes None means no batching, as in PubSub.py.
+    """
+    pub_sock = context.socket(zmq.PUB)
+    pub_sock.setsockopt(zmq.SNDHWM, 0)
+    port = pub_sock.bind_to_random_port("tcp://127.0.0.1")
+    sub_sock = context.socket(zmq.SUB)
+    sub_sock.setsockopt(zmq.RCVHWM, 0)
+    sub_sock.setsockopt(zmq.SUBSCRIBE, "")
+    sub_sock.connect("tcp://127.0.0.1:" + str(port))
+    while not sub_sock.poll(10):             # Avoid the slow joiner, see PubSub.py
+        pub_sock.send_multipart(["sync", ""])
+    while sub_sock.poll(100):
+        sub_sock.recv_multipart()
+
+    batched = max_batch_bytes is not None
+    latencies = []
+    subscriber = threading.Thread(target=bench_subscriber, args=(sub_sock, messages, batched, latencies))
+    subscriber.start()
+    publisher = BatchingPublisher(pub_sock, max_batch_bytes, max_delay) if batched else None
+    start = time.time()
+    for i in range(messages):
+        topic = "Important" if i % 2 else "Useless"
+        if batched:
+            publisher.publish(topic, repr(time.time()))
+        else:
+            pub_sock.send_multipart([topic, repr(time.time())])
+    if batched:
+        publisher.flush_all()
+    subscriber.join()
+    elapsed = time.time() - start
+    pub_sock.close()
+    sub_sock.close()
+    latencies.sort()
+    return messages / elapsed, latencies
+
+if __name__ == "__main__":                          # Start the logic
+
+    context = zmq.Context()
+    context.setsockopt(zmq.LINGER, 0)
+    try:
+        if len(sys.argv) > 1 and sys.argv[1] == "bench":
+            print "%-26s %12s %12s %12s" % ("mode", "msgs/sec", "p50 ms", "p99 ms")
+            for max_batch_bytes, max_delay in [(None, None), (1024, 0.001), (8192, 0.005), (65536, 0.02)]:
+                throughput, latencies = bench(200000, max_batch_bytes, max_delay)
+                if max_batch_bytes is None:
+                    mode = "one message per send"
+                else:
+                    mode = "batch %dB / %.0fms" % (max_batch_bytes, max_delay * 1000)
+                print "%-26s %12.0f %12.2f %12.2f" % (mode, throughput, latencies[len(latencies) // 2] * 1000,
+                                                       latencies[int(len(latencies) * 0.99)] * 1000)
+        else:
+            pub_uri = "inproc://batched-pub-sub"
+            threads = [threading.Thread(target=pub_function, args=(pub_uri, ))]
+            threads.append(threading.Thread(target=sub_function, args=(pub_uri, 0, "Important", 10)))
+            threads.append(threading.Thread(target=sub_function, args=(pub_uri, 1, "Useless", 5)))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        context.term()                                      # End the ZeroMQ context before to leave
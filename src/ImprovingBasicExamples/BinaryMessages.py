@@ -0,0 +1,262 @@
+#!/usr/bin/env python2
+# All the previous examples build their messages concatenating strings,
+#
+#       "ReqSocket " + str(identifier) + " says: Hi!"
+#
+# and BalancedDynamicReqRep.py gets the identifier back with str.split(message)[1]. Formatting numbers
+# as text and splitting text to find them again costs CPU in both sides, and the messages are bigger
+# than they need to be.
+#
+# Here we define the messages with a fixed binary layout built with the struct module. Every message
+# starts with the same header:
+#
+#        0         1         2                   4                             8                        16
+#        +---------+---------+-------------------+-----------------------------+------------------------+
+#        | version |  type   |       flags       |           sender            |        sequence        |
+#        +---------+---------+-------------------+-----------------------------+------------------------+
+#
+# followed by the fixed fields of its type and, optionally, a variable payload of bytes at the end.
+# Every message type compiles its header and fields in a single struct.Struct, so encoding is one
+# pack() call and decoding one unpack() call. The version field lets old and new peers detect each
+# other instead of misreading the messages.
+#
+# The module can be imported by the other examples: send_message() and recv_message() work with any
+# socket. For PUB/SUB sockets pass a topic, which travels in its own first part so the SUB sockets
+# keep filtering by it.
+#
+# Running 'python BinaryMessages.py' plays the ReqRep, PushPull and PubSub examples with binary
+# messages, and 'python BinaryMessages.py bench' compares them with the string messages.
+
+import collections
+import functools
+import struct
+import sys
+import threading
+import time
+import zmq
+
+VERSION = 1
+HEADER_FORMAT = "!BBHIQ"                    # version, type, flags, sender, sequence
+HEADER_FIELDS = ("flags", "sender", "sequence")
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+class MessageType(object):
+    """ A message type: its number, its fixed fields and whether it carries a payload.
+
+        fields is a list of (name, struct format) pairs, for example [("identifier", "I")].
+    """
+    registry = {}
+
+    def __init__(self, type_id, name, fields=(), payload=False):
+        if type_id in MessageType.registry:
+            raise ValueError("message type " + str(type_id) + " already registered")
+        self.type_id = type_id
+        self.name = name
+        self.payload = payload
+        self.layout = struct.Struct(HEADER_FORMAT + "".join(fmt for field, fmt in fields))
+        names = HEADER_FIELDS + tuple(field for field, fmt in fields) + (("payload", ) if payload else ())
+        self.tuple = collections.namedtuple(name, names)
+        self.make = functools.partial(tuple.__new__, self.tuple)   # Faster than namedtuple._make
+        MessageType.registry[type_id] = self
+
+    def encode(self, sender, sequence, *values, **options):
+        """ Encode a message. The payload, if any, is given as payload=...; flags as flags=...
+        """
+        if options:
+            data = self.layout.pack(VERSION, self.type_id, options.get("flags", 0), sender, sequence, *values)
+            return data + options.get("payload", "") if self.payload else data
+        return self.layout.pack(VERSION, self.type_id, 0, sender, sequence, *values)
+
+    def decode(self, data):
+        if len(data) < self.layout.size:
+            raise ValueError(self.name + " message of " + str(len(data)) + " bytes, it needs " +
+                             str(self.layout.size))
+        values = self.layout.unpack_from(data)
+        if self.payload:
+            return self.make(values[2:] + (data[self.layout.size:], ))
+        return self.make(values[2:])
+
+def message_type(data):
+    """ Return the MessageType of an encoded message, checking its length, version and type.
+    """
+    if len(data) < HEADER_SIZE:
+        raise ValueError("message of " + str(len(data)) + " bytes, shorter than the header")
+    if ord(data[0]) != VERSION:
+        raise ValueError("unsupported message version " + str(ord(data[0])))
+    try:
+        return MessageType.registry[ord(data[1])]
+    except KeyError:
+        raise ValueError("unknown message type " + str(ord(data[1])))
+
+def decode(data):
+    """ Decode any registered message. Raises ValueError if it isn't one.
+    """
+    return message_type(data).decode(data)
+
+def send_message(sock, message_type, sender, sequence, *values, **options):
+    """ Encode and send a message. With topic=... it is sent as [topic, message] for PUB sockets.
+    """
+    topic = options.pop("topic", None)
+    data = message_type.encode(sender, sequence, *values, **options)
+    if topic is None:
+        return sock.send(data)
+    return sock.send_multipart([topic, data])
+
+def recv_message(sock, topic=False):
+    """ Receive and decode a message. With topic=True it returns (topic, message).
+    """
+    if topic:
+        topic, data = sock.recv_multipart()
+        return topic, decode(data)
+    return decode(sock.recv())
+
+# The messages of the examples
+
+GREETING = MessageType(1, "Greeting", [("sent_at", "d")])                  # "ReqSocket N says: Hi!"
+GREETING_REPLY = MessageType(2, "GreetingReply", [("greeted", "I")])        # "RepSocket N says: Hi 'M'!"
+POTATO = MessageType(3, "Potato", [("potato", "I")])                        # "N Potato"
+NEWS = MessageType(4, "News", payload=True)                                 # 'Find Time Machine'
+
+def req_function(broker_router_uri, identifier, times):
+    """ The req_function of BalancedDynamicReqRep.py, with binary messages.
+    """
+    req_sock = context.socket(zmq.REQ)
+    req_sock.connect(broker_router_uri)
+    for i in range(times):
+        send_message(req_sock, GREETING, identifier, i, time.time())
+        reply = recv_message(req_sock)
+        print "RepSocket " + str(reply.sender) + " says: Hi '" + str(reply.greeted) + "'!"
+    req_sock.close()
+
+def rep_function(broker_dealer_uri, identifier, times_greet):
+    """ The rep_function of BalancedDynamicReqRep.py. No str.split, the identifier is a field.
+    """
+    rep_sock = context.socket(zmq.REP)
+    rep_sock.connect(broker_dealer_uri)
+    for i in range(times_greet):
+        greeting = recv_message(rep_sock)
+        send_message(rep_sock, GREETING_REPLY, identifier, greeting.sequence, greeting.sender)
+    rep_sock.close()
+
+def push_function(times, pullers):
+    """ The push_function of PushPull.py, without its sleep.
+
+        A PUSH socket sends everything to the first PULL socket that connects, so it waits until the
+        pullers say READY.
+    """
+    push_sock = context.socket(zmq.PUSH)
+    push_sock.bind("inproc://binary-push-pull")
+    sync_sock = context.socket(zmq.PULL)
+    sync_sock.bind("inproc://binary-push-pull-sync")
+    for i in range(pullers):
+        sync_sock.recv()
+    sync_sock.close()
+    for i in range(times):
+        send_message(push_sock, POTATO, 0, i, i + 1)
+    push_sock.close()
+
+def pull_function(num, times):
+    """ The pull_function of PushPull.py.
+    """
+    pull_sock = context.socket(zmq.PULL)
+    pull_sock.connect("inproc://binary-push-pull")
+    sync_sock = context.socket(zmq.PUSH)
+    sync_sock.connect("inproc://binary-push-pull-sync")
+    sync_sock.send("READY")
+    for i in range(times):
+        print "Pull" + str(num) + ": I recieved potato " + str(recv_message(pull_sock).potato)
+    sync_sock.close()                       # Not before: with LINGER 0 the READY could be dropped
+    pull_sock.close()
+
+def pub_function(times):
+    """ The pub_function of PubSub.py. The topic is still the first part.
+    """
+    pub_sock = context.socket(zmq.PUB)
+    pub_sock.bind("inproc://binary-pub-sub")
+    time.sleep(0.2)
+    for i in range(times):
+        send_message(pub_sock, NEWS, 0, i, topic="Important", payload="Find Time Machine")
+        send_message(pub_sock, NEWS, 0, i, topic="Useless", payload="Drink Brawndo")
+    pub_sock.close()
+
+def sub_function(num, subs_message, times):
+    """ The sub_function of PubSub.py.
+    """
+    sub_sock = context.socket(zmq.SUB)
+    sub_sock.setsockopt(zmq.SUBSCRIBE, subs_message)
+    sub_sock.connect("inproc://binary-pub-sub")
+    for i in range(times):
+        topic, news = recv_message(sub_sock, topic=True)
+        print "S" + str(num) + ": topic " + topic + ", news " + str(news.sequence) + ": " + news.payload
+    sub_sock.close()
+
+def broker(broker_router_uri, broker_dealer_uri):
+    """ The QUEUE broker of BalancedDynamicReqRep.py.
+    """
+    frontend = context.socket(zmq.ROUTER)
+    frontend.bind(broker_router_uri)
+    backend = context.socket(zmq.DEALER)
+    backend.bind(broker_dealer_uri)
+    try:
+        zmq.device(zmq.QUEUE, frontend, backend)
+    except zmq.ContextTerminated:
+        frontend.close()
+        backend.close()
+
+def bench(times):
+    """ Compare the CPU per message and the size of the string and the binary greetings.
+
+        Both carry the same data: who greets, the sequence number and when the greeting was sent.
+    """
+    identifier = 12345
+    start = time.time()
+    for i in range(times):
+        request = "ReqSocket " + str(identifier) + " says: Hi! #" + str(i) + " at " + repr(time.time())
+        fields = str.split(request)
+        sender, sequence, sent_at = int(fields[1]), int(fields[4][1:]), float(fields[6])
+        reply = "RepSocket " + str(7) + " says: Hi '" + str(sender) + "'! #" + str(sequence)
+        fields = str.split(reply)
+        int(fields[4][1:-2]), int(fields[5][1:])
+    text_time = time.time() - start
+    text_sizes = (len(request), len(reply))
+
+    start = time.time()
+    for i in range(times):
+        request = GREETING.encode(identifier, i, time.time())
+        greeting = decode(request)
+        reply = GREETING_REPLY.encode(7, greeting.sequence, greeting.sender)
+        decode(reply)
+    binary_time = time.time() - start
+    binary_sizes = (len(request), len(reply))
+
+    print "text:   %5.2f us per request/reply, %d + %d bytes" % ((text_time / times * 1e6, ) + text_sizes)
+    print "binary: %5.2f us per request/reply, %d + %d bytes" % ((binary_time / times * 1e6, ) + binary_sizes)
+
+if __name__ == "__main__":                          # Start the logic
+
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        bench(200000)
+        sys.exit(0)
+
+    context = zmq.Context()
+    context.setsockopt(zmq.LINGER, 0)
+    try:
+        threading.Thread(target=broker, args=("inproc://broker_frontend", "inproc://broker_backend")).start()
+        threads = [threading.Thread(target=rep_function, args=("inproc://broker_backend", 1, 2)),
+                   threading.Thread(target=rep_function, args=("inproc://broker_backend", 2, 2)),
+                   threading.Thread(target=req_function, args=("inproc://broker_frontend", 1, 2)),
+                   threading.Thread(target=req_function, args=("inproc://broker_frontend", 2, 2)),
+                   threading.Thread(target=pull_function, args=(0, 3)),
+                   threading.Thread(target=pull_function, args=(1, 3)),
+                   threading.Thread(target=push_function, args=(6, 2)),
+                   threading.Thread(target=sub_function, args=(0, "Important", 3)),
+                   threading.Thread(target=sub_function, args=(1, "Useless", 3)),
+                   threading.Thread(target=pub_function, args=(3, ))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        context.term()                                      # End the ZeroMQ context before to leave
@@ -0,0 +1,247 @@
+#!/usr/bin/env python2
+# This example expands the features of the previous BalancedDynamicReqRep exercise.
+#
+# The broker of BalancedDynamicReqRep.py sends every request to a REP socket, even when the very same
+# request was answered a moment ago. When the requests are idempotent (the same request always gets
+# the same reply) and repeated a lot, most of the work of the REP sockets is wasted.
+#
+# Here the broker can keep a ResponseCache of the replies, keyed by the request:
+#
+#   - a cache hit is answered by the broker itself, it never reaches a REP socket,
+#   - the cache forgets the least recently used replies when it has more than max_entries replies or
+#     max_bytes bytes of requests and replies, and a reply expires after ttl seconds,
+#   - identical requests that arrive while the first one is still being answered are coalesced: the
+#     broker waits for the one reply and sends it to all of them. If it doesn't arrive in
+#     request_timeout seconds, the waiting clients get TIMEOUT and the next identical request goes to
+#     a REP socket again.
+#
+#                     req_sock      req_sock      req_sock
+#                        |             |             |
+#                        -----------------------------
+#                                      |
+#                                 router_sock
+#                           caching broker  <-- ResponseCache
+#                                 dealer_sock                     [request id | "" | request]
+#                                      |
+#                        -----------------------------
+#                        |             |             |
+#                     rep_sock      rep_sock      rep_sock
+#
+# The broker can't use the QUEUE device any more: it needs to read the requests. The requests it sends
+# to the backend carry a request id in front of the empty delimiter frame, that the REP sockets send
+# back untouched, so the broker knows which clients are waiting for every reply.
+#
+# Running 'python CachingBroker.py bench' compares the broker with and without cache.
+
+import collections
+import json
+import sys
+import threading
+import time
+import zmq
+
+TIMEOUT = "TIMEOUT"
+
+class ResponseCache(object):
+    """ LRU cache of replies with a time to live.
+
+        max_entries: replies kept at most.
+        max_bytes:   bytes of keys and replies kept at most. A bigger entry is never cached.
+        ttl:         seconds a reply is valid, None for ever.
+    """
+    def __init__(self, max_entries=1000, max_bytes=1024 * 1024, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()     # key -> (expires at, reply), oldest first
+        self.size = 0
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None and entry[0] is not None and entry[0] <= time.time():
+            self.size = self.size - len(key) - len(entry[1])
+            self.stats["expirations"] = self.stats["expirations"] + 1
+            entry = None
+        if entry is None:
+            self.stats["misses"] = self.stats["misses"] + 1
+            return None
+        self.entries[key] = entry                    # The most recently used goes to the end
+        self.stats["hits"] = self.stats["hits"] + 1
+        return entry[1]
+
+    def put(self, key, reply):
+        if len(key) + len(reply) > self.max_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size = self.size - len(key) - len(old[1])
+        expires_at = None if self.ttl is None else time.time() + self.ttl
+        self.entries[key] = (expires_at, reply)
+        self.size = self.size + len(key) + len(reply)
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            key, (expires_at, reply) = self.entries.popitem(last=False)
+            self.size = self.size - len(key) - len(reply)
+            self.stats["evictions"] = self.stats["evictions"] + 1
+
+def caching_broker(broker_router_uri, broker_dealer_uri, cache=None, stats_uri=None, request_timeout=5.0):
+    """ Definition of the broker. Without cache, it forwards every request like the QUEUE device.
+
+        With stats_uri it answers the cache stats as JSON on a REP socket. A request without reply
+        after request_timeout seconds is answered with TIMEOUT.
+    """
+    frontend = context.socket(zmq.ROUTER)
+    frontend.bind(broker_router_uri)
+    backend = context.socket(zmq.DEALER)
+    backend.bind(broker_dealer_uri)
+    poller = zmq.Poller()
+    poller.register(frontend, zmq.POLLIN)
+    poller.register(backend, zmq.POLLIN)
+    stats_sock = None
+    if stats_uri is not None:
+        stats_sock = context.socket(zmq.REP)
+        stats_sock.bind(stats_uri)
+        poller.register(stats_sock, zmq.POLLIN)
+
+    in_flight = collections.OrderedDict()      # request id -> (sent at, request, envelopes of the waiting
+                                                # clients), oldest first
+    in_flight_requests = {}                     # request -> request id, to coalesce identical requests
+    sequence = 0
+    try:
+        while True:
+            now = time.time()
+            while in_flight and next(iter(in_flight.itervalues()))[0] <= now - request_timeout:
+                request_id, (sent_at, request, envelopes) = in_flight.popitem(last=False)
+                if cache is not None:           # A REP socket lost it: don't coalesce with it any more
+                    del in_flight_requests[request]
+                for envelope in envelopes:
+                    frontend.send_multipart(envelope + [TIMEOUT])
+            timeout = None
+            if in_flight:
+                timeout = max(0, next(iter(in_flight.itervalues()))[0] + request_timeout - now) * 1000
+            for sock, event in poller.poll(timeout):
+                if sock is frontend:
+                    frames = frontend.recv_multipart()
+                    envelope, request = frames[:-1], frames[-1]
+                    if cache is not None:
+                        reply = cache.get(request)
+                        if reply is not None:
+                            frontend.send_multipart(envelope + [reply])
+                            continue
+                        request_id = in_flight_requests.get(request)
+                        if request_id is not None:
+                            in_flight[request_id][2].append(envelope)
+                            cache.stats["coalesced"] = cache.stats["coalesced"] + 1
+                            continue
+                    sequence = sequence + 1
+                    request_id = str(sequence)
+                    in_flight[request_id] = (time.time(), request, [envelope])
+                    if cache is not None:
+                        in_flight_requests[request] = request_id
+                    backend.send_multipart([request_id, "", request])
+
+                elif sock is backend:
+                    request_id, empty, reply = backend.recv_multipart()
+                    if request_id not in in_flight:
+                        continue                # Too late, its clients got TIMEOUT
+                    sent_at, request, envelopes = in_flight.pop(request_id)
+                    if cache is not None:
+                        del in_flight_requests[request]
+                        cache.put(request, reply)
+                    for envelope in envelopes:
+                        frontend.send_multipart(envelope + [reply])
+
+                else:
+                    stats_sock.recv()
+                    stats = dict(cache.stats, entries=len(cache.entries), bytes=cache.size) if cache else {}
+                    stats_sock.send(json.dumps(stats))
+    except zmq.ContextTerminated:
+        for sock in (frontend, backend, stats_sock):
+            if sock is not None:
+                sock.close()
+
+def rep_function(broker_dealer_uri, identifier, work_time):
+    """ A REP socket answering the price of a product. It takes work_time seconds to find it.
+    """
+    rep_sock = context.socket(zmq.REP)
+    rep_sock.connect(broker_dealer_uri)
+    try:
+        while True:
+            product = rep_sock.recv()
+            time.sleep(work_time)
+            rep_sock.send("RepSocket " + str(identifier) + ": " + product + " costs " + str(len(product) * 10))
+    except zmq.ContextTerminated:
+        rep_sock.close()
+
+def req_function(broker_router_uri, identifier, products, verbose=True):
+    """ A client asking the prices of some products.
+    """
+    req_sock = context.socket(zmq.REQ)
+    req_sock.connect(broker_router_uri)
+    for product in products:
+        start = time.time()
+        req_sock.send(product)
+        reply = req_sock.recv()
+        if verbose:
+            print "ReqSocket %d: %s (%.0f ms)" % (identifier, reply, (time.time() - start) * 1000)
+    req_sock.close()
+
+def get_stats(stats_uri):
+    stats_req = context.socket(zmq.REQ)
+    stats_req.connect(stats_uri)
+    stats_req.send("")
+    stats = json.loads(stats_req.recv())
+    stats_req.close()
+    return stats
+
+def bench(cache, suffix):
+    """ 8 clients asking 100 prices each, picked among 20 products, to 2 REP sockets of 5ms.
+    """
+    frontend_uri, backend_uri = "inproc://bench_frontend" + suffix, "inproc://bench_backend" + suffix
+    threading.Thread(target=caching_broker, args=(frontend_uri, backend_uri, cache)).start()
+    for i in range(2):
+        threading.Thread(target=rep_function, args=(backend_uri, i, 0.005)).start()
+    products = ["product-%d" % (i * i % 20) for i in range(100)]
+    clients = [threading.Thread(target=req_function, args=(frontend_uri, i, products, False)) for i in range(8)]
+    start = time.time()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    return 8 * len(products) / (time.time() - start)
+
+if __name__ == "__main__":                          # Start the logic
+
+    context = zmq.Context()
+    context.setsockopt(zmq.LINGER, 0)
+    try:
+        if len(sys.argv) > 1 and sys.argv[1] == "bench":
+            print "%-24s %8.0f requests/sec" % ("without cache", bench(None, "-off"))
+            cache = ResponseCache(max_entries=10, ttl=1.0)
+            print "%-24s %8.0f requests/sec" % ("cache of 10, ttl 1s", bench(cache, "-on"))
+            print json.dumps(cache.stats, sort_keys=True)
+        else:
+            stats_uri = "inproc://caching_broker_stats"
+            cache = ResponseCache(max_entries=2, ttl=1.0)
+            threading.Thread(target=caching_broker,
+                             args=("inproc://broker_frontend", "inproc://broker_backend", cache, stats_uri)).start()
+            for i in range(2):
+                threading.Thread(target=rep_function, args=("inproc://broker_backend", i, 0.2)).start()
+
+            # Three clients asking for the same product at the same time: one goes to a REP socket
+            clients = [threading.Thread(target=req_function, args=("inproc://broker_frontend", i, ["Brawndo"]))
+                       for i in range(3)]
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            # Hits, an eviction of the least recently used, and an expiration
+            req_function("inproc://broker_frontend", 3, ["Brawndo", "Time Machine", "Brawndo", "Tacos", "Brawndo",
+                                                         "Time Machine"])
+            time.sleep(1.0)
+            req_function("inproc://broker_frontend", 3, ["Brawndo"])
+            print json.dumps(get_stats(stats_uri), sort_keys=True)
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        context.term()                                      # End the ZeroMQ context before to leave
@@ -0,0 +1,70 @@
+#!/usr/bin/env python2
+#
+# This example expands the features of the previous Classroom exercise (ClassroomTeacher.py and
+# ClassroomStudent.py). This is the student part of the example, see ClassroomBarrierTeacher.py.
+#
+# A student subscribes to the teacher's channel and waits until a 'probe' arrives: then it knows its
+# SUB socket is receiving, and it checks in sending the probe token to the teacher's ROUTER socket.
+# It doesn't wait for any answer, it just listens to the lesson.
+#
+# Usage: python ClassroomBarrierStudent.py --students 1000
+
+import argparse
+import threading
+import zmq
+
+def ready_to_learn(student_num, verbose):
+    """ Wait for a probe, check in with its token and print the lesson learned.
+    """
+    subscriber = context.socket(zmq.SUB)
+    subscriber.connect("tcp://127.0.0.1:2202")
+    subscriber.setsockopt(zmq.SUBSCRIBE, "")
+
+    kind, body = subscriber.recv_multipart()
+    while kind != "probe":                      # Arrived in the middle of the lesson
+        if body == "END":
+            subscriber.close()
+            return
+        kind, body = subscriber.recv_multipart()
+
+    checkin = context.socket(zmq.DEALER)
+    checkin.setsockopt(zmq.IDENTITY, "Student " + str(student_num))
+    checkin.connect("tcp://127.0.0.1:2201")
+    checkin.send_multipart(["HELLO", body])
+    if verbose:
+        print "Student " + str(student_num) + " checks in"
+
+    while True:
+        kind, lesson = subscriber.recv_multipart()
+        if kind != "lesson":
+            continue
+        if lesson == 'END':
+            break
+        if verbose:
+            print "Student " + str(student_num) + " thoughts : {" + lesson + "}"
+    subscriber.close()
+    checkin.close()
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Students that check in when their SUB socket works")
+    parser.add_argument("--students", type=int, default=3, help="number of students to start")
+    args = parser.parse_args()
+
+    context = zmq.Context()
+    context.set(zmq.MAX_SOCKETS, 2 * args.students + 10)
+    context.setsockopt(zmq.LINGER, 0)
+    try:
+        students = []
+        for i in range(args.students):
+            student = threading.Thread(target=ready_to_learn, args=(i + 1, args.students <= 10))
+            student.daemon = True
+            student.start()
+            students.append(student)
+        for student in students:
+            while student.is_alive():               # join() with a timeout, so Ctrl+C works
+                student.join(1)
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        context.term()                                      # End the ZeroMQ context before to leave
@@ -0,0 +1,102 @@
+#!/usr/bin/env python2
+#
+# This example expands the features of the previous Classroom exercise (ClassroomTeacher.py and
+# ClassroomStudent.py). This is the teacher part of the example.
+#
+# ClassroomTeacher.py waits for its students with a REP socket: recv() the 'hello' of one student,
+# send() the answer, then the next one, up to the hard-coded NUMBER_OF_STUDENTS. With thousands of
+# students those one-by-one handshakes are what delays the lesson, and a single missing student
+# blocks it forever. Besides, a student saying 'hello' doesn't prove its SUB socket is already
+# receiving: it only proves it has connected.
+#
+# Here the teacher uses a readiness barrier:
+#
+#   - The check-ins arrive at a ROUTER socket, which doesn't need to answer one before reading the
+#     next, so all of them are handled as soon as they arrive.
+#   - While waiting, the teacher publishes 'probe' messages with a token. A student only checks in
+#     when one probe has reached its SUB socket, and sends the token back: the teacher knows that
+#     student will receive the lesson.
+#   - The number of students comes from the command line, and the lesson starts when a quorum of
+#     them is ready (95% by default) or when the timeout expires, whatever happens first.
+#
+#           -----------------------------------------------------
+#           -                 teacher                           -
+#           -----------------------------------------------------
+#           -    Pub socket         |       Router socket       -
+#           -----------------------------------------------------
+#                      |                        ^
+#              probe token, then             'HELLO' + probe token
+#                  the lesson                   |
+#                      |                        |
+#           -----------------------------------------------------
+#           -   Sub socket          |      Dealer socket        -
+#           -----------------------------------------------------
+#           -      student (ClassroomBarrierStudent.py)         -
+#           -----------------------------------------------------
+#
+# Usage: python ClassroomBarrierTeacher.py --students 1000 --quorum 0.95 --timeout 30
+
+import argparse
+import os
+import time
+import zmq
+
+PROBE_INTERVAL = 0.1                        # seconds between probes
+
+def wait_for_students(publisher, barrier, number_of_students, quorum, timeout):
+    """ Publish probes and collect check-ins until the quorum is ready or the timeout expires.
+
+        Returns the identities of the students that checked in.
+    """
+    needed = max(1, int(number_of_students * quorum + 0.999999))
+    tokens = set()
+    ready = set()
+    deadline = time.time() + timeout
+    next_probe = time.time()
+    while len(ready) < needed and time.time() < deadline:
+        if time.time() >= next_probe:
+            token = os.urandom(8).encode("hex")
+            tokens.add(token)
+            publisher.send_multipart(["probe", token])
+            next_probe = time.time() + PROBE_INTERVAL
+        if barrier.poll(max(0, min(next_probe, deadline) - time.time()) * 1000):
+            while barrier.poll(0) and len(ready) < needed:   # Take all the check-ins already there
+                identity, hello, token = barrier.recv_multipart()
+                if token in tokens and identity not in ready:
+                    ready.add(identity)
+                    if len(ready) % max(1, number_of_students // 10) == 0:
+                        print str(len(ready)) + " of " + str(number_of_students) + " students ready"
+    return ready
+
+if __name__ == "__main__":                          # Start the logic
+
+    parser = argparse.ArgumentParser(description="Teacher that waits for a quorum of its students")
+    parser.add_argument("--students", type=int, default=3, help="number of students expected")
+    parser.add_argument("--quorum", type=float, default=0.95, help="fraction of students needed to start")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for the quorum")
+    args = parser.parse_args()
+
+    context = zmq.Context()
+    context.setsockopt(zmq.LINGER, 0)
+    publisher = context.socket(zmq.PUB)
+    publisher.setsockopt(zmq.SNDHWM, 0)
+    publisher.bind("tcp://127.0.0.1:2202")
+    barrier = context.socket(zmq.ROUTER)
+    barrier.setsockopt(zmq.RCVHWM, 0)
+    barrier.bind("tcp://127.0.0.1:2201")
+
+    print "Waiting for " + str(int(args.quorum * 100)) + "% of my " + str(args.students) + " students..."
+    start_time = time.time()
+    ready = wait_for_students(publisher, barrier, args.students, args.quorum, args.timeout)
+    print "%d of %d students ready after %.2f seconds. Start the lesson..." % (
+        len(ready), args.students, time.time() - start_time)
+
+    publisher.send_multipart(["lesson", "En un lugar de la Mancha, de cuyo nombre no quiero acordarme, "])
+    publisher.send_multipart(["lesson", " no ha mucho tiempo que vivia un hidalgo de los de lanza en astillero "])
+    publisher.send_multipart(["lesson", " adarga antigua, rocin flaco y galgo corredor. "])
+    publisher.send_multipart(["lesson", "END"])
+    time.sleep(1)
+
+    publisher.close()
+    barrier.close()
+    context.term()                                      # End the ZeroMQ context before to leave
@@ -0,0 +1,257 @@
+#!/usr/bin/env python2
+# BalancedReqRep.py and the Classroom examples send their messages over tcp://127.0.0.1, where
+# bandwidth is free. When the same topologies span several hosts, the bandwidth of the link is often
+# the limit, and sending fewer bytes is worth some CPU.
+#
+# Here the last frame of every message (the body; the envelope and the topic frames stay as they are,
+# so ROUTER and SUB sockets keep working) starts with a one byte header telling how it was compressed:
+#
+#        0         1
+#        +---------+--------------------------------------------+
+#        |  codec  |  body, compressed with the codec           |
+#        +---------+--------------------------------------------+
+#
+#        codec: 0 none, 1 zlib, 2 lzma
+#
+# Every message picks its own codec, so the receiver never has to guess, and peers that compress
+# differently (or not at all) talk to each other without problems.
+#
+# An AdaptiveCompressor picks the codec of every message. It knows the bandwidth of the link and
+# measures, for every codec and payload size, the compression ratio it gets and the CPU it spends.
+# Then it picks the codec that sends the payload sooner: CPU time plus compressed bytes / bandwidth.
+# Small payloads are never compressed, payloads that don't compress (already compressed data,
+# random bytes...) quickly stop being compressed, and every probe_every messages a different codec is
+# tried again, in case the data changed.
+#
+# lzma is in the standard library from python 3.3. In python 2 it needs the backports.lzma package;
+# without it only zlib is used.
+#
+# Running 'python CompressedMessages.py bench' measures throughput versus CPU for different payload
+# sizes and bandwidths.
+
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+import zmq
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None                         # Optional, only zlib is used without it
+
+NONE = "\x00"
+ZLIB = "\x01"
+LZMA = "\x02"
+CODEC_NAMES = {NONE: "none", ZLIB: "zlib", LZMA: "lzma"}
+COMPRESSORS = {ZLIB: lambda data: zlib.compress(data, 1)}
+DECOMPRESSORS = {ZLIB: zlib.decompress}
+if lzma is not None:
+    COMPRESSORS[LZMA] = lambda data: lzma.compress(data, preset=0)
+    DECOMPRESSORS[LZMA] = lzma.decompress
+
+def encode(codec, data):
+    """ Compress data with the codec and put the header in front.
+    """
+    if codec == NONE:
+        return NONE + data
+    return codec + COMPRESSORS[codec](data)
+
+def decode(frame):
+    """ Read the header of a frame and return its data, uncompressed.
+    """
+    if not frame:
+        raise ValueError("empty frame, missing the codec header")
+    codec = frame[0]
+    if codec == NONE:
+        return frame[1:]
+    if codec not in DECOMPRESSORS:
+        raise ValueError("unsupported codec " + CODEC_NAMES.get(codec, repr(codec)))
+    return DECOMPRESSORS[codec](frame[1:])
+
+class AdaptiveCompressor(object):
+    """ Picks, for every payload, the codec that sends it sooner through the link.
+
+        bandwidth:   bytes per second of the link. None never compresses, for inproc:// and ipc://.
+        min_size:    payloads smaller than this are never compressed.
+        probe_every: every these many payloads of a size, a codec other than the best is measured again.
+    """
+    ALPHA = 0.2                             # weight of the latest measure in the averages
+
+    def __init__(self, bandwidth, min_size=512, probe_every=100):
+        self.bandwidth = bandwidth
+        self.min_size = min_size
+        self.probe_every = probe_every
+        self.codecs = sorted(COMPRESSORS)
+        self.estimates = {}                 # (codec, size class) -> [ratio, CPU seconds per byte]
+        self.messages = {}                  # size class -> payloads seen
+        self.stats = dict.fromkeys(CODEC_NAMES.values(), 0)
+        self.stats.update(bytes_in=0, bytes_out=0)
+
+    def choose(self, size):
+        if self.bandwidth is None or size < self.min_size:
+            return NONE
+        size_class = size.bit_length()      # Payloads within a power of two compress alike
+        seen = self.messages[size_class] = self.messages.get(size_class, 0) + 1
+        best, best_cost = NONE, float(size) / self.bandwidth
+        for codec in self.codecs:
+            estimate = self.estimates.get((codec, size_class))
+            if estimate is None:
+                return codec                # Never measured: measure it now
+            cost = size * estimate[1] + size * estimate[0] / self.bandwidth
+            if cost < best_cost:
+                best, best_cost = codec, cost
+        if seen % self.probe_every == 0:
+            candidates = [codec for codec in self.codecs if codec != best]
+            if candidates:
+                return candidates[seen // self.probe_every % len(candidates)]
+        return best
+
+    def compress(self, data):
+        """ Return the frame to send: the header and the data, compressed or not.
+        """
+        codec = self.choose(len(data))
+        frame = None
+        if codec != NONE:
+            start = time.time()
+            body = COMPRESSORS[codec](data)
+            ratio, cpu = float(len(body)) / len(data), (time.time() - start) / len(data)
+            key = (codec, len(data).bit_length())
+            estimate = self.estimates.get(key)
+            if estimate is None:
+                self.estimates[key] = [ratio, cpu]
+            else:
+                estimate[0] = estimate[0] + self.ALPHA * (ratio - estimate[0])
+                estimate[1] = estimate[1] + self.ALPHA * (cpu - estimate[1])
+            if len(body) < len(data):
+                frame = codec + body
+        if frame is None:
+            codec, frame = NONE, NONE + data
+        self.stats[CODEC_NAMES[codec]] = self.stats[CODEC_NAMES[codec]] + 1
+        self.stats["bytes_in"] = self.stats["bytes_in"] + len(data)
+        self.stats["bytes_out"] = self.stats["bytes_out"] + len(frame)
+        return frame
+
+class CompressedSocket(object):
+    """ A socket that compresses the last frame of the messages it sends and decompresses the
+        last frame of the messages it receives.
+    """
+    def __init__(self, sock, compressor):
+        self.sock = sock
+        self.compressor = compressor
+
+    def send(self, data, flags=0):
+        self.sock.send(self.compressor.compress(data), flags)
+
+    def recv(self, flags=0):
+        return decode(self.sock.recv(flags))
+
+    def send_multipart(self, frames, flags=0):
+        self.sock.send_multipart(frames[:-1] + [self.compressor.compress(frames[-1])], flags)
+
+    def recv_multipart(self, flags=0):
+        frames = self.sock.recv_multipart(flags)
+        frames[-1] = decode(frames[-1])
+        return frames
+
+    def close(self):
+        self.sock.close()
+
+def compressed_socket(sock, endpoint, bandwidth=10e6):
+    """ Wrap a socket, compressing only if the endpoint is tcp://.
+    """
+    return CompressedSocket(sock, AdaptiveCompressor(bandwidth if endpoint.startswith("tcp://") else None))
+
+def log_lines(size):
+    """ A payload that compresses like the real ones: log lines with some random numbers.
+    """
+    rnd = random.Random(size)
+    lines = []
+    total = 0
+    while total < size:
+        line = "%s INFO worker-%d served request %d in %.3f ms\n" % (
+            time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(rnd.randint(0, 2 ** 30))),
+            rnd.randint(0, 16), rnd.randint(0, 10 ** 6), rnd.random() * 100)
+        lines.append(line)
+        total = total + len(line)
+    return "".join(lines)[:size]
+
+def req_function(ports, payloads):
+    """ The req_function of BalancedReqRep.py, sending bigger messages.
+    """
+    req_sock = context.socket(zmq.REQ)
+    for port in ports:
+        req_sock.connect("tcp://127.0.0.1:" + str(port))
+    req_sock = compressed_socket(req_sock, "tcp://127.0.0.1", bandwidth=1e6)
+    for name, payload in payloads:
+        req_sock.send(payload)
+        print "ReqSocket sent " + name + ": " + req_sock.recv()
+    print "ReqSocket: " + str(req_sock.compressor.stats)
+    req_sock.close()
+
+def rep_function(identifier, port):
+    """ The rep_function of BalancedReqRep.py. The REP sockets don't know how the request was sent.
+    """
+    rep_sock = context.socket(zmq.REP)
+    endpoint = "tcp://127.0.0.1:" + str(port)
+    rep_sock.bind(endpoint)
+    rep_sock = compressed_socket(rep_sock, endpoint)
+    try:
+        while True:
+            message = rep_sock.recv()
+            rep_sock.send("RepSocket " + str(identifier) + " says: Polo! (" + str(len(message)) + " bytes)")
+    except zmq.ContextTerminated:
+        rep_sock.close()
+
+def bench(bandwidth, size, times):
+    """ Compress and decompress times payloads and return, for every codec and the adaptive one,
+        the CPU per message, the ratio and the throughput through a link of the bandwidth.
+    """
+    payload = log_lines(size)
+    results = []
+    modes = [(CODEC_NAMES[codec], codec) for codec in [NONE] + sorted(COMPRESSORS)] + [("adaptive", None)]
+    for name, codec in modes:
+        compressor = AdaptiveCompressor(bandwidth)
+        wire_bytes = 0
+        start = time.time()
+        for i in range(times):
+            frame = encode(codec, payload) if codec is not None else compressor.compress(payload)
+            decode(frame)
+            wire_bytes = wire_bytes + len(frame)
+        cpu = time.time() - start
+        throughput = times * size / (cpu + wire_bytes / bandwidth)
+        results.append((name, cpu / times, float(wire_bytes) / (times * size), throughput))
+    return results
+
+if __name__ == "__main__":                          # Start the logic
+
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        if lzma is None:
+            print "lzma not available, install backports.lzma to try it"
+        print "%-12s %9s %-9s %12s %8s %12s" % ("bandwidth", "payload", "codec", "CPU us/msg", "ratio", "MB/s")
+        for bandwidth in [1e6, 100e6, 10e9]:
+            for size in [128, 1024, 16384, 262144]:
+                times = max(20, 2 ** 22 // size)
+                for name, cpu, ratio, throughput in bench(bandwidth, size, times):
+                    print "%-12s %9d %-9s %12.1f %8.2f %12.1f" % ("%g MB/s" % (bandwidth / 1e6), size, name,
+                                                                  cpu * 1e6, ratio, throughput / 1e6)
+        sys.exit(0)
+
+    context = zmq.Context()
+    context.setsockopt(zmq.LINGER, 0)
+    try:
+        ports = [2211, 2212, 2213]
+        for identifier, port in enumerate(ports):
+            threading.Thread(target=rep_function, args=(identifier, port)).start()
+        payloads = [("a small greeting", "Marco...")] * 2 + [("20KB of logs", log_lines(20000))] * 3 + \
+                   [("20KB of random bytes", os.urandom(20000))] * 3
+        req_function(ports, payloads)
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        context.term()                                      # End the ZeroMQ context before to leave
@@ -0,0 +1,177 @@
+#!/usr/bin/env python2
+# This example expands the features of the previous PubSub exercise.
+#
+# When a sub_function of PubSub.py is slower than the pub_function, its queue grows until the
+# high-water mark, and then the new messages are dropped without telling anyone. The slow subscriber
+# keeps reading old messages while the fresh ones are lost. For topics like prices, where only the
+# latest value matters, it's exactly the wrong way round.
+#
+# ZeroMQ has the ZMQ_CONFLATE option, but it keeps a single message per socket, whatever its topic,
+# and doesn't work with multipart messages. Here we put a conflating proxy between the publisher and
+# the subscribers:
+#
+#   - the proxy reads everything the publisher sends, as fast as it arrives,
+#   - for every subscriber it keeps at most one pending message per topic: a newer message of the
+#     same topic replaces the pending one, which is counted as conflated,
+#   - a subscriber asks for the next message when it's ready for it (NEXT), so the messages wait in
+#     the proxy, where they are conflated, instead of in the socket queues.
+#
+# Memory is bounded by subscribers x topics, and a slow subscriber always gets the freshest value.
+# Every message carries how many older messages of its topic it replaced.
+#
+#                          pub_sock
+#                              |               [topic | body]
+#                       frontend (SUB)
+#                     conflating proxy         subscriber -> topic -> latest body
+#                      backend (ROUTER)
+#                         /       \            <- SUBSCRIBE prefix, NEXT
+#               dealer_sock       dealer_sock  -> [topic | body | conflated]
+#                  (fast)           (slow)
+#
+
+import collections
+import json
+import struct
+import threading
+import time
+import zmq
+
+FRONTEND_URI = "inproc://conflating_frontend"
+BACKEND_URI = "inproc://conflating_backend"
+COUNT = struct.Struct("!I")
+
+class Subscriber(object):
+    """ What the proxy knows about a subscriber.
+    """
+    def __init__(self):
+        self.prefixes = []
+        self.pending = collections.OrderedDict()     # topic -> [body, conflated], oldest first
+        self.ready = False                           # It asked for a message we didn't have
+        self.stats = {"sent": 0, "conflated": 0}
+
+    def wants(self, topic):
+        return any(topic.startswith(prefix) for prefix in self.prefixes)
+
+def conflating_proxy(frontend_uri, backend_uri):
+    """ Definition of the conflating proxy.
+    """
+    frontend = context.socket(zmq.SUB)
+    frontend.setsockopt(zmq.SUBSCRIBE, "")
+    frontend.bind(frontend_uri)
+    backend = context.socket(zmq.ROUTER)
+    backend.bind(backend_uri)
+    poller = zmq.Poller()
+    poller.register(frontend, zmq.POLLIN)
+    poller.register(backend, zmq.POLLIN)
+    subscribers = {}                                 # identity -> Subscriber
+
+    def send_next(identity, subscriber):
+        topic, (body, conflated) = subscriber.pending.popitem(last=False)
+        backend.send_multipart([identity, topic, body, COUNT.pack(conflated)])
+        subscriber.ready = False
+        subscriber.stats["sent"] = subscriber.stats["sent"] + 1
+
+    try:
+        while True:
+            events = dict(poller.poll())
+            if events.get(frontend) == zmq.POLLIN:
+                topic, body = frontend.recv_multipart()
+                for identity, subscriber in subscribers.items():
+                    if not subscriber.wants(topic):
+                        continue
+                    pending = subscriber.pending.get(topic)
+                    if pending is None:
+                        subscriber.pending[topic] = [body, 0]
+                    else:                            # Keep its place in the queue, with the new body
+                        pending[0] = body
+                        pending[1] = pending[1] + 1
+                        subscriber.stats["conflated"] = subscriber.stats["conflated"] + 1
+                    if subscriber.ready:
+                        send_next(identity, subscriber)
+
+            if events.get(backend) == zmq.POLLIN:
+                frames = backend.recv_multipart()
+                identity, command = frames[0], frames[1]
+                subscriber = subscribers.setdefault(identity, Subscriber())
+                if command == "SUBSCRIBE":
+                    subscriber.prefixes.append(frames[2])
+                elif command == "NEXT":
+                    if subscriber.pending:
+                        send_next(identity, subscriber)
+                    else:
+                        subscriber.ready = True
+                elif command == "STATS":
+                    backend.send_multipart([identity, "STATS", json.dumps(subscriber.stats)])
+                elif command == "BYE":
+                    del subscribers[identity]
+    except zmq.ContextTerminated:
+        frontend.close()
+        backend.close()
+
+class ConflatedSubscriber(object):
+    """ The subscriber side of the conflating proxy.
+    """
+    def __init__(self, context, backend_uri, prefixes):
+        self.dealer_sock = context.socket(zmq.DEALER)
+        self.dealer_sock.connect(backend_uri)
+        for prefix in prefixes:
+            self.dealer_sock.send_multipart(["SUBSCRIBE", prefix])
+
+    def recv(self):
+        """ Ask for the next message and return its topic, body and how many older messages it replaced.
+        """
+        self.dealer_sock.send("NEXT")
+        topic, body, conflated = self.dealer_sock.recv_multipart()
+        return topic, body, COUNT.unpack(conflated)[0]
+
+    def stats(self):
+        """ Return the counters the proxy keeps for this subscriber, as a dictionary.
+        """
+        self.dealer_sock.send("STATS")
+        return json.loads(self.dealer_sock.recv_multipart()[1])
+
+    def close(self):
+        self.dealer_sock.send("BYE")
+        self.dealer_sock.close()
+
+def pub_function(frontend_uri, ticks):
+    """ A fast publisher: the price of three products, a thousand times per second.
+    """
+    pub_sock = context.socket(zmq.PUB)
+    pub_sock.connect(frontend_uri)
+    time.sleep(0.1)
+    for tick in range(ticks):
+        for product, base in [("Brawndo", 10), ("Time Machine", 1000), ("Tacos", 2)]:
+            pub_sock.send_multipart(["price/" + product, "%.2f @ tick %d" % (base + tick % 7 * 0.01, tick)])
+        time.sleep(0.001)
+    pub_sock.close()
+
+def sub_function(num, backend_uri, subs_message, times, work_time):
+    """ A subscriber that takes work_time seconds with every message.
+    """
+    subscriber = ConflatedSubscriber(context, backend_uri, [subs_message])
+    for i in range(times):
+        topic, body, conflated = subscriber.recv()
+        print "S%d: %s %s (%d older values skipped)" % (num, topic, body, conflated)
+        time.sleep(work_time)
+    print "S" + str(num) + ": " + json.dumps(subscriber.stats(), sort_keys=True)
+    subscriber.close()
+
+if __name__ == "__main__":                          # Start the logic
+
+    context = zmq.Context()
+    context.setsockopt(zmq.LINGER, 0)
+    try:
+        threading.Thread(target=conflating_proxy, args=(FRONTEND_URI, BACKEND_URI)).start()
+        subscribers = [threading.Thread(target=sub_function, args=(0, BACKEND_URI, "price/Brawndo", 5, 0)),
+                       threading.Thread(target=sub_function, args=(1, BACKEND_URI, "price/", 9, 0.2))]
+        for subscriber in subscribers:
+            subscriber.start()
+        time.sleep(0.1)
+        pub_function(FRONTEND_URI, 2000)
+        for subscriber in subscribers:
+            subscriber.join()
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        context.term()                                      # End the ZeroMQ context before to leave
@@ -0,0 +1,148 @@
+#!/usr/bin/env python2
+# This example expands the features of the previous PushPull exercise.
+#
+# In PushPull.py the push socket sleeps one second after every message. Without that sleep all the
+# messages go to Pull0: a PUSH socket fills the pipe of the first connected PULL socket before the
+# others are even connected, and it never asks if the pull socket is busy. That's not good when we
+# need to dispatch thousands of tasks per second.
+#
+# Here we replace the blind PUSH with credit-based flow control:
+#
+#   - Every puller advertises how many tasks it is able to take (its credit window).
+#   - The pusher only sends a task to a puller that has credit left, rotating between all of them,
+#     so the load is evenly spread.
+#   - When a puller has processed a part of its window it gives the credit back to the pusher.
+#
+# A PUSH socket can't know who is at the other side, so the pusher is a ROUTER socket and the
+# pullers are DEALER sockets. The ROUTER sees the identity of every puller and can address it.
+#
+#                            push_sock (ROUTER)
+#                           /        |        \
+#                     tasks/    credit|tasks    \credit
+#                         /          |          \
+#             pull_sock (DEALER)  pull_sock ...  pull_sock (DEALER)
+#
+# The pusher never sleeps: it sends as fast as the pullers give credit back, so the throughput grows
+# with the number of pullers instead of being capped at one message per second.
+
+import collections
+import threading
+import time
+import zmq
+
+PUSH_PULL_URI = "inproc://credit-push-pull"
+CREDIT_WINDOW = 10                          # tasks every puller is able to hold
+WORK_TIME = 0.001                           # seconds every task takes to be processed
+
+def pull_function(num, window, processed):
+    """ Definition of the pull socket.
+
+        It advertises its credit window, processes the tasks it receives and gives the credit
+        back every half window, so the pusher is never waiting for a single task.
+    """
+    pull_sock = context.socket(zmq.DEALER)
+    pull_sock.setsockopt(zmq.IDENTITY, "Pull" + str(num))
+    pull_sock.connect(PUSH_PULL_URI)
+    pull_sock.send(str(window))                 # The first credit is the whole window
+
+    returned_every = max(1, window // 2)
+    pending_credit = 0
+    processed[num] = 0
+    message = pull_sock.recv()
+    while message != "END":
+        time.sleep(WORK_TIME)                   # Process the task
+        processed[num] = processed[num] + 1
+        pending_credit = pending_credit + 1
+        if pending_credit >= returned_every:    # Give the credit back
+            pull_sock.send(str(pending_credit))
+            pending_credit = 0
+        message = pull_sock.recv()
+    pull_sock.send("DONE")                      # The pusher must not leave before reading our credit
+    pull_sock.close()
+
+def push_function(number_of_pullers, number_of_tasks, elapsed):
+    """ Definition of the function that executes the push socket.
+
+        It waits for all the pullers to advertise their credit and then sends the
+        'N Potato' tasks at full speed, only to the pullers with credit left.
+    """
+    push_sock = context.socket(zmq.ROUTER)
+    push_sock.bind(PUSH_PULL_URI)
+
+    credit = {}                                 # puller identity -> tasks it can still take
+    ready = collections.deque()                 # pullers with credit, in the order they will get tasks
+
+    def receive_credit(flags):
+        """ Read the credit messages waiting in the socket. Returns False if there were none.
+        """
+        try:
+            identity, amount = push_sock.recv_multipart(flags)
+        except zmq.Again:
+            return False
+        if credit.get(identity, 0) == 0:
+            ready.append(identity)
+        credit[identity] = credit.get(identity, 0) + int(amount)
+        return True
+
+    while len(credit) < number_of_pullers:       # Don't start until every puller is connected
+        receive_credit(0)
+
+    start_time = time.time()
+    sent = 0
+    while sent < number_of_tasks:
+        if not ready:                           # Nobody has credit, wait for some
+            receive_credit(0)
+        while receive_credit(zmq.NOBLOCK):      # Take all the credit already returned
+            pass
+        while ready and sent < number_of_tasks:
+            identity = ready.popleft()
+            push_sock.send_multipart([identity, str(sent + 1) + " Potato"])
+            sent = sent + 1
+            credit[identity] = credit[identity] - 1
+            if credit[identity] > 0:
+                ready.append(identity)          # Back to the end of the line
+
+    for identity in credit:                     # The tasks are queued before the END in every pipe
+        push_sock.send_multipart([identity, "END"])
+    finished = 0
+    while finished < number_of_pullers:         # Wait until every puller has processed its tasks
+        identity, message = push_sock.recv_multipart()
+        if message == "DONE":
+            finished = finished + 1
+    elapsed.append(time.time() - start_time)
+    push_sock.close()
+
+def run(number_of_pullers, number_of_tasks):
+    """ Run the pusher and the pullers until all the tasks are processed.
+    """
+    processed = {}
+    elapsed = []
+    threads = [threading.Thread(target=push_function, args=(number_of_pullers, number_of_tasks, elapsed))]
+    for i in range(number_of_pullers):
+        threads.append(threading.Thread(target=pull_function, args=(i, CREDIT_WINDOW, processed)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return processed, elapsed[0]
+
+if __name__ == "__main__":                          # Start the logic
+
+    context = zmq.Context()
+    try:
+        # The same 7 potatoes of PushPull.py, now without any sleep
+        processed, elapsed = run(2, 7)
+        for num in sorted(processed):
+            print "Pull" + str(num) + ": processed " + str(processed[num]) + " potatoes"
+
+        # Every task takes 1ms, so a single puller is capped at ~1000 tasks per second.
+        # Adding pullers multiplies the throughput.
+        for number_of_pullers in [1, 2, 4, 8]:
+            processed, elapsed = run(number_of_pullers, 2000)
+            print "%d pullers: %6.0f tasks/sec, tasks per puller %s" % (
+                number_of_pullers, sum(processed.values()) / elapsed,
+                [processed[num] for num in sorted(processed)])
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        context.term()                                      # End the ZeroMQ context before to leave
@@ -0,0 +1,241 @@
+#!/usr/bin/env python2
+# This example expands the features of the previous PubSub and ClassroomTeacher exercises.
+#
+# PubSub.py and ClassroomTeacher.py have a single publisher, and the subscribers connect to it. With
+# many publishers and thousands of subscribers, every subscriber would connect to every publisher:
+# N x M connections, and every new publisher has to be announced to all of them.
+#
+# Here publishers and subscribers only connect to a tier of forwarders:
+#
+#   - a forwarder is the builtin proxy between an XSUB socket, where the publishers connect, and an
+#     XPUB socket, where the subscribers connect. The XPUB socket reads the subscriptions and the XSUB
+#     socket sends them upstream, so the PUB sockets still filter: a message nobody subscribed to
+#     never leaves its publisher,
+#   - the tier runs several forwarders, each one in its own process, and each one owns a subset of
+#     the topics: the channel of a topic (what goes before the first '/') is placed on a forwarder
+#     with the consistent hashing of ShardedBroker.py,
+#   - publishers and subscribers use that same hash to pick the forwarder of every topic, so the
+#     traffic of a channel only goes through its forwarder, and the fan-out work is spread over the
+#     processes, and the cores.
+#
+#          publisher      publisher      publisher          (a PUB socket per forwarder)
+#              |  \        /     \        /   |
+#          XSUB 0 (lesson, prices)    XSUB 1 (gossip)       <-- subscriptions go upstream
+#           forwarder 0 (process)     forwarder 1 (process)
+#          XPUB 0                     XPUB 1
+#              |  \        /     \        /   |
+#          subscriber     subscriber     subscriber         (a SUB socket per forwarder they need)
+#
+# All the subscriptions must name a channel: 'prices/' or 'prices/Brawndo', never just 'pri'.
+#
+# Running 'python ForwarderTier.py bench' measures the messages delivered per second with 1, 2, 4...
+# forwarders, up to the number of cores.
+
+import multiprocessing
+import sys
+import threading
+import time
+import zmq
+
+from ShardedBroker import HashRing
+
+FRONTEND_URI = "ipc:///tmp/zmq-forwarder-xsub-%d"
+BACKEND_URI = "ipc:///tmp/zmq-forwarder-xpub-%d"
+
+def channel(topic):
+    return topic.split("/", 1)[0]
+
+def forwarder_process(num, forwarded=None):
+    """ Definition of a forwarder. forwarded, a multiprocessing.Value, counts the messages it forwards.
+    """
+    context = zmq.Context()                 # Never use the context of the parent process
+    context.setsockopt(zmq.LINGER, 0)
+    frontend = context.socket(zmq.XSUB)
+    frontend.setsockopt(zmq.RCVHWM, 0)
+    frontend.bind(FRONTEND_URI % num)
+    backend = context.socket(zmq.XPUB)
+    backend.setsockopt(zmq.SNDHWM, 0)
+    backend.bind(BACKEND_URI % num)
+    capture = None
+    if forwarded is not None:               # Count through the capture socket of the proxy
+        capture = context.socket(zmq.PAIR)
+        capture.bind("inproc://capture")
+        counter = context.socket(zmq.PAIR)
+        counter.connect("inproc://capture")
+        threading.Thread(target=count_messages, args=(counter, forwarded)).start()
+    try:
+        zmq.proxy(frontend, backend, capture)
+    except (KeyboardInterrupt, zmq.ContextTerminated):
+        pass
+
+def count_messages(counter, forwarded):
+    """ The capture socket gets both directions: [topic, body] messages and single frame subscriptions.
+    """
+    while True:
+        if len(counter.recv_multipart()) > 1:
+            forwarded.value = forwarded.value + 1
+
+class ForwarderTier(object):
+    """ Starts size forwarder processes.
+    """
+    def __init__(self, size, count=False):
+        self.counters = [multiprocessing.Value("l", 0) if count else None for i in range(size)]
+        self.processes = [multiprocessing.Process(target=forwarder_process, args=(i, self.counters[i]))
+                          for i in range(size)]
+
+    def start(self):
+        for process in self.processes:
+            process.daemon = True
+            process.start()
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+            process.join()
+
+class TierPublisher(object):
+    """ A PUB socket per forwarder. Every message goes to the forwarder of its channel.
+    """
+    def __init__(self, context, size):
+        self.ring = HashRing(range(size))
+        self.sockets = []
+        for num in range(size):
+            pub_sock = context.socket(zmq.PUB)
+            pub_sock.setsockopt(zmq.SNDHWM, 0)
+            pub_sock.connect(FRONTEND_URI % num)
+            self.sockets.append(pub_sock)
+
+    def publish(self, topic, body):
+        self.sockets[self.ring.shard_for(channel(topic))].send_multipart([topic, body])
+
+    def close(self):
+        for pub_sock in self.sockets:
+            pub_sock.close()
+
+class TierSubscriber(object):
+    """ A SUB socket per forwarder it needs, created with the first subscription to one of its channels.
+    """
+    def __init__(self, context, size):
+        self.context = context
+        self.ring = HashRing(range(size))
+        self.sockets = {}                   # forwarder -> SUB socket
+        self.poller = zmq.Poller()
+
+    def subscribe(self, prefix):
+        num = self.ring.shard_for(channel(prefix))
+        sub_sock = self.sockets.get(num)
+        if sub_sock is None:
+            sub_sock = self.sockets[num] = self.context.socket(zmq.SUB)
+            sub_sock.setsockopt(zmq.RCVHWM, 0)
+            sub_sock.connect(BACKEND_URI % num)
+            self.poller.register(sub_sock, zmq.POLLIN)
+        sub_sock.setsockopt(zmq.SUBSCRIBE, prefix)
+
+    def recv(self, timeout=None):
+        """ Return the next [topic, body], or None if nothing arrives in timeout milliseconds.
+        """
+        for sub_sock, event in self.poller.poll(timeout):
+            return sub_sock.recv_multipart()
+        return None
+
+    def close(self):
+        for sub_sock in self.sockets.values():
+            sub_sock.close()
+
+def bench_publisher(size, messages, channels):
+    context = zmq.Context()
+    publisher = TierPublisher(context, size)
+    time.sleep(1)                           # Let the subscriptions go upstream
+    for i in range(messages):
+        publisher.publish("channel%d/tick" % (i % channels), "x" * 64)
+    publisher.close()
+    context.term()
+
+def bench_subscriber(size, expected, channels, results):
+    context = zmq.Context()
+    context.setsockopt(zmq.LINGER, 0)
+    subscriber = TierSubscriber(context, size)
+    for i in range(channels):
+        subscriber.subscribe("channel%d/" % i)
+    received = 0
+    first = last = None
+    while received < expected:
+        if subscriber.recv(2000) is None:   # Nothing more is coming
+            break
+        last = time.time()
+        if first is None:
+            first = last
+        received = received + 1
+    results.put((received, first, last))
+    subscriber.close()
+    context.term()
+
+def bench(size, publishers, subscribers, messages, channels=64):
+    """ Messages delivered per second: every subscriber wants every channel of every publisher.
+    """
+    tier = ForwarderTier(size)
+    tier.start()
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=bench_subscriber,
+                                         args=(size, publishers * messages, channels, results))
+                 for i in range(subscribers)]
+    processes += [multiprocessing.Process(target=bench_publisher, args=(size, messages, channels))
+                  for i in range(publishers)]
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for i in range(subscribers)]
+    for process in processes:
+        process.join()
+    tier.stop()
+    delivered = sum(received for received, first, last in outcomes)
+    elapsed = max(last for received, first, last in outcomes) - min(first for received, first, last in outcomes)
+    return delivered, delivered / elapsed
+
+if __name__ == "__main__":                          # Start the logic
+
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        cores = multiprocessing.cpu_count()
+        print "Machine with " + str(cores) + " cores"
+        size = 1
+        while size <= max(cores, 2):
+            delivered, throughput = bench(size, 2, 4, 20000)
+            print "%2d forwarders: %7d messages delivered, %9.0f msgs/sec" % (size, delivered, throughput)
+            size = size * 2
+        sys.exit(0)
+
+    tier = ForwarderTier(2, count=True)
+    tier.start()
+    context = zmq.Context()
+    context.setsockopt(zmq.LINGER, 0)
+    try:
+        ring = HashRing(range(2))
+        for name in ["lesson", "prices", "gossip"]:
+            print "Channel " + name + " is owned by forwarder " + str(ring.shard_for(name))
+        students = []
+        for prefix in ["lesson/", "lesson/", "prices/Brawndo"]:
+            student = TierSubscriber(context, 2)
+            student.subscribe(prefix)
+            students.append((prefix, student))
+        teachers = [TierPublisher(context, 2) for i in range(3)]
+        time.sleep(1)                               # Let the subscriptions go upstream
+
+        for i, teacher in enumerate(teachers):
+            teacher.publish("lesson/%d" % i, "Teacher " + str(i) + ": En un lugar de la Mancha...")
+            teacher.publish("prices/Brawndo", "Teacher " + str(i) + ": Brawndo costs " + str(10 + i))
+            teacher.publish("prices/Tacos", "Teacher " + str(i) + ": Tacos cost 2")      # Nobody wants it
+            teacher.publish("gossip/today", "Teacher " + str(i) + ": did you hear...")   # Nobody wants it
+        for num, (prefix, student) in enumerate(students):
+            message = student.recv(500)
+            while message is not None:
+                print "Student " + str(num) + " (" + prefix + "): " + message[0] + " " + message[1]
+                message = student.recv(500)
+            student.close()
+        for teacher in teachers:
+            teacher.close()
+        for num, counter in enumerate(tier.counters):
+            print "Forwarder " + str(num) + " forwarded " + str(counter.value) + " messages"
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        context.term()                                      # End the ZeroMQ context before to leave
+        tier.stop()
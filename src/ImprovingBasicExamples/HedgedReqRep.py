@@ -0,0 +1,248 @@
+#!/usr/bin/env python2
+# This example expands the features of the previous BalancedReqRep exercise.
+#
+# In BalancedReqRep.py a single REQ socket is connected to three REP sockets and blocks on recv()
+# until the reply arrives. If the REP socket that got the request stalls, the client stalls with it,
+# and if the REP socket dies, the client waits forever.
+#
+# Here we write a client that protects itself with two tricks:
+#
+#   - Deadlines: every request has a timeout. When it expires the client gives up and returns None.
+#   - Hedged requests: if the reply takes longer than what most of the replies take (a configurable
+#     percentile of the latest latencies), the client sends a backup copy of the request to another
+#     REP socket, and one more every time that delay passes again. The first reply wins and the
+#     duplicates are discarded when they arrive.
+#
+# The percentile only means something if the latencies are the ones of the primary requests, measured
+# from when they were sent: a backup that wins doesn't make its primary fast, and a request that times
+# out counts at the timeout. Hedging also adds load, so a budget keeps the backups under 5% of the
+# requests, and the backups go to the REP socket with fewer unanswered copies, never to the one that
+# already has the request.
+#
+# A REQ socket can't do this: it only allows one outstanding request. So the client uses one DEALER
+# socket per REP socket. The DEALER puts the request id in front of the empty delimiter frame; the REP
+# socket sees it as an envelope and sends it back untouched, so the client knows which request every
+# reply belongs to.
+#
+#                             hedged client
+#                  dealer_sock  dealer_sock  dealer_sock
+#                       |            |            |
+#                   rep_sock     rep_sock     rep_sock
+#                                (stalls)     (dies)
+#
+
+import collections
+import threading
+import time
+import zmq
+
+class HedgedClient(object):
+    """ Request client that sends a backup request when the reply is late.
+
+        endpoints:        URIs of the REP sockets.
+        timeout:          seconds a request can last before giving up on it.
+        hedge_percentile: fraction of the latest latencies the reply may exceed before hedging,
+                          None to never send a backup request.
+    """
+    INITIAL_HEDGE_DELAY = 0.05              # seconds, used until we have enough latencies
+    MIN_HEDGE_DELAY = 0.002                 # seconds, never hedge sooner than this
+    MIN_SAMPLES = 20
+    WINDOW = 200                            # latencies used to compute the percentile
+    HEDGE_BUDGET = 0.05                     # backup requests per request, at most
+    MAX_HEDGE_TOKENS = 5                    # backup requests that can be sent in a row
+
+    def __init__(self, context, endpoints, timeout=1.0, hedge_percentile=0.95):
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.sockets = []
+        self.poller = zmq.Poller()
+        for endpoint in endpoints:
+            dealer_sock = context.socket(zmq.DEALER)
+            dealer_sock.setsockopt(zmq.LINGER, 0)
+            dealer_sock.setsockopt(zmq.IMMEDIATE, 1)    # Don't queue requests for a dead REP socket
+            dealer_sock.connect(endpoint)
+            self.sockets.append(dealer_sock)
+            self.poller.register(dealer_sock, zmq.POLLIN)
+        self.outstanding = dict((dealer_sock, 0) for dealer_sock in self.sockets)  # copies without reply
+        self.latencies = collections.deque(maxlen=self.WINDOW)
+        self.late_primaries = {}            # request id -> (socket, sent at) of primaries that lost
+        self.hedge_tokens = self.MAX_HEDGE_TOKENS
+        self.sequence = 0
+        self.next_socket = 0
+        self.stats = {"requests": 0, "hedged": 0, "backup_wins": 0, "timeouts": 0, "discarded": 0,
+                      "hedges_denied": 0}
+
+    def hedge_delay(self):
+        """ Seconds to wait before sending the backup request.
+        """
+        if len(self.latencies) < self.MIN_SAMPLES:
+            return self.INITIAL_HEDGE_DELAY
+        latencies = sorted(self.latencies)
+        return max(self.MIN_HEDGE_DELAY,
+                   latencies[min(len(latencies) - 1, int(self.hedge_percentile * len(latencies)))])
+
+    def send(self, dealer_sock, frames):
+        try:
+            dealer_sock.send_multipart(frames, zmq.NOBLOCK)
+        except zmq.Again:                                # Not connected
+            return False
+        self.outstanding[dealer_sock] = self.outstanding[dealer_sock] + 1
+        return True
+
+    def send_primary(self, frames):
+        """ Send the request to the next REP socket that accepts it. Returns the socket or None.
+
+            Round robin, but the sockets still busy with the losers of hedged requests go last.
+        """
+        order = self.sockets[self.next_socket:] + self.sockets[:self.next_socket]
+        self.next_socket = (self.next_socket + 1) % len(self.sockets)
+        for dealer_sock in sorted(order, key=lambda dealer_sock: self.outstanding[dealer_sock] > 0):
+            if self.send(dealer_sock, frames):
+                return dealer_sock
+        return None
+
+    def send_backup(self, frames, exclude):
+        """ Send a copy of the request to the least loaded REP socket that doesn't have one yet.
+
+            A socket still busy with older copies would answer the backup late too. Returns the
+            socket or None if no socket took it.
+        """
+        candidates = [dealer_sock for dealer_sock in self.sockets if dealer_sock not in exclude]
+        for dealer_sock in sorted(candidates, key=lambda dealer_sock: self.outstanding[dealer_sock]):
+            if self.send(dealer_sock, frames):
+                return dealer_sock
+        return None
+
+    def record_late_reply(self, dealer_sock, request_id):
+        """ The latency of a primary that lost still tells how fast its REP socket is.
+        """
+        late = self.late_primaries.get(request_id)
+        if late is not None and late[0] is dealer_sock:
+            del self.late_primaries[request_id]
+            self.latencies.append(time.time() - late[1])
+
+    def expire_late_primaries(self, now):
+        for request_id, (dealer_sock, sent_at) in self.late_primaries.items():
+            if now - sent_at >= self.timeout:            # It never answered: count it at the timeout
+                del self.late_primaries[request_id]
+                self.latencies.append(self.timeout)
+
+    def request(self, message):
+        """ Send a request and return its reply, or None if the deadline passed.
+        """
+        self.sequence = self.sequence + 1
+        self.stats["requests"] = self.stats["requests"] + 1
+        self.hedge_tokens = min(self.MAX_HEDGE_TOKENS, self.hedge_tokens + self.HEDGE_BUDGET)
+        frames = [str(self.sequence), "", message]
+        start = time.time()
+        self.expire_late_primaries(start)
+        deadline = start + self.timeout
+        primary = self.send_primary(frames)
+        sent_at = {primary: start}                       # When every copy of the request was sent
+        hedge_at = None
+        if self.hedge_percentile is not None:
+            hedge_delay = self.hedge_delay()
+            hedge_at = start + hedge_delay
+
+        while True:
+            now = time.time()
+            if now >= deadline:
+                self.stats["timeouts"] = self.stats["timeouts"] + 1
+                self.latencies.append(self.timeout)
+                return None
+            wake_up = deadline if hedge_at is None else min(deadline, hedge_at)
+            for dealer_sock, event in self.poller.poll(max(0, wake_up - now) * 1000):
+                request_id, empty, reply = dealer_sock.recv_multipart()
+                self.outstanding[dealer_sock] = self.outstanding[dealer_sock] - 1
+                if request_id != frames[0]:              # The loser of a previous hedged request
+                    self.stats["discarded"] = self.stats["discarded"] + 1
+                    self.record_late_reply(dealer_sock, request_id)
+                    continue
+                if dealer_sock is primary:
+                    self.latencies.append(time.time() - sent_at[primary])
+                else:                                    # Its latency is recorded when it arrives
+                    self.stats["backup_wins"] = self.stats["backup_wins"] + 1
+                    self.late_primaries[frames[0]] = (primary, sent_at[primary])
+                return reply
+            now = time.time()
+            if hedge_at is not None and now >= hedge_at:
+                if self.hedge_tokens < 1:                # Over budget: hedging would add load, not save time
+                    self.stats["hedges_denied"] = self.stats["hedges_denied"] + 1
+                    hedge_at = None
+                    continue
+                backup = self.send_backup(frames, sent_at)
+                if backup is None:                       # Every REP socket already has a copy
+                    hedge_at = None
+                    continue
+                self.hedge_tokens = self.hedge_tokens - 1
+                self.stats["hedged"] = self.stats["hedged"] + 1
+                sent_at[backup] = now
+                hedge_at = now + hedge_delay             # Still late? Try the next one
+
+    def close(self):
+        for dealer_sock in self.sockets:
+            dealer_sock.close()
+
+def req_function(ports, hedge_percentile, results):
+    """ Definition of the hedged client.
+
+        It sends the same 10 'Marco...' requests of BalancedReqRep.py, but many more times.
+    """
+    client = HedgedClient(context, ["tcp://127.0.0.1:" + str(port) for port in ports],
+                          timeout=1.0, hedge_percentile=hedge_percentile)
+    latencies = []
+    for i in range(300):
+        start = time.time()
+        client.request("Marco...")
+        latencies.append(time.time() - start)
+    client.close()
+    results.append((sorted(latencies), client.stats))
+
+def rep_function(identifier, port, stall_every, die_after):
+    """ Definition of the response socket.
+
+        Every stall_every requests it stalls for half a second, and it dies
+        after answering die_after requests.
+    """
+    rep_sock = context.socket(zmq.REP)
+    rep_sock.setsockopt(zmq.LINGER, 0)
+    rep_sock.bind("tcp://127.0.0.1:" + str(port))
+    answered = 0
+    try:
+        while answered < die_after:
+            rep_sock.recv()
+            answered = answered + 1
+            if stall_every and answered % stall_every == 0:
+                time.sleep(0.5)
+            rep_sock.send("RepSocket " + str(identifier) + " says: Polo!")
+        print "RepSocket " + str(identifier) + " dies after " + str(answered) + " requests"
+    except zmq.ContextTerminated:
+        pass
+    rep_sock.close()
+
+def run(hedge_percentile, first_port):
+    """ Start three REP sockets (a healthy one, a staller and a dying one) and a client.
+    """
+    ports = [first_port, first_port + 1, first_port + 2]
+    threading.Thread(target=rep_function, args=(1, ports[0], 0, 100000)).start()
+    threading.Thread(target=rep_function, args=(2, ports[1], 10, 100000)).start()
+    threading.Thread(target=rep_function, args=(3, ports[2], 0, 50)).start()
+    results = []
+    req_function(ports, hedge_percentile, results)
+    latencies, stats = results[0]
+    print "  p50 %.1f ms, p99 %.1f ms, max %.1f ms, %s" % (
+        latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000,
+        latencies[-1] * 1000, stats)
+
+if __name__ == "__main__":                          # Start the logic
+
+    context = zmq.Context()
+    try:
+        print "Without hedging (only deadlines):"
+        run(None, 2201)
+        print "Hedging after the p95 latency:"
+        run(0.95, 2211)
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        context.term()                                      # End the ZeroMQ context before to leave
@@ -0,0 +1,360 @@
+#!/usr/bin/env python2
+# This example expands the features of the previous PubSub and LastValueCache exercises.
+#
+# A pub_function of PubSub.py created with 'bind' drops every message while no SUB socket is connected,
+# so a subscriber that restarts misses everything published while it was down. The last value cache of
+# LastValueCache.py only keeps the latest message of every topic, not the history.
+#
+# Here the publisher writes every message to a journal before publishing it:
+#
+#   - the journal is a file mapped in memory (mmap) and used as a ring: when it is full, the oldest
+#     messages are overwritten, so its size is the retention. Optionally, messages older than max_age
+#     seconds are forgotten too,
+#   - every message gets a sequence number, and an index maps sequence numbers to their place in the
+#     file, so a replay from any sequence number starts right away,
+#   - reading it is reading memory: the page cache of the operating system keeps it, and keeps it after
+#     the publisher restarts.
+#
+# A subscriber remembers the sequence number of the last message it processed. When it comes back, it
+# subscribes to the live stream first, then asks for a replay from its next sequence number. Replays
+# go in batches of MAX_BATCH messages, each batch ends with MORE (ask again) or END (caught up), and
+# with the oldest sequence number the journal still keeps: if it is bigger than the one asked for, the
+# messages in between were overwritten or expired, and the subscriber knows it lost them:
+#
+#                                 publisher ----> journal (mmap ring file)
+#                              live (PUB)     replay (ROUTER)
+#                                  |              ^     |
+#             [topic | seq | body] |   REPLAY seq prefix     [topic | seq | body]... [MORE|END | seq | oldest]
+#                                  |              |     |
+#                              sub_sock       dealer_sock
+#                                    restarting subscriber
+#
+# The journal file starts with a header page: the capacity of the ring, the offsets of the oldest
+# record and of the next one (as byte counters that only grow) and the next sequence number. Every
+# record is:
+#
+#        +-----------+------------+-------------+-----------------+---------+---------+
+#        |  length   |  sequence  |  timestamp  |  topic length   |  topic  |  body   |
+#        +-----------+------------+-------------+-----------------+---------+---------+
+#
+# A record that doesn't fit before the end of the ring starts again at the beginning; a length of 0
+# marks the jump.
+#
+# Running 'python JournaledPubSub.py bench' measures how fast a replay reads the journal.
+
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zmq
+
+JOURNAL_PATH = os.path.join(tempfile.gettempdir(), "zmq-journal-example")
+LIVE_URI = "inproc://journal_live"
+REPLAY_URI = "inproc://journal_replay"
+SEQUENCE = struct.Struct("!Q")
+MAX_BATCH = 1000                            # messages per replay batch
+
+class Journal(object):
+    """ Append-only ring of messages in a memory-mapped file, indexed by sequence number.
+
+        size:    bytes of the ring. When it's full the oldest messages are overwritten.
+        max_age: seconds a message is kept, None to keep it while it fits.
+    """
+    MAGIC = "ZMQJRNL1"
+    HEADER = struct.Struct("!8sQQQQ")       # magic, capacity, head offset, tail offset, next sequence
+    HEADER_SIZE = mmap.PAGESIZE
+    RECORD = struct.Struct("!IQdH")         # length, sequence, timestamp, topic length
+    WRAP = 0                                # length of the mark that sends the readers to the beginning
+
+    def __init__(self, path, size=64 * 1024 * 1024, max_age=None):
+        self.max_age = max_age
+        exists = os.path.exists(path) and os.path.getsize(path) == self.HEADER_SIZE + size
+        self.file = open(path, "r+b" if exists else "w+b")
+        if not exists:
+            self.file.truncate(self.HEADER_SIZE + size)
+        self.map = mmap.mmap(self.file.fileno(), self.HEADER_SIZE + size)
+        self.capacity = size
+        self.index = []                     # (sequence, offset, timestamp), oldest first
+        self.first = 0                      # index entries before this one are forgotten
+        magic, capacity, self.head, self.tail, self.next_sequence = self.HEADER.unpack_from(self.map, 0)
+        if magic != self.MAGIC or capacity != size:
+            self.head, self.tail, self.next_sequence = 0, 0, 1
+            self.write_header()
+        else:
+            self.rebuild_index()
+
+    def write_header(self):
+        self.HEADER.pack_into(self.map, 0, self.MAGIC, self.capacity, self.head, self.tail, self.next_sequence)
+
+    def position(self, offset):
+        return self.HEADER_SIZE + offset % self.capacity
+
+    def skip_wrap(self, offset):
+        """ Return the offset of the record that starts at offset, following the jump to the beginning.
+        """
+        left = self.capacity - offset % self.capacity
+        if left < self.RECORD.size or struct.unpack_from("!I", self.map, self.position(offset))[0] == self.WRAP:
+            return offset + left
+        return offset
+
+    def rebuild_index(self):
+        """ Scan the records of an existing journal.
+        """
+        offset = self.head
+        while offset < self.tail:
+            offset = self.skip_wrap(offset)
+            length, sequence, timestamp, topic_length = self.RECORD.unpack_from(self.map, self.position(offset))
+            self.index.append((sequence, offset, timestamp))
+            offset = offset + length
+
+    def forget_oldest(self):
+        self.first = self.first + 1
+        self.head = self.index[self.first][1] if self.first < len(self.index) else self.tail
+        if self.first > 1024 and self.first > len(self.index) // 2:
+            del self.index[:self.first]
+            self.first = 0
+
+    def append(self, topic, body):
+        """ Write a message and return its sequence number.
+        """
+        length = self.RECORD.size + len(topic) + len(body)
+        if length > self.capacity:
+            raise ValueError("message of " + str(length) + " bytes doesn't fit in the journal")
+        left = self.capacity - self.tail % self.capacity
+        if left < length:                   # Doesn't fit before the end: jump to the beginning
+            if left >= self.RECORD.size:
+                struct.pack_into("!I", self.map, self.position(self.tail), self.WRAP)
+            end = self.tail + left + length
+        else:
+            end = self.tail + length
+        while self.first < len(self.index) and end - self.head > self.capacity:
+            self.forget_oldest()            # Make room, overwriting the oldest messages
+        if left < length:
+            self.tail = self.tail + left
+            if self.first == len(self.index):
+                self.head = self.tail
+
+        sequence = self.next_sequence
+        timestamp = time.time()
+        position = self.position(self.tail)
+        self.RECORD.pack_into(self.map, position, length, sequence, timestamp, len(topic))
+        start = position + self.RECORD.size
+        self.map[start:start + len(topic)] = topic
+        self.map[start + len(topic):position + length] = body
+        self.index.append((sequence, self.tail, timestamp))
+        self.tail = self.tail + length
+        self.next_sequence = sequence + 1
+        self.write_header()
+        return sequence
+
+    def expire(self):
+        """ Forget the messages older than max_age.
+        """
+        if self.max_age is not None:
+            limit = time.time() - self.max_age
+            while self.first < len(self.index) and self.index[self.first][2] < limit:
+                self.forget_oldest()
+            self.write_header()
+
+    def read(self, offset):
+        position = self.position(offset)
+        length, sequence, timestamp, topic_length = self.RECORD.unpack_from(self.map, position)
+        start = position + self.RECORD.size
+        return sequence, self.map[start:start + topic_length], self.map[start + topic_length:position + length]
+
+    def replay(self, from_sequence, prefix="", limit=None):
+        """ Yield (sequence, topic, body) of the messages from from_sequence, or from the oldest one kept.
+        """
+        self.expire()
+        if self.first == len(self.index):
+            return
+        position = self.first + max(0, from_sequence - self.index[self.first][0])   # Sequences are consecutive
+        for i in xrange(position, len(self.index)):            # A slice would copy the whole index
+            if limit is not None and limit <= 0:
+                return
+            sequence, topic, body = self.read(self.index[i][1])
+            if topic.startswith(prefix):
+                yield sequence, topic, body
+                if limit is not None:
+                    limit = limit - 1
+
+    def oldest_sequence(self):
+        return self.index[self.first][0] if self.first < len(self.index) else self.next_sequence
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+class JournaledPublisher(object):
+    """ A PUB socket that journals every message, and a ROUTER socket that replays them.
+    """
+    def __init__(self, context, live_uri, replay_uri, journal):
+        self.journal = journal
+        self.live = context.socket(zmq.PUB)
+        self.live.bind(live_uri)
+        self.replay_sock = context.socket(zmq.ROUTER)
+        self.replay_sock.bind(replay_uri)
+
+    def publish(self, topic, body):
+        sequence = self.journal.append(topic, body)
+        self.live.send_multipart([topic, SEQUENCE.pack(sequence), body])
+        return sequence
+
+    def serve_replays(self, timeout=0):
+        """ Answer the pending replay requests, waiting up to timeout milliseconds for the first one.
+
+            A request that isn't [REPLAY, sequence, prefix] is answered with ERROR.
+        """
+        while self.replay_sock.poll(timeout):
+            timeout = 0
+            frames = self.replay_sock.recv_multipart()      # [identity, REPLAY, from sequence, prefix]
+            identity = frames[0]
+            if len(frames) != 4 or frames[1] != "REPLAY" or len(frames[2]) != SEQUENCE.size:
+                self.replay_sock.send_multipart([identity, "ERROR", "expected REPLAY, a sequence and a prefix"])
+                continue
+            next_sequence = SEQUENCE.unpack(frames[2])[0]
+            prefix = frames[3]
+            sent = 0
+            for sequence, topic, body in self.journal.replay(next_sequence, prefix, MAX_BATCH):
+                self.replay_sock.send_multipart([identity, topic, SEQUENCE.pack(sequence), body])
+                next_sequence = sequence + 1
+                sent = sent + 1
+            oldest = SEQUENCE.pack(self.journal.oldest_sequence())
+            if sent == MAX_BATCH and next_sequence < self.journal.next_sequence:
+                self.replay_sock.send_multipart([identity, "MORE", SEQUENCE.pack(next_sequence), oldest])
+            else:
+                self.replay_sock.send_multipart([identity, "END", SEQUENCE.pack(self.journal.next_sequence - 1),
+                                                 oldest])
+
+    def close(self):
+        self.live.close()
+        self.replay_sock.close()
+
+def replay(context, replay_uri, from_sequence, prefix, handle, lost=None):
+    """ Ask for the messages from from_sequence and handle them. Returns the last sequence replayed.
+
+        lost(first, last) is called with the sequences the journal doesn't keep any more.
+    """
+    dealer_sock = context.socket(zmq.DEALER)
+    dealer_sock.connect(replay_uri)
+    while True:
+        dealer_sock.send_multipart(["REPLAY", SEQUENCE.pack(from_sequence), prefix])
+        while True:
+            frames = dealer_sock.recv_multipart()
+            if frames[0] in ("MORE", "END", "ERROR"):
+                break
+            handle(frames[0], SEQUENCE.unpack(frames[1])[0], frames[2])
+        if frames[0] == "ERROR":
+            dealer_sock.close()
+            raise ValueError("replay refused: " + frames[1])
+        oldest = SEQUENCE.unpack(frames[2])[0]
+        if oldest > from_sequence and lost is not None:
+            lost(from_sequence, oldest - 1)
+        if frames[0] == "END":
+            dealer_sock.close()
+            return SEQUENCE.unpack(frames[1])[0]
+        from_sequence = SEQUENCE.unpack(frames[1])[0]
+
+def pub_function(times):
+    """ The pub_function of PubSub.py, with a journal. Reopening the journal keeps the old messages.
+    """
+    journal = Journal(JOURNAL_PATH, size=64 * 1024, max_age=60)
+    print "P: the journal keeps messages " + str(journal.oldest_sequence()) + " to " + \
+          str(journal.next_sequence - 1) + " of previous runs"
+    publisher = JournaledPublisher(context, LIVE_URI, REPLAY_URI, journal)
+    for i in range(times):
+        publisher.publish("Important", "Find Time Machine #" + str(i))
+        publisher.serve_replays(100)
+    publisher.serve_replays(500)
+    publisher.close()
+    journal.close()
+
+def sub_function(num, subs_message, times, last_sequence, crash_after=None):
+    """ A SUB socket that processes times messages, or crashes after crash_after of them.
+
+        It starts after the message last_sequence. Returns the last sequence number it processed.
+    """
+    sub_sock = context.socket(zmq.SUB)          # First listen to the live stream...
+    sub_sock.setsockopt(zmq.SUBSCRIBE, subs_message)
+    sub_sock.connect(LIVE_URI)
+    processed = [last_sequence]
+
+    def handle(topic, sequence, body, source):
+        print "S%d: %-6s #%d %s" % (num, source, sequence, body)
+        processed[0] = sequence
+
+    # ...then ask for what we missed while we were down
+    def lost(first, last):
+        print "S%d: lost messages %d to %d, the journal doesn't keep them" % (num, first, last)
+
+    replayed_until = replay(context, REPLAY_URI, last_sequence + 1, subs_message,
+                            lambda topic, sequence, body: handle(topic, sequence, body, "replay"), lost)
+    processed[0] = max(processed[0], replayed_until)
+    count = 0
+    while count < (crash_after or times):
+        topic, sequence, body = sub_sock.recv_multipart()
+        sequence = SEQUENCE.unpack(sequence)[0]
+        if sequence <= processed[0]:
+            continue                            # Already replayed
+        handle(topic, sequence, body, "live")
+        count = count + 1
+    if crash_after is not None:
+        print "S" + str(num) + ": crashing after #" + str(processed[0])
+    sub_sock.close()
+    return processed[0]
+
+def bench(messages, size):
+    """ Append messages to a journal and replay them, without sockets.
+    """
+    path = JOURNAL_PATH + "-bench"
+    if os.path.exists(path):
+        os.remove(path)
+    journal = Journal(path, size=256 * 1024 * 1024)
+    body = "x" * size
+    start = time.time()
+    for i in range(messages):
+        journal.append("Important", body)
+    append_time = time.time() - start
+    start = time.time()
+    replayed = 0
+    next_sequence = 1
+    while True:                             # In batches, like serve_replays
+        sent = 0
+        for sequence, topic, body in journal.replay(next_sequence, "", MAX_BATCH):
+            next_sequence = sequence + 1
+            sent = sent + 1
+        replayed = replayed + sent
+        if sent < MAX_BATCH:
+            break
+    replay_time = time.time() - start
+    journal.close()
+    os.remove(path)
+    print "%6d bytes: append %8.0f msgs/sec, replay %8.0f msgs/sec (%7.1f MB/sec)" % (
+        size, messages / append_time, replayed / replay_time, replayed * size / replay_time / 1e6)
+
+if __name__ == "__main__":                          # Start the logic
+
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        for size in [64, 1024, 16384]:
+            bench(100000, size)
+        sys.exit(0)
+
+    context = zmq.Context()
+    context.setsockopt(zmq.LINGER, 0)
+    try:
+        publisher = threading.Thread(target=pub_function, args=(30, ))
+        publisher.start()
+        time.sleep(0.2)
+        last_sequence = sub_function(0, "Important", 0, 0, crash_after=5)
+        time.sleep(1)                               # Down for a second, missing about ten messages
+        print "S0: restarting from #" + str(last_sequence + 1)
+        sub_function(0, "Important", 5, last_sequence)
+        publisher.join()
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        context.term()                                      # End the ZeroMQ context before to leave
@@ -0,0 +1,185 @@
+#!/usr/bin/env python2
+# This example revisits the Classroom exercise (ClassroomTeacher.py and ClassroomStudent.py).
+#
+# There, the teacher doesn't start the lesson until every student has said 'hello' through a REQ/REP
+# handshake, because a SUB socket loses everything published before it connects. It works, but the
+# slowest student decides when the lesson starts for everybody, and the teacher must know how many
+# students are coming.
+#
+# Here we put a last value cache (LVC) between the publisher and the subscribers. The cache:
+#
+#   - receives every message the publisher sends and gives it a sequence number,
+#   - keeps the latest message of every topic,
+#   - forwards the message to the live stream, with its sequence number,
+#   - answers snapshot requests with the cached messages matching a prefix, ending with the last
+#     sequence number the snapshot covers.
+#
+# A student that arrives late first subscribes to the live stream, then asks for a snapshot, and then
+# only applies the live messages above the last sequence number of the snapshot: nothing is applied
+# twice. The subscription travels to the cache on its own, and over tcp:// it can arrive after the
+# snapshot request, so a message published in between is in neither of them. The student notices it
+# when the next live message skips a sequence number, or when the live stream stays silent for
+# SILENCE seconds (the lost message could be the last one), and asks for a new snapshot. The teacher
+# starts right away.
+#
+#                          teacher (PUB)
+#                               |
+#                          [topic | body]
+#                               |
+#           -----------------------------------------------
+#           -          frontend (SUB)                      -
+#           -     last value cache: topic -> (seq, body)  -
+#           -   live (PUB)        |      snapshot (ROUTER) -
+#           -----------------------------------------------
+#                   |                           ^      |
+#           [topic | seq | body]          SNAPSHOT     [topic | seq | body]... [END | seq]
+#                   |                     prefix       |
+#           -----------------------------------------------
+#           -   Sub socket          |     Dealer socket    -
+#           -----------------------------------------------
+#           -                  student                     -
+#           -----------------------------------------------
+#
+# Every line of the lesson has its own topic (lesson/001, lesson/002...), so the cache keeps the
+# whole lesson. With a single topic updated over and over, it would keep only the latest value.
+
+import struct
+import threading
+import time
+import zmq
+
+FRONTEND_URI = "inproc://lvc_frontend"
+LIVE_URI = "inproc://lvc_live"
+SNAPSHOT_URI = "inproc://lvc_snapshot"
+SEQUENCE = struct.Struct("!Q")
+SILENCE = 1.0                                   # seconds without live messages before checking a snapshot
+LESSON = ["En un lugar de la Mancha, de cuyo nombre no quiero acordarme, ",
+          " no ha mucho tiempo que vivia un hidalgo de los de lanza en astillero ",
+          " adarga antigua, rocin flaco y galgo corredor. ",
+          " Una olla de algo mas vaca que carnero, salpicon las mas noches, ",
+          " duelos y quebrantos los sabados, lantejas los viernes, "]
+
+def last_value_cache(frontend_uri, live_uri, snapshot_uri):
+    """ Definition of the last value cache proxy.
+    """
+    frontend = context.socket(zmq.SUB)
+    frontend.setsockopt(zmq.SUBSCRIBE, "")
+    frontend.bind(frontend_uri)
+    live = context.socket(zmq.PUB)
+    live.bind(live_uri)
+    snapshot = context.socket(zmq.ROUTER)
+    snapshot.bind(snapshot_uri)
+
+    cache = {}                                  # topic -> (sequence, body)
+    sequence = 0
+    poller = zmq.Poller()
+    poller.register(frontend, zmq.POLLIN)
+    poller.register(snapshot, zmq.POLLIN)
+    try:
+        while True:
+            events = dict(poller.poll())
+            if events.get(frontend) == zmq.POLLIN:
+                topic, body = frontend.recv_multipart()
+                sequence = sequence + 1
+                cache[topic] = (sequence, body)
+                live.send_multipart([topic, SEQUENCE.pack(sequence), body])
+
+            if events.get(snapshot) == zmq.POLLIN:
+                identity, command, prefix = snapshot.recv_multipart()
+                for topic, (topic_sequence, body) in sorted(cache.items(), key=lambda item: item[1][0]):
+                    if topic.startswith(prefix):
+                        snapshot.send_multipart([identity, topic, SEQUENCE.pack(topic_sequence), body])
+                snapshot.send_multipart([identity, "END", SEQUENCE.pack(sequence)])
+    except zmq.ContextTerminated:
+        frontend.close()
+        live.close()
+        snapshot.close()
+
+def teacher(frontend_uri):
+    """ The teacher starts the lesson right away, one line every half second.
+    """
+    publisher = context.socket(zmq.PUB)
+    publisher.connect(frontend_uri)
+    time.sleep(0.1)                             # Only the cache must be connected
+    for i, line in enumerate(LESSON):
+        print "Teacher: " + line
+        publisher.send_multipart(["lesson/%03d" % i, line])
+        time.sleep(0.5)
+    publisher.send_multipart(["lesson/end", "END"])
+    publisher.close()
+
+def request_snapshot(student_num, snapshot, prefix, last_sequence):
+    """ Apply the cached messages above last_sequence.
+
+        Returns the last sequence number the snapshot covers, and True if the lesson has ended.
+    """
+    snapshot.send_multipart(["SNAPSHOT", prefix])
+    lesson_ended = False
+    while True:
+        frames = snapshot.recv_multipart()
+        if frames[0] == "END":
+            return max(last_sequence, SEQUENCE.unpack(frames[1])[0]), lesson_ended
+        topic, sequence, body = frames
+        if SEQUENCE.unpack(sequence)[0] <= last_sequence:
+            continue                            # Applied already
+        if body == "END":
+            lesson_ended = True                 # We arrived after the end of the lesson
+        else:
+            print "Student " + str(student_num) + " catches up : {" + body + "}"
+
+def ready_to_learn(student_num, live_uri, snapshot_uri):
+    """ A student that arrives whenever it wants and doesn't miss anything.
+    """
+    subscriber = context.socket(zmq.SUB)        # First listen to the live stream...
+    subscriber.setsockopt(zmq.SUBSCRIBE, "lesson/")
+    subscriber.connect(live_uri)
+
+    # No waiting for the subscription to arrive: a message that falls between it and the snapshot
+    # shows up as a jump in the sequence numbers, or as silence, and a new snapshot fills it.
+    snapshot = context.socket(zmq.DEALER)       # ...then ask for what we missed
+    snapshot.connect(snapshot_uri)
+    last_sequence, lesson_ended = request_snapshot(student_num, snapshot, "lesson/", 0)
+
+    while not lesson_ended:
+        if not subscriber.poll(SILENCE * 1000):  # Nothing new, or we missed the last message
+            last_sequence, lesson_ended = request_snapshot(student_num, snapshot, "lesson/", last_sequence)
+            continue
+        topic, sequence, body = subscriber.recv_multipart()
+        sequence = SEQUENCE.unpack(sequence)[0]
+        if sequence <= last_sequence:
+            continue                            # Already in the snapshot
+        if sequence > last_sequence + 1:        # Something was published that never reached us
+            print "Student " + str(student_num) + " missed messages before #" + str(sequence) + \
+                  ", asks for a snapshot"
+            last_sequence, lesson_ended = request_snapshot(student_num, snapshot, "lesson/", last_sequence)
+            continue                            # The snapshot covers this message too
+        last_sequence = sequence
+        if body == "END":
+            break
+        print "Student " + str(student_num) + " thoughts : {" + body + "}"
+    snapshot.close()
+    subscriber.close()
+
+if __name__ == '__main__':
+
+    context = zmq.Context()
+    context.setsockopt(zmq.LINGER, 0)
+    try:
+        threading.Thread(target=last_value_cache, args=(FRONTEND_URI, LIVE_URI, SNAPSHOT_URI)).start()
+        lesson = threading.Thread(target=teacher, args=(FRONTEND_URI, ))
+        lesson.start()
+
+        # The students arrive late, each one at a different moment
+        students = []
+        for student_num, delay in [(1, 0.2), (2, 1.0), (3, 0.8)]:
+            time.sleep(delay)
+            student = threading.Thread(target=ready_to_learn, args=(student_num, LIVE_URI, SNAPSHOT_URI))
+            student.start()
+            students.append(student)
+        for student in students:
+            student.join()
+        lesson.join()
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        context.term()                                      # End the ZeroMQ context before to leave
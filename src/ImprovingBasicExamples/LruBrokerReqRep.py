@@ -0,0 +1,220 @@
+#!/usr/bin/env python2
+# This example expands the features of the previous BalancedDynamicReqRep exercise.
+#
+# The broker of BalancedDynamicReqRep.py uses the builtin QUEUE device. Its DEALER socket round-robins
+# the requests between the REP sockets without knowing if they are busy, so a slow REP socket gets the
+# same amount of requests than a fast one. The requests pile up behind the slow socket while the fast
+# ones sit idle, and the clients waiting there see a huge latency.
+#
+# Here we write the broker ourselves with a ROUTER socket on both sides, following the
+# 'least recently used' (LRU) routing:
+#
+#   - Every worker is a REQ socket. When it starts it sends a READY message, and every reply it sends
+#     means that it is ready again.
+#   - The broker keeps the list of idle workers. A request is only sent to an idle worker, always to the
+#     one that has been waiting the longest.
+#   - When there isn't any idle worker, the requests wait in the broker queue, so we can measure its depth.
+#
+#                     req_sock      req_sock
+#                        |             |
+#                        ---------------
+#                               |
+#                          frontend (ROUTER)
+#                         (lru broker code) ----- stats_sock (REP)
+#                          backend (ROUTER)
+#                               |
+#                   ------------------------------------
+#                   |           |           |          |
+#              worker_sock  worker_sock  worker_sock  (worker_sock)
+#                 (REQ)        (REQ)        (REQ)
+#
+# The broker answers the current queue depth and the counters through a stats REP socket.
+#
+# At the end we compare it with the QUEUE device, running both with two fast and two slow workers.
+
+import collections
+import errno
+import json
+import threading
+import time
+import zmq
+
+READY = "READY"
+FRONTEND_URI = "inproc://lru_frontend"
+BACKEND_URI = "inproc://lru_backend"
+STATS_URI = "inproc://lru_stats"
+
+def req_function(broker_router_uri, identifier, times, latencies):
+    """ Definition of the request socket.
+
+        It sends requests to the router frontend of the broker, measuring how long
+        it waits for every response.
+    """
+    req_sock = context.socket(zmq.REQ)
+    req_sock.connect(broker_router_uri)
+    for i in range(times):
+        sent = time.time()
+        req_sock.send("ReqSocket " + str(identifier) + " says: Hi!")
+        req_sock.recv()
+        latencies.append(time.time() - sent)
+    req_sock.close()
+
+def worker_function(broker_backend_uri, identifier, work_time):
+    """ Definition of the LRU worker socket.
+
+        It says it is READY and then answers every request the broker gives to it.
+        Every request takes work_time seconds.
+    """
+    worker_sock = context.socket(zmq.REQ)
+    worker_sock.setsockopt(zmq.IDENTITY, "Worker" + str(identifier))
+    worker_sock.connect(broker_backend_uri)
+    worker_sock.send(READY)
+    try:
+        while True:
+            client, empty, message = worker_sock.recv_multipart()
+            time.sleep(work_time)
+            worker_sock.send_multipart([client, "", "Worker " + str(identifier) + " says: Hi '" + message + "'!"])
+    except zmq.ContextTerminated:
+        worker_sock.close()
+
+def rep_function(broker_dealer_uri, identifier, work_time):
+    """ Definition of the response socket used with the QUEUE device.
+
+        It is the same rep_function of BalancedDynamicReqRep.py, taking work_time seconds per request.
+    """
+    rep_sock = context.socket(zmq.REP)
+    rep_sock.connect(broker_dealer_uri)
+    try:
+        while True:
+            message = rep_sock.recv()
+            time.sleep(work_time)
+            rep_sock.send("RepSocket " + str(identifier) + " says: Hi '" + message + "'!")
+    except zmq.ContextTerminated:
+        rep_sock.close()
+
+def lru_broker(broker_router_uri, broker_backend_uri, stats_uri):
+    """ Definition of the LRU broker.
+
+        It reads every request from the frontend and keeps it in its queue until a worker is idle.
+        Every reply of a worker goes back to its client and puts the worker at the end of the idle list.
+    """
+    frontend = context.socket(zmq.ROUTER)
+    frontend.bind(broker_router_uri)
+    backend = context.socket(zmq.ROUTER)
+    backend.setsockopt(zmq.ROUTER_MANDATORY, 1)  # Tell us when a worker is gone instead of dropping requests
+    backend.bind(broker_backend_uri)
+    stats_sock = context.socket(zmq.REP)
+    stats_sock.bind(stats_uri)
+
+    idle_workers = collections.deque()           # The worker waiting the longest is at the left
+    requests = collections.deque()               # Requests waiting for an idle worker
+    stats = {"requests": 0, "replies": 0, "max_queue_depth": 0, "lost_workers": 0, "served": {}}
+
+    poller = zmq.Poller()
+    poller.register(frontend, zmq.POLLIN)
+    poller.register(backend, zmq.POLLIN)
+    poller.register(stats_sock, zmq.POLLIN)
+    try:
+        while True:
+            events = dict(poller.poll())
+
+            if events.get(backend) == zmq.POLLIN:
+                frames = backend.recv_multipart()    # [worker, "", READY] or [worker, "", client, "", reply]
+                worker = frames[0]
+                if frames[2] != READY:
+                    frontend.send_multipart(frames[2:])
+                    stats["replies"] = stats["replies"] + 1
+                    stats["served"][worker] = stats["served"].get(worker, 0) + 1
+                idle_workers.append(worker)
+
+            if events.get(frontend) == zmq.POLLIN:
+                requests.append(frontend.recv_multipart())  # [client, "", request]
+                stats["requests"] = stats["requests"] + 1
+                stats["max_queue_depth"] = max(stats["max_queue_depth"], len(requests))
+
+            if events.get(stats_sock) == zmq.POLLIN:
+                stats_sock.recv()
+                stats["queue_depth"] = len(requests)
+                stats["idle_workers"] = len(idle_workers)
+                stats_sock.send(json.dumps(stats))
+
+            while requests and idle_workers:
+                worker = idle_workers.popleft()
+                try:
+                    backend.send_multipart([worker, ""] + requests[0])
+                    requests.popleft()
+                except zmq.ZMQError as e:
+                    if e.errno != errno.EHOSTUNREACH:
+                        raise
+                    stats["lost_workers"] = stats["lost_workers"] + 1  # Forget it, the request stays queued
+    except zmq.ContextTerminated:
+        frontend.close()
+        backend.close()
+        stats_sock.close()
+
+def queue_broker(broker_router_uri, broker_dealer_uri):
+    """ The broker of BalancedDynamicReqRep.py, using the builtin QUEUE device.
+    """
+    frontend = context.socket(zmq.ROUTER)
+    frontend.bind(broker_router_uri)
+    backend = context.socket(zmq.DEALER)
+    backend.bind(broker_dealer_uri)
+    try:
+        zmq.device(zmq.QUEUE, frontend, backend)
+    except zmq.ContextTerminated:
+        frontend.close()
+        backend.close()
+
+def get_stats(stats_uri):
+    """ Ask the broker for its counters.
+    """
+    stats_client = context.socket(zmq.REQ)
+    stats_client.connect(stats_uri)
+    stats_client.send("")
+    stats = json.loads(stats_client.recv())
+    stats_client.close()
+    return stats
+
+def percentile(latencies, fraction):
+    latencies = sorted(latencies)
+    return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+def run_clients(frontend_uri, number_of_clients, times):
+    """ Start the clients, wait for them and return all their latencies.
+    """
+    latencies = []
+    clients = [threading.Thread(target=req_function, args=(frontend_uri, i, times, latencies))
+               for i in range(number_of_clients)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    return latencies
+
+if __name__ == "__main__":                          # Start the logic
+
+    context = zmq.Context()
+    context.setsockopt(zmq.LINGER, 0)
+    work_times = [0.001, 0.001, 0.02, 0.02]          # Two fast workers and two slow ones
+    try:
+        # The QUEUE device of BalancedDynamicReqRep.py
+        threading.Thread(target=queue_broker, args=("inproc://queue_frontend", "inproc://queue_backend")).start()
+        for i in range(len(work_times)):
+            threading.Thread(target=rep_function, args=("inproc://queue_backend", i, work_times[i])).start()
+        latencies = run_clients("inproc://queue_frontend", 4, 100)
+        print "QUEUE device: p50 %.1f ms, p99 %.1f ms" % (percentile(latencies, 0.5) * 1000,
+                                                           percentile(latencies, 0.99) * 1000)
+
+        # The LRU broker, with the same workers
+        threading.Thread(target=lru_broker, args=(FRONTEND_URI, BACKEND_URI, STATS_URI)).start()
+        for i in range(len(work_times)):
+            threading.Thread(target=worker_function, args=(BACKEND_URI, i, work_times[i])).start()
+        latencies = run_clients(FRONTEND_URI, 4, 100)
+        print "LRU broker:   p50 %.1f ms, p99 %.1f ms" % (percentile(latencies, 0.5) * 1000,
+                                                           percentile(latencies, 0.99) * 1000)
+        print "LRU broker stats: " + json.dumps(get_stats(STATS_URI), sort_keys=True)
+
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        context.term()                                      # End the ZeroMQ context before to leave
@@ -0,0 +1,267 @@
+#!/usr/bin/env python2
+# This example expands the features of the previous PushPull exercise.
+#
+# In PushPull.py the PUSH socket spreads the potatoes between the PULL sockets, and the PULL sockets
+# just print them. Nobody collects what the workers do, and nobody knows when all the work is done.
+#
+# Here we build the complete parallel pipeline:
+#
+#   - the ventilator splits a job in tasks and pushes them to the workers,
+#   - the workers are processes that run a user function on every task and push the results to the
+#     sink,
+#   - the sink collects the results, knows how many tasks every batch has and tells when a batch is
+#     complete,
+#   - the controller publishes KILL when the pipeline shuts down, and every worker leaves.
+#
+#                           ventilator (PUSH)   ---- BATCH id count ---->
+#                          /        |        \                            \
+#                     worker     worker     worker   (processes)  <---   controller (PUB)   KILL
+#                          \        |        /                            /
+#                                 sink (PULL)  <-----------------------------
+#
+# Remember the comment of PushPull.py: a PUSH socket sends everything to the first PULL socket that
+# connects. The workers say READY to the sink once they have connected both sockets, and no task is
+# sent before all of them have. READY only proves that the link to the sink is up: the link from the
+# ventilator is usually up by then too, but if it isn't, the first tasks are spread over fewer
+# workers. Nothing is lost, a PUSH socket only sends to the connected workers.
+#
+# A task is lost when its worker dies with it. If a batch doesn't get any result for RESUBMIT_AFTER
+# seconds, wait() sends its missing tasks again; a result that arrives twice is kept once.
+#
+# Running 'python Pipeline.py bench' measures the tasks per second with 1, 2, 4... workers, up to
+# twice the number of cores.
+
+import multiprocessing
+import sys
+import threading
+import time
+import zmq
+
+VENTILATOR_URI = "ipc:///tmp/zmq-pipeline-ventilator"
+SINK_URI = "ipc:///tmp/zmq-pipeline-sink"
+CONTROL_URI = "ipc:///tmp/zmq-pipeline-control"
+RESUBMIT_AFTER = 5.0                        # seconds without results before sending the missing tasks again
+
+def worker_process(identifier, function):
+    """ Definition of the worker process.
+
+        It pulls tasks, runs the function on them and pushes the results, until it hears KILL.
+    """
+    context = zmq.Context()                 # Never use the context of the parent process
+    context.setsockopt(zmq.LINGER, 0)
+    tasks = context.socket(zmq.PULL)
+    tasks.connect(VENTILATOR_URI)
+    results = context.socket(zmq.PUSH)
+    results.connect(SINK_URI)
+    control = context.socket(zmq.SUB)
+    control.setsockopt(zmq.SUBSCRIBE, "KILL")
+    control.connect(CONTROL_URI)
+    poller = zmq.Poller()
+    poller.register(tasks, zmq.POLLIN)
+    poller.register(control, zmq.POLLIN)
+    results.send_multipart(["READY", str(identifier)])
+    try:
+        while True:
+            events = dict(poller.poll())
+            if events.get(control) == zmq.POLLIN:
+                break
+            if events.get(tasks) == zmq.POLLIN:
+                batch_id, task_id, payload = tasks.recv_multipart()
+                try:
+                    status, result = "OK", function(payload)
+                except Exception as e:           # A failing task must not kill the worker
+                    status, result = "ERROR", repr(e)
+                results.send_multipart(["RESULT", batch_id, task_id, status, result])
+    except KeyboardInterrupt:
+        pass
+    for sock in (tasks, results, control):
+        sock.close()
+    context.term()
+
+class Batch(object):
+    """ The results of a batch, as the sink collects them.
+    """
+    def __init__(self):
+        self.expected = None                # Unknown until BATCH arrives, results can arrive before
+        self.results = {}                   # task id -> (status, result)
+        self.payloads = None                # Set by submit(), to send the lost tasks again
+        self.last_result = time.time()
+        self.done = threading.Event()
+
+    def add(self, task_id, status, result):
+        self.results[task_id] = (status, result)
+        self.last_result = time.time()
+        self.check()
+
+    def check(self):
+        if self.expected is not None and len(self.results) >= self.expected:
+            self.done.set()
+
+class Pipeline(object):
+    """ A ventilator, size worker processes running function, a sink and a controller.
+
+        function receives the payload of a task (a string) and returns its result (a string).
+    """
+    def __init__(self, context, function, size):
+        self.context = context
+        self.function = function
+        self.size = size
+        self.ventilator = context.socket(zmq.PUSH)
+        self.ventilator.bind(VENTILATOR_URI)
+        self.controller = context.socket(zmq.PUB)
+        self.controller.bind(CONTROL_URI)
+        self.sink_control = context.socket(zmq.PUSH)     # From the ventilator to the sink thread
+        self.sink_control.connect("inproc://pipeline_sink_control")
+        self.batches = {}
+        self.batch_lock = threading.Lock()
+        self.ready = threading.Event()
+        self.workers = []
+        self.sequence = 0
+
+    def start(self):
+        sink_bound = threading.Event()
+        self.sink_thread = threading.Thread(target=self.sink, args=(sink_bound, ))
+        self.sink_thread.start()
+        sink_bound.wait()
+        for i in range(self.size):
+            worker = multiprocessing.Process(target=worker_process, args=(i, self.function))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        self.ready.wait()
+
+    def batch(self, batch_id):
+        with self.batch_lock:
+            return self.batches.setdefault(batch_id, Batch())
+
+    def sink(self, sink_bound):
+        """ Definition of the sink. It collects the results until the pipeline shuts down.
+        """
+        results = self.context.socket(zmq.PULL)
+        results.bind(SINK_URI)
+        control = self.context.socket(zmq.PULL)
+        control.bind("inproc://pipeline_sink_control")
+        sink_bound.set()
+        poller = zmq.Poller()
+        poller.register(results, zmq.POLLIN)
+        poller.register(control, zmq.POLLIN)
+        ready_workers = set()
+        while True:
+            events = dict(poller.poll())
+            if events.get(control) == zmq.POLLIN:
+                frames = control.recv_multipart()
+                if frames[0] == "KILL":
+                    break
+                batch = self.batch(frames[1])                     # BATCH id count
+                batch.expected = int(frames[2])
+                batch.check()
+            if events.get(results) == zmq.POLLIN:
+                frames = results.recv_multipart()
+                if frames[0] == "READY":
+                    ready_workers.add(frames[1])
+                    if len(ready_workers) == self.size:
+                        self.ready.set()
+                else:
+                    command, batch_id, task_id, status, result = frames
+                    self.batch(batch_id).add(int(task_id), status, result)
+        results.close()
+        control.close()
+
+    def submit(self, payloads):
+        """ Send a batch of tasks to the workers and return its id.
+        """
+        self.sequence = self.sequence + 1
+        batch_id = str(self.sequence)
+        self.batch(batch_id).payloads = payloads
+        self.sink_control.send_multipart(["BATCH", batch_id, str(len(payloads))])
+        for task_id, payload in enumerate(payloads):
+            self.ventilator.send_multipart([batch_id, str(task_id), payload])
+        return batch_id
+
+    def wait(self, batch_id, timeout=None):
+        """ Wait for a batch to complete and return its (status, result) list, in the order of the tasks.
+
+            Returns None if the timeout expires before.
+        """
+        batch = self.batch(batch_id)
+        deadline = None if timeout is None else time.time() + timeout
+        while not batch.done.is_set():
+            wait = RESUBMIT_AFTER if deadline is None else min(RESUBMIT_AFTER, deadline - time.time())
+            if batch.done.wait(max(0, wait)):
+                break
+            if deadline is not None and time.time() >= deadline:
+                return None
+            if time.time() - batch.last_result >= RESUBMIT_AFTER:     # Stuck: some tasks were lost
+                for task_id, payload in enumerate(batch.payloads):
+                    if task_id not in batch.results:
+                        self.ventilator.send_multipart([batch_id, str(task_id), payload])
+                batch.last_result = time.time()
+        with self.batch_lock:
+            del self.batches[batch_id]
+        return [batch.results[task_id] for task_id in range(batch.expected)]
+
+    def map(self, payloads):
+        return self.wait(self.submit(payloads))
+
+    def shutdown(self):
+        """ Tell the workers and the sink to leave, and wait for them.
+        """
+        self.controller.send("KILL")
+        self.sink_control.send_multipart(["KILL"])
+        for worker in self.workers:
+            worker.join(1)
+            if worker.is_alive():
+                worker.terminate()
+        self.sink_thread.join()
+        for sock in (self.ventilator, self.controller, self.sink_control):
+            sock.close()
+
+def peel(potato):
+    """ The work of the demo: peel the potatoes of PushPull.py, refusing the rotten ones.
+    """
+    if "rotten" in potato:
+        raise ValueError("can't peel a " + potato)
+    time.sleep(0.1)
+    return potato.replace("Potato", "peeled potato")
+
+def cpu_heavy(message):
+    """ The work of the bench: adds the squares of the numbers up to the one received.
+    """
+    return str(sum(i * i for i in xrange(int(message))))
+
+if __name__ == "__main__":                          # Start the logic
+
+    context = zmq.Context()
+    context.setsockopt(zmq.LINGER, 0)
+    pipeline = None
+    try:
+        if len(sys.argv) > 1 and sys.argv[1] == "bench":
+            cores = multiprocessing.cpu_count()
+            print "Machine with " + str(cores) + " cores"
+            size = 1
+            while size <= 2 * cores:
+                pipeline = Pipeline(context, cpu_heavy, size)
+                pipeline.start()
+                start = time.time()
+                pipeline.map(["100000"] * 200)
+                print "%2d workers: %7.1f tasks/sec" % (size, 200 / (time.time() - start))
+                pipeline.shutdown()
+                pipeline = None
+                size = size * 2
+        else:
+            pipeline = Pipeline(context, peel, 3)
+            pipeline.start()
+            first = pipeline.submit([str(i + 1) + " Potato" for i in range(7)])
+            second = pipeline.submit(["8 Potato", "9 rotten Potato", "10 Potato"])
+            for batch_id in [first, second]:
+                for status, result in pipeline.wait(batch_id):
+                    print "Batch " + batch_id + ": " + status + " " + result
+                print "Batch " + batch_id + " complete"
+            pipeline.shutdown()
+            pipeline = None
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        if pipeline is not None:
+            pipeline.shutdown()
+        context.term()                                      # End the ZeroMQ context before to leave
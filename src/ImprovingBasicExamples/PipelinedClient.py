@@ -0,0 +1,238 @@
+#!/usr/bin/env python2
+# This example expands the features of the previous BalancedDynamicReqRep exercise.
+#
+# req_function in BalancedDynamicReqRep.py and BalancedReqRep.py uses a REQ socket, which works in
+# strict lockstep: send, wait for the reply, send again. A client never has more than one request in
+# flight, so it can't do more than 1/RTT requests per second, however many REP sockets are waiting.
+#
+# Here the client uses a DEALER socket, which can send as many requests as it wants without waiting.
+# The client keeps a window of outstanding requests: request() returns a Future right away while the
+# window has room, and only blocks when it is full. Every request carries a correlation id in front
+# of the empty delimiter frame; the REP sockets see it as an envelope and send it back untouched, so
+# the client matches every reply with its Future, whatever order the replies arrive in.
+#
+#                         pipelined client
+#                            dealer_sock         [correlation id | "" | body] x window
+#                                 |
+#                            router_sock
+#                           (broker code)
+#                            dealer_sock
+#                                 |
+#                   ------------------------------------
+#                   |           |           |          |
+#                rep_sock    rep_sock    rep_sock    rep_sock   (unchanged)
+#
+# The client is not thread safe, like the sockets it owns: the replies are read when the owner calls
+# request(), poll() or Future.result(), and the callbacks run right there.
+#
+# Running 'python PipelinedClient.py bench' compares the REQ client with windows of different sizes.
+
+import collections
+import sys
+import threading
+import time
+import zmq
+
+class Future(object):
+    """ The reply of a request that may not have arrived yet.
+    """
+    def __init__(self, client, correlation_id, callback=None):
+        self.client = client
+        self.correlation_id = correlation_id
+        self.callbacks = [callback] if callback is not None else []
+        self.reply = None
+        self.finished = False
+
+    def done(self):
+        return self.finished
+
+    def add_done_callback(self, callback):
+        if self.finished:
+            callback(self)
+        else:
+            self.callbacks.append(callback)
+
+    def set_result(self, reply):
+        self.reply = reply
+        self.finished = True
+        for callback in self.callbacks:
+            callback(self)
+
+    def result(self, timeout=None):
+        """ Wait for the reply and return it. Raises zmq.Again if the timeout expires before.
+
+            A request that times out is abandoned: it leaves the window, and its reply is ignored.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.finished:
+            if self.correlation_id not in self.client.pending:
+                raise zmq.Again("request abandoned after a timeout")
+            if deadline is None:
+                self.client.poll()
+            elif not self.client.poll(max(0, deadline - time.time())) and time.time() >= deadline:
+                self.client.abandon(self.correlation_id)
+                raise zmq.Again("no reply in " + str(timeout) + " seconds")
+        return self.reply
+
+class PipelinedClient(object):
+    """ Request client with up to window requests in flight over one DEALER socket.
+    """
+    def __init__(self, context, broker_router_uri, window=32):
+        self.window = window
+        self.dealer_sock = context.socket(zmq.DEALER)
+        self.dealer_sock.setsockopt(zmq.LINGER, 0)
+        self.dealer_sock.connect(broker_router_uri)
+        self.pending = collections.OrderedDict()     # correlation id -> Future, oldest first
+        self.sequence = 0
+
+    def request(self, message, callback=None, timeout=None):
+        """ Send a request and return its Future. callback(future) is called when the reply arrives.
+
+            If the window is still full after timeout seconds, the oldest request is abandoned to
+            make room, like a Future.result() that times out.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while len(self.pending) >= self.window:
+            if deadline is None:
+                self.poll()
+            elif not self.poll(max(0, deadline - time.time())) and time.time() >= deadline:
+                self.abandon(next(iter(self.pending)))
+        self.sequence = self.sequence + 1
+        correlation_id = str(self.sequence)
+        future = self.pending[correlation_id] = Future(self, correlation_id, callback)
+        self.dealer_sock.send_multipart([correlation_id, "", message])
+        return future
+
+    def poll(self, timeout=None):
+        """ Wait up to timeout seconds (None is forever) for replies and finish their futures.
+
+            Returns the number of replies read.
+        """
+        if not self.pending:
+            return 0
+        if not self.dealer_sock.poll(None if timeout is None else timeout * 1000):
+            return 0
+        replies = 0
+        while True:
+            try:
+                correlation_id, empty, reply = self.dealer_sock.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return replies
+            future = self.pending.pop(correlation_id, None)
+            if future is not None:          # Unknown ids are replies nobody waits for any more
+                future.set_result(reply)
+                replies = replies + 1
+
+    def abandon(self, correlation_id):
+        """ Stop waiting for a request: it leaves the window, and its reply will be ignored.
+        """
+        del self.pending[correlation_id]
+
+    def drain(self, timeout=None):
+        """ Wait for all the outstanding requests, abandoning the ones still pending after timeout seconds.
+
+            Returns the number of requests abandoned.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self.pending:
+            if deadline is None:
+                self.poll()
+            elif not self.poll(max(0, deadline - time.time())) and time.time() >= deadline:
+                abandoned = len(self.pending)
+                for correlation_id in self.pending.keys():
+                    self.abandon(correlation_id)
+                return abandoned
+        return 0
+
+    def close(self):
+        self.dealer_sock.close()
+
+def req_function(broker_router_uri, identifier, times):
+    """ The requests of BalancedDynamicReqRep.py, all sent at once.
+    """
+    client = PipelinedClient(context, broker_router_uri, window=4)
+    futures = []
+    for i in range(times):
+        message = "ReqSocket " + str(identifier) + " says: Hi #" + str(i) + "!"
+        print message
+        futures.append(client.request(message, callback=lambda future: sys.stdout.write(future.reply + "\n")))
+    print "ReqSocket " + str(identifier) + ": first reply " + futures[0].result()
+    client.drain()
+    client.close()
+
+def rep_function(broker_dealer_uri, identifier, work_time):
+    """ The rep_function of BalancedDynamicReqRep.py, taking work_time seconds for every request.
+    """
+    rep_sock = context.socket(zmq.REP)
+    rep_sock.connect(broker_dealer_uri)
+    try:
+        while True:
+            message = rep_sock.recv()
+            if work_time:
+                time.sleep(work_time)
+            rep_sock.send("RepSocket " + str(identifier) + " says: Hi '" + str.split(message)[1] + "'!")
+    except zmq.ContextTerminated:
+        rep_sock.close()
+
+def broker(broker_router_uri, broker_dealer_uri):
+    """ The QUEUE broker of BalancedDynamicReqRep.py.
+    """
+    frontend = context.socket(zmq.ROUTER)
+    frontend.bind(broker_router_uri)
+    backend = context.socket(zmq.DEALER)
+    backend.bind(broker_dealer_uri)
+    try:
+        zmq.device(zmq.QUEUE, frontend, backend)
+    except zmq.ContextTerminated:
+        frontend.close()
+        backend.close()
+
+def bench_lockstep(broker_router_uri, times):
+    req_sock = context.socket(zmq.REQ)
+    req_sock.connect(broker_router_uri)
+    start = time.time()
+    for i in range(times):
+        req_sock.send("ReqSocket 0 says: Hi!")
+        req_sock.recv()
+    elapsed = time.time() - start
+    req_sock.close()
+    return times / elapsed
+
+def bench_pipelined(broker_router_uri, times, window):
+    client = PipelinedClient(context, broker_router_uri, window)
+    start = time.time()
+    for i in range(times):
+        client.request("ReqSocket 0 says: Hi!")
+    client.drain()
+    elapsed = time.time() - start
+    client.close()
+    return times / elapsed
+
+if __name__ == "__main__":                          # Start the logic
+
+    context = zmq.Context()
+    context.setsockopt(zmq.LINGER, 0)
+    try:
+        threading.Thread(target=broker, args=("inproc://broker_frontend", "inproc://broker_backend")).start()
+        if len(sys.argv) > 1 and sys.argv[1] == "bench":
+            # 64 REP sockets that take 1ms each: a lockstep client can't use more than one at a time
+            for i in range(64):
+                threading.Thread(target=rep_function, args=("inproc://broker_backend", i, 0.001)).start()
+            time.sleep(0.5)
+            print "%-22s %8.0f requests/sec" % ("REQ (lockstep)", bench_lockstep("inproc://broker_frontend", 2000))
+            for window in [1, 4, 16, 64]:
+                print "%-22s %8.0f requests/sec" % ("DEALER, window %d" % window,
+                                                    bench_pipelined("inproc://broker_frontend", 5000, window))
+        else:
+            for i in range(3):
+                threading.Thread(target=rep_function, args=("inproc://broker_backend", i, 0.1)).start()
+            clients = [threading.Thread(target=req_function, args=("inproc://broker_frontend", i, 6))
+                       for i in range(2)]
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        context.term()                                      # End the ZeroMQ context before to leave
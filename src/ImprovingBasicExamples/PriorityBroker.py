@@ -0,0 +1,187 @@
+#!/usr/bin/env python2
+# This example expands the features of the previous LruBrokerReqRep exercise.
+#
+# The QUEUE device of BalancedDynamicReqRep.py, and the LRU broker of LruBrokerReqRep.py, serve the
+# requests in arrival order. During a burst the queue grows, an urgent request waits behind all the
+# bulk ones, and the workers spend their time on requests whose client stopped waiting long ago.
+#
+# Here every request carries a header frame with its priority class and its deadline:
+#
+#        0            1                                  5
+#        +------------+----------------------------------+
+#        |  priority  |  budget in milliseconds (0: none) |
+#        +------------+----------------------------------+
+#
+# The deadline travels as a budget, relative to when the request arrives at the broker, so the clocks
+# of the clients and the broker don't need to agree. The scheduling broker:
+#
+#   - keeps one queue per priority class and always gives an idle worker the most urgent request,
+#   - drops the requests whose deadline has passed before they reach a worker, answering EXPIRED to
+#     their client, so no worker time is spent on them,
+#   - answers BAD_HEADER to the requests without a valid header.
+#
+#                critical req_sock    bulk req_sock  bulk req_sock ...
+#                        |                 |              |
+#                        ----------------------------------      [header | request]
+#                                      |
+#                               frontend (ROUTER)
+#                   scheduling broker: CRITICAL | NORMAL | BULK queues
+#                               backend (ROUTER)
+#                                      |
+#                        ----------------------------
+#                        |                          |
+#                   worker_sock                worker_sock   (LRU workers, they never see the header)
+#
+# At the end we compare it with the FIFO order of the LRU broker during a burst of bulk requests.
+
+import collections
+import errno
+import struct
+import threading
+import time
+import zmq
+
+READY = "READY"
+EXPIRED = "EXPIRED"
+BAD_HEADER = "BAD_HEADER"
+HEADER = struct.Struct("!BI")               # priority class, budget in milliseconds
+CRITICAL, NORMAL, BULK = 0, 1, 2
+CLASS_NAMES = ["critical", "normal", "bulk"]
+
+def scheduling_broker(broker_router_uri, broker_backend_uri, stats, scheduling=True):
+    """ Definition of the scheduling broker.
+
+        With scheduling=False it serves the requests in FIFO order and never drops them, like the
+        LRU broker. stats is a dictionary the broker fills with its counters.
+    """
+    frontend = context.socket(zmq.ROUTER)
+    frontend.bind(broker_router_uri)
+    backend = context.socket(zmq.ROUTER)
+    backend.setsockopt(zmq.ROUTER_MANDATORY, 1)
+    backend.bind(broker_backend_uri)
+
+    idle_workers = collections.deque()
+    queues = [collections.deque() for name in CLASS_NAMES]     # (deadline, priority, [client, "", request])
+    stats.update(dispatched=[0] * len(CLASS_NAMES), expired=[0] * len(CLASS_NAMES), lost_workers=0, malformed=0)
+
+    poller = zmq.Poller()
+    poller.register(frontend, zmq.POLLIN)
+    poller.register(backend, zmq.POLLIN)
+    try:
+        while True:
+            events = dict(poller.poll())
+
+            if events.get(backend) == zmq.POLLIN:
+                frames = backend.recv_multipart()    # [worker, "", READY] or [worker, "", client, "", reply]
+                if frames[2] != READY:
+                    frontend.send_multipart(frames[2:])
+                idle_workers.append(frames[0])
+
+            if events.get(frontend) == zmq.POLLIN:
+                frames = frontend.recv_multipart()  # [client, "", header, request]
+                if len(frames) != 4 or len(frames[2]) != HEADER.size:
+                    frontend.send_multipart([frames[0], "", BAD_HEADER])
+                    stats["malformed"] = stats["malformed"] + 1
+                else:
+                    client, empty, header, request = frames
+                    priority, budget = HEADER.unpack(header)
+                    priority = min(priority, BULK)
+                    deadline = time.time() + budget / 1000.0 if budget else None
+                    queues[priority if scheduling else NORMAL].append((deadline, priority, [client, "", request]))
+
+            while idle_workers:
+                queue = next((queue for queue in queues if queue), None)  # The most urgent class first
+                if queue is None:
+                    break
+                deadline, priority, request = queue[0]
+                if scheduling and deadline is not None and deadline < time.time():
+                    queue.popleft()
+                    frontend.send_multipart(request[:2] + [EXPIRED])
+                    stats["expired"][priority] = stats["expired"][priority] + 1
+                    continue
+                worker = idle_workers.popleft()
+                try:
+                    backend.send_multipart([worker, ""] + request)
+                    queue.popleft()
+                    stats["dispatched"][priority] = stats["dispatched"][priority] + 1
+                except zmq.ZMQError as e:
+                    if e.errno != errno.EHOSTUNREACH:
+                        raise
+                    stats["lost_workers"] = stats["lost_workers"] + 1
+    except zmq.ContextTerminated:
+        frontend.close()
+        backend.close()
+
+def worker_function(broker_backend_uri, identifier, work_time):
+    """ The LRU worker of LruBrokerReqRep.py. Every request takes work_time seconds.
+    """
+    worker_sock = context.socket(zmq.REQ)
+    worker_sock.setsockopt(zmq.IDENTITY, "Worker" + str(identifier))
+    worker_sock.connect(broker_backend_uri)
+    worker_sock.send(READY)
+    try:
+        while True:
+            client, empty, message = worker_sock.recv_multipart()
+            time.sleep(work_time)
+            worker_sock.send_multipart([client, "", "Worker " + str(identifier) + " says: Hi '" + message + "'!"])
+    except zmq.ContextTerminated:
+        worker_sock.close()
+
+def req_function(broker_router_uri, priority, budget, times, interval, latencies, expired):
+    """ A client sending requests of a priority class, with a budget in milliseconds.
+
+        It waits interval seconds between requests, and records the latencies of the answered ones.
+    """
+    req_sock = context.socket(zmq.REQ)
+    req_sock.connect(broker_router_uri)
+    header = HEADER.pack(priority, budget)
+    for i in range(times):
+        sent = time.time()
+        req_sock.send_multipart([header, CLASS_NAMES[priority] + " request"])
+        if req_sock.recv() == EXPIRED:
+            expired.append(sent)
+        else:
+            latencies.append(time.time() - sent)
+        time.sleep(interval)
+    req_sock.close()
+
+def percentile(latencies, fraction):
+    latencies = sorted(latencies)
+    return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+def burst(scheduling, suffix):
+    """ A steady critical client while 20 bulk clients flood two workers of 5ms.
+    """
+    frontend_uri, backend_uri = "inproc://priority_frontend" + suffix, "inproc://priority_backend" + suffix
+    stats = {}
+    threading.Thread(target=scheduling_broker, args=(frontend_uri, backend_uri, stats, scheduling)).start()
+    for i in range(2):
+        threading.Thread(target=worker_function, args=(backend_uri, i, 0.005)).start()
+    results = dict((name, ([], [])) for name in CLASS_NAMES)
+    clients = [threading.Thread(target=req_function, args=(frontend_uri, CRITICAL, 100, 60, 0.05) +
+                                results["critical"])]
+    clients += [threading.Thread(target=req_function, args=(frontend_uri, BULK, 50, 30, 0) + results["bulk"])
+                for i in range(20)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    return results, stats
+
+if __name__ == "__main__":                          # Start the logic
+
+    context = zmq.Context()
+    context.setsockopt(zmq.LINGER, 0)
+    try:
+        for scheduling, name in [(False, "FIFO"), (True, "scheduling")]:
+            results, stats = burst(scheduling, "-" + name)
+            for class_name in ["critical", "bulk"]:
+                latencies, expired = results[class_name]
+                print "%-10s %-8s: p50 %6.1f ms, p99 %6.1f ms, %3d answered, %3d expired" % (
+                    name, class_name, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+                    len(latencies), len(expired))
+            print "%-10s broker  : dispatched %s, expired %s" % (name, stats["dispatched"], stats["expired"])
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        context.term()                                      # End the ZeroMQ context before to leave
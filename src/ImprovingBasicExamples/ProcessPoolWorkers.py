@@ -0,0 +1,284 @@
+#!/usr/bin/env python2
+# This example expands the features of the previous BalancedDynamicReqRep and LruBrokerReqRep exercises.
+#
+# ClassroomStudent.py says it uses processes "to do it more realistic", but it starts threads, and so
+# do the REP sockets of BalancedDynamicReqRep.py. That's fine while the workers only wait for messages,
+# but when a worker has real computation to do, the GIL lets only one thread run python code at a time.
+# Adding worker threads doesn't add CPU.
+#
+# Here every worker is a separate process with its own ZeroMQ context. The workers connect to the
+# backend of the broker through ipc://, the transport for processes of the same machine.
+#
+#                     req_sock      req_sock      (threads of the main process)
+#                        |             |
+#                        ---------------
+#                               |
+#                      frontend (ROUTER, inproc://)
+#                          (lru broker)
+#                      backend (ROUTER, ipc://)
+#                               |
+#                   ------------------------------------
+#                   |           |           |          |
+#              worker_sock  worker_sock  worker_sock  worker_sock   (one process each,
+#                                                                    optionally pinned to a CPU)
+#
+# The broker is the LRU broker of LruBrokerReqRep.py: a worker says READY and only gets a request when
+# it is idle. Like the REP sockets of BalancedDynamicReqRep.py, a worker can die after max_requests
+# requests; it says BYE with its last reply, so the broker doesn't give it more work.
+#
+# A WorkerPool supervises the processes: every worker that dies, on purpose or because it crashed,
+# is started again. The new generation has a new identity in the same slot ('Worker-3-2' replaces
+# 'Worker-3-1'), so when it says READY the broker knows the previous one is gone, and sends the
+# request it was working on to another worker.
+#
+# Running 'python ProcessPoolWorkers.py bench' measures the throughput of a CPU-heavy handler with
+# 1, 2, 4... worker processes, up to twice the number of cores.
+
+import collections
+import errno
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+import zmq
+
+try:
+    import psutil                           # Optional, used to pin the workers to a CPU
+except ImportError:
+    psutil = None
+
+FRONTEND_URI = "inproc://process_pool_frontend"
+BACKEND_URI = "ipc:///tmp/zmq-process-pool-backend"
+READY = "READY"
+BYE = "BYE"
+
+def cpu_heavy_handler(message):
+    """ A handler that spends CPU: adds the squares of the numbers up to the one received.
+    """
+    return str(sum(i * i for i in xrange(int(message))))
+
+def pin_to_cpu(cpu):
+    """ Pin the current process to the given CPU. Returns False if it wasn't possible.
+    """
+    if psutil is not None:
+        psutil.Process(os.getpid()).cpu_affinity([cpu])
+        return True
+    devnull = open(os.devnull, "w")
+    try:
+        subprocess.check_call(["taskset", "-p", "-c", str(cpu), str(os.getpid())], stdout=devnull)
+        return True
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    finally:
+        devnull.close()
+
+def worker_process(broker_backend_uri, identity, handler, max_requests, cpu):
+    """ Definition of the worker process.
+
+        It creates its own context, says READY to the broker and answers requests with the handler.
+        After max_requests requests it says BYE and leaves.
+    """
+    if cpu is not None and not pin_to_cpu(cpu):
+        print identity + ": couldn't pin to CPU " + str(cpu)
+    context = zmq.Context()                 # Never use the context of the parent process
+    worker_sock = context.socket(zmq.REQ)
+    worker_sock.setsockopt(zmq.IDENTITY, identity)
+    worker_sock.connect(broker_backend_uri)
+    worker_sock.send(READY)
+    served = 0
+    try:
+        while True:
+            client, empty, message = worker_sock.recv_multipart()
+            reply = handler(message)
+            served = served + 1
+            if max_requests is not None and served >= max_requests:
+                worker_sock.send_multipart([BYE, client, "", reply])
+                break
+            worker_sock.send_multipart([client, "", reply])
+    except KeyboardInterrupt:
+        pass
+    worker_sock.close()
+    context.term()
+
+class WorkerPool(object):
+    """ Starts size worker processes and starts them again when they die.
+
+        handler:      function that receives a request and returns its reply.
+        max_requests: requests a worker answers before leaving, None for no limit.
+        pin_cpus:     pin worker i to CPU i modulo the number of CPUs.
+    """
+    def __init__(self, broker_backend_uri, size, handler, max_requests=None, pin_cpus=False):
+        self.broker_backend_uri = broker_backend_uri
+        self.handler = handler
+        self.max_requests = max_requests
+        self.pin_cpus = pin_cpus
+        self.processes = [None] * size
+        self.generations = [0] * size
+        self.restarts = 0
+        self.stopping = threading.Event()
+        self.supervisor = threading.Thread(target=self.supervise)
+
+    def start_worker(self, num):
+        """ Start the worker num, with a new identity for every generation.
+        """
+        self.generations[num] = self.generations[num] + 1
+        identity = "Worker-" + str(num) + "-" + str(self.generations[num])
+        cpu = num % multiprocessing.cpu_count() if self.pin_cpus else None
+        process = multiprocessing.Process(target=worker_process,
+                                          args=(self.broker_backend_uri, identity, self.handler,
+                                                self.max_requests, cpu))
+        process.daemon = True
+        process.start()
+        self.processes[num] = process
+
+    def start(self):
+        for num in range(len(self.processes)):
+            self.start_worker(num)
+        self.supervisor.start()
+
+    def supervise(self):
+        """ Check the workers ten times per second and start again the ones that died.
+        """
+        while not self.stopping.wait(0.1):
+            for num, process in enumerate(self.processes):
+                if not process.is_alive():
+                    process.join()
+                    if process.exitcode != 0:
+                        print "Worker-" + str(num) + " crashed with exit code " + str(process.exitcode)
+                    self.restarts = self.restarts + 1
+                    self.start_worker(num)
+
+    def stop(self):
+        self.stopping.set()
+        self.supervisor.join()
+        for process in self.processes:
+            process.terminate()
+            process.join()
+
+def worker_slot(identity):
+    """ 'Worker-3-2' is the generation 2 of the worker 3: its slot is 'Worker-3'.
+    """
+    return identity.rsplit("-", 1)[0]
+
+def lru_broker(broker_router_uri, broker_backend_uri):
+    """ The LRU broker of LruBrokerReqRep.py, understanding the BYE of the leaving workers.
+
+        It remembers the request every worker is busy with. When a new generation of a worker says
+        READY, the previous one is dead: its request goes back to the queue, or is answered with an
+        error if it already killed a worker before.
+    """
+    frontend = context.socket(zmq.ROUTER)
+    frontend.bind(broker_router_uri)
+    backend = context.socket(zmq.ROUTER)
+    backend.setsockopt(zmq.ROUTER_MANDATORY, 1)
+    backend.bind(broker_backend_uri)
+
+    idle_workers = collections.deque()
+    requests = collections.deque()          # (retried, [client, "", request])
+    in_flight = {}                          # worker -> (retried, [client, "", request])
+    generations = {}                        # slot -> identity of its current worker
+    poller = zmq.Poller()
+    poller.register(frontend, zmq.POLLIN)
+    poller.register(backend, zmq.POLLIN)
+    try:
+        while True:
+            events = dict(poller.poll())
+            if events.get(backend) == zmq.POLLIN:
+                frames = backend.recv_multipart()    # [worker, "", READY], [worker, "", (BYE,) client, "", reply]
+                worker = frames[0]
+                if frames[2] == BYE:
+                    frontend.send_multipart(frames[3:])
+                    in_flight.pop(worker, None)
+                elif frames[2] == READY:
+                    dead = generations.get(worker_slot(worker))
+                    generations[worker_slot(worker)] = worker
+                    if dead is not None and dead != worker:
+                        if dead in idle_workers:
+                            idle_workers.remove(dead)
+                        if dead in in_flight:
+                            retried, request = in_flight.pop(dead)
+                            if retried:                     # It killed two workers, don't try a third
+                                frontend.send_multipart(request[:2] + ["ERROR: the worker died"])
+                            else:
+                                requests.appendleft((True, request))
+                    if worker not in idle_workers:          # A READY repeated must not queue it twice
+                        idle_workers.append(worker)
+                else:
+                    frontend.send_multipart(frames[2:])
+                    in_flight.pop(worker, None)
+                    idle_workers.append(worker)
+            if events.get(frontend) == zmq.POLLIN:
+                requests.append((False, frontend.recv_multipart()))
+            while requests and idle_workers:
+                worker = idle_workers.popleft()
+                try:
+                    backend.send_multipart([worker, ""] + requests[0][1])
+                    in_flight[worker] = requests.popleft()
+                except zmq.ZMQError as e:
+                    if e.errno != errno.EHOSTUNREACH:
+                        raise
+    except zmq.ContextTerminated:
+        frontend.close()
+        backend.close()
+
+def req_function(broker_router_uri, times, work, timeout=10):
+    """ Definition of the request socket. It asks for 'work' squares every time.
+
+        It gives up if a reply takes more than timeout seconds.
+    """
+    req_sock = context.socket(zmq.REQ)
+    req_sock.connect(broker_router_uri)
+    for i in range(times):
+        req_sock.send(str(work))
+        if not req_sock.poll(timeout * 1000):
+            print "No reply in " + str(timeout) + " seconds, giving up"
+            break
+        req_sock.recv()
+    req_sock.close()
+
+def run_clients(broker_router_uri, number_of_clients, times, work):
+    """ Start the clients, wait for them and return the requests per second.
+    """
+    clients = [threading.Thread(target=req_function, args=(broker_router_uri, times, work))
+               for i in range(number_of_clients)]
+    start = time.time()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    return number_of_clients * times / (time.time() - start)
+
+if __name__ == "__main__":                          # Start the logic
+
+    context = zmq.Context()
+    context.setsockopt(zmq.LINGER, 0)
+    try:
+        if len(sys.argv) > 1 and sys.argv[1] == "bench":
+            cores = multiprocessing.cpu_count()
+            sizes = [1]
+            while sizes[-1] < 2 * cores:
+                sizes.append(sizes[-1] * 2)
+            print "Machine with " + str(cores) + " cores"
+            for size in sizes:
+                # A broker per step: the identities of a new pool start again at Worker-N-1
+                frontend_uri, backend_uri = FRONTEND_URI + "-" + str(size), BACKEND_URI + "-" + str(size)
+                threading.Thread(target=lru_broker, args=(frontend_uri, backend_uri)).start()
+                pool = WorkerPool(backend_uri, size, cpu_heavy_handler, pin_cpus=True)
+                pool.start()
+                throughput = run_clients(frontend_uri, 2 * size, 20, 200000)
+                pool.stop()
+                print "%2d worker processes: %7.1f requests/sec" % (size, throughput)
+        else:
+            threading.Thread(target=lru_broker, args=(FRONTEND_URI, BACKEND_URI)).start()
+            # Four workers that leave after 25 requests each, so the pool has to start them again
+            pool = WorkerPool(BACKEND_URI, 4, cpu_heavy_handler, max_requests=25)
+            pool.start()
+            throughput = run_clients(FRONTEND_URI, 8, 50, 100000)
+            pool.stop()
+            print "%.1f requests/sec, %d workers started again" % (throughput, pool.restarts)
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        context.term()                                      # End the ZeroMQ context before to leave
@@ -0,0 +1,194 @@
+#!/usr/bin/env python2
+# This example expands the features of the previous BalancedDynamicReqRep exercise.
+#
+# BalancedDynamicReqRep.py creates a default zmq.Context(), which has a single I/O thread, and sends
+# every client through one ROUTER/DEALER pair served by one broker thread. However many cores the
+# machine has, the broker layer uses one of them.
+#
+# Here we run several brokers, the shards, in the same process:
+#
+#   - the context is created with io_threads, so the sockets of the shards are spread over several
+#     I/O threads instead of sharing one,
+#   - every shard runs the builtin QUEUE device, which works in C without holding the GIL, so the
+#     shards really run in parallel,
+#   - every client picks its shard with a consistent hash of its identity: the same client always
+#     goes to the same shard, and adding a shard only moves about 1/N of the clients,
+#   - every worker connects to the backend of every shard, so any worker can serve any shard.
+#
+#           client  client  client  client  client  client
+#              |      |        \      /        |       |
+#              -------          ------          -------          (consistent hash of the identity)
+#                 |                |                |
+#             frontend 0       frontend 1       frontend 2       (ROUTER)
+#               shard 0          shard 1          shard 2        (QUEUE device, one thread each)
+#             backend 0        backend 1        backend 2        (DEALER)
+#                 |                |                |
+#              -----------------------------------------
+#                 |                |                |
+#              rep_sock         rep_sock         rep_sock        (connected to every backend)
+#
+# Running 'python ShardedBroker.py bench' measures the aggregate throughput with 1, 2, 4... shards,
+# up to the number of cores, with the clients and the workers in their own processes.
+
+import bisect
+import hashlib
+import multiprocessing
+import sys
+import threading
+import time
+import zmq
+
+SHARDS = 3
+IO_THREADS = 3
+FRONTEND_URI = "ipc:///tmp/zmq-shard-frontend-%d"
+BACKEND_URI = "ipc:///tmp/zmq-shard-backend-%d"
+
+class HashRing(object):
+    """ Consistent hashing of keys to shards.
+
+        Every shard is placed REPLICAS times in the ring, so the keys are spread evenly and removing
+        or adding a shard only moves the keys of its neighbours.
+    """
+    REPLICAS = 100
+
+    def __init__(self, shards):
+        self.ring = sorted((self.hash(str(shard) + "#" + str(i)), shard)
+                           for shard in shards for i in range(self.REPLICAS))
+        self.hashes = [point for point, shard in self.ring]
+
+    @staticmethod
+    def hash(key):
+        return int(hashlib.md5(key).hexdigest()[:8], 16)
+
+    def shard_for(self, key):
+        position = bisect.bisect(self.hashes, self.hash(key)) % len(self.ring)
+        return self.ring[position][1]
+
+class ShardedBroker(object):
+    """ Several QUEUE brokers, one thread each, in the same context.
+    """
+    def __init__(self, context, frontend_uris, backend_uris):
+        self.context = context
+        self.shards = zip(frontend_uris, backend_uris)
+        self.threads = []
+
+    def start(self):
+        for frontend_uri, backend_uri in self.shards:
+            thread = threading.Thread(target=self.broker, args=(frontend_uri, backend_uri))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def broker(self, broker_router_uri, broker_dealer_uri):
+        """ The broker of BalancedDynamicReqRep.py. Ends when the context is terminated.
+        """
+        frontend = self.context.socket(zmq.ROUTER)
+        frontend.bind(broker_router_uri)
+        backend = self.context.socket(zmq.DEALER)
+        backend.bind(broker_dealer_uri)
+        try:
+            zmq.device(zmq.QUEUE, frontend, backend)
+        except zmq.ContextTerminated:
+            frontend.close()
+            backend.close()
+
+def shard_uris(shards):
+    return [FRONTEND_URI % i for i in range(shards)], [BACKEND_URI % i for i in range(shards)]
+
+def req_function(context, frontend_uris, identity, times, verbose=True):
+    """ Definition of the request socket. It only talks to the shard its identity hashes to.
+    """
+    frontend_uri = HashRing(frontend_uris).shard_for(identity)
+    req_sock = context.socket(zmq.REQ)
+    req_sock.setsockopt(zmq.IDENTITY, identity)
+    req_sock.connect(frontend_uri)
+    if verbose:
+        print identity + " uses the shard at " + frontend_uri
+    for i in range(times):
+        req_sock.send(identity + " says: Hi!")
+        response = req_sock.recv()
+        if verbose:
+            print response
+    req_sock.close()
+
+def rep_function(context, backend_uris, identifier):
+    """ Definition of the response socket. It serves every shard.
+    """
+    rep_sock = context.socket(zmq.REP)
+    for backend_uri in backend_uris:
+        rep_sock.connect(backend_uri)
+    try:
+        while True:
+            message = rep_sock.recv()
+            rep_sock.send("RepSocket " + str(identifier) + " says: Hi '" + str.split(message)[0] + "'!")
+    except zmq.ContextTerminated:
+        rep_sock.close()
+
+def client_process(frontend_uris, identity, times):
+    context = zmq.Context()                 # Never use the context of the parent process
+    req_function(context, frontend_uris, identity, times, verbose=False)
+    context.term()
+
+def worker_process(backend_uris, identifier):
+    context = zmq.Context()
+    context.setsockopt(zmq.LINGER, 0)
+    rep_function(context, backend_uris, identifier)
+
+def bench(shards, times):
+    """ Aggregate requests/sec of 2 clients and 1 worker per shard, each one a process.
+    """
+    context = zmq.Context(io_threads=shards)
+    context.setsockopt(zmq.LINGER, 0)
+    frontend_uris, backend_uris = shard_uris(shards)
+    ShardedBroker(context, frontend_uris, backend_uris).start()
+    workers = [multiprocessing.Process(target=worker_process, args=(backend_uris, i)) for i in range(shards)]
+    for worker in workers:
+        worker.start()
+    clients = [multiprocessing.Process(target=client_process, args=(frontend_uris, "Client-%d" % i, times))
+               for i in range(2 * shards)]
+    start = time.time()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    throughput = len(clients) * times / (time.time() - start)
+    for worker in workers:
+        worker.terminate()
+        worker.join()
+    context.term()
+    return throughput
+
+if __name__ == "__main__":                          # Start the logic
+
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        cores = multiprocessing.cpu_count()
+        print "Machine with " + str(cores) + " cores"
+        shards = 1
+        while shards <= max(cores, 2):
+            print "%2d shards, %2d io_threads: %8.0f requests/sec" % (shards, shards, bench(shards, 5000))
+            shards = shards * 2
+        sys.exit(0)
+
+    context = zmq.Context(io_threads=IO_THREADS)
+    context.setsockopt(zmq.LINGER, 0)
+    try:
+        # Adding a fourth shard only moves about a quarter of the clients
+        identities = ["Client-%d" % i for i in range(1000)]
+        three, four = HashRing(range(3)), HashRing(range(4))
+        moved = sum(1 for identity in identities if three.shard_for(identity) != four.shard_for(identity))
+        print "Going from 3 to 4 shards moves " + str(moved) + " of " + str(len(identities)) + " clients"
+
+        frontend_uris, backend_uris = shard_uris(SHARDS)
+        ShardedBroker(context, frontend_uris, backend_uris).start()
+        for i in range(3):
+            threading.Thread(target=rep_function, args=(context, backend_uris, i)).start()
+        clients = [threading.Thread(target=req_function, args=(context, frontend_uris, "Client-%d" % i, 2))
+                   for i in range(6)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        context.term()                                      # End the ZeroMQ context before to leave
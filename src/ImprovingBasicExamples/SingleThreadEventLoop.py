@@ -0,0 +1,300 @@
+#!/usr/bin/env python2
+# This example revisits the roles of the previous exercises: req_function, rep_function, sub_function,
+# pull_function and ready_to_learn all run in their own threading.Thread.
+#
+# A thread per socket is easy to read, but it doesn't scale: with some thousands of sockets we pay
+# thousands of thread stacks, and all of them fight for the GIL to do very little work each.
+#
+# ZeroMQ sockets don't need a thread to wait: every socket has a file descriptor that a single poll()
+# call can watch together with thousands of others. Here we build a tiny event loop on top of poll(),
+# and every role is written as a coroutine, that is, a python generator that 'yield's whenever it has
+# to wait:
+#
+#       yield sock          wait until the socket has a message to recv()
+#       yield 0.5           sleep half a second
+#
+# The loop resumes every coroutine when the thing it was waiting for is ready. All the sockets and all
+# the coroutines live in the same thread:
+#
+#                               EventLoop (one thread)
+#                                       |
+#                                 select.poll
+#                  -----------------------------------------
+#                  |            |            |             |
+#            req coroutine  rep coroutine  sub coroutine  pull coroutine ...
+#
+# Running 'python SingleThreadEventLoop.py' plays the ReqRep, PushPull and PubSub examples on one loop.
+# Running 'python SingleThreadEventLoop.py students' starts the three students of ClassroomStudent.py
+# on one loop, to be used with ClassroomTeacher.py.
+# Running 'python SingleThreadEventLoop.py bench' compares the memory and the throughput of the
+# thread-per-socket model with the event loop, using thousands of REQ/REP pairs.
+
+import collections
+import heapq
+import resource
+import select
+import subprocess
+import sys
+import threading
+import time
+import zmq
+
+class EventLoop(object):
+    """ Runs socket coroutines in a single thread.
+
+        A coroutine is a generator that yields a zmq socket to wait for a message,
+        or a number of seconds to sleep.
+
+        Every socket exposes a file descriptor (zmq.FD) that becomes readable when its events
+        may have changed. We watch those descriptors with select.poll, registering each socket
+        only once, so waking up a coroutine doesn't cost more with thousands of sockets around.
+    """
+    def __init__(self):
+        self.poller = select.poll()
+        self.sockets = {}                       # file descriptor -> socket registered on it
+        self.ready = collections.deque()        # coroutines that can run now
+        self.waiting = {}                       # socket -> coroutine waiting for a message on it
+        self.timers = []                        # heap of (wake up time, order, coroutine)
+        self.order = 0
+
+    def spawn(self, coroutine):
+        """ Schedule a new coroutine.
+        """
+        self.ready.append(coroutine)
+
+    def step(self, coroutine):
+        """ Run the coroutine until it has to wait again.
+        """
+        try:
+            waiting_for = next(coroutine)
+        except StopIteration:
+            return
+        if isinstance(waiting_for, zmq.Socket):
+            # Reading zmq.EVENTS also rearms the descriptor, so it must be checked after
+            # registering it: a message that arrived before is seen here, later ones by poll
+            fd = waiting_for.getsockopt(zmq.FD)
+            if self.sockets.get(fd) is not waiting_for:
+                self.sockets[fd] = waiting_for
+                self.poller.register(fd, select.POLLIN)
+            if waiting_for.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+                self.ready.append(coroutine)     # Already a message there, don't poll for it
+            else:
+                self.waiting[waiting_for] = coroutine
+        else:
+            self.order = self.order + 1
+            heapq.heappush(self.timers, (time.time() + waiting_for, self.order, coroutine))
+
+    def run(self):
+        """ Run until every coroutine has finished.
+        """
+        while self.ready or self.waiting or self.timers:
+            while self.ready:
+                self.step(self.ready.popleft())
+
+            if self.timers:
+                timeout = max(0, self.timers[0][0] - time.time()) * 1000
+            elif self.waiting:
+                timeout = None
+            else:
+                break
+
+            for fd, event in self.poller.poll(timeout):
+                sock = self.sockets.get(fd)
+                if sock is None or sock.closed or event & select.POLLNVAL:
+                    self.poller.unregister(fd)  # The coroutine closed it
+                    self.sockets.pop(fd, None)
+                    continue
+                if sock.getsockopt(zmq.EVENTS) & zmq.POLLIN and sock in self.waiting:
+                    self.ready.append(self.waiting.pop(sock))
+            now = time.time()
+            while self.timers and self.timers[0][0] <= now:
+                self.ready.append(heapq.heappop(self.timers)[2])
+
+# The roles of the previous examples, written as coroutines
+
+def req_coroutine(context, uri, identifier, times):
+    """ The req_function of ReqRep.py.
+    """
+    req_sock = context.socket(zmq.REQ)
+    req_sock.connect(uri)
+    for i in range(times):
+        req_sock.send("Marco...")
+        yield req_sock
+        print "Req " + str(identifier) + ": received response '" + req_sock.recv() + "'"
+    req_sock.close()
+
+def rep_coroutine(context, uri, times):
+    """ The rep_function of ReqRep.py.
+    """
+    rep_sock = context.socket(zmq.REP)
+    rep_sock.bind(uri)
+    for i in range(times):
+        yield rep_sock
+        print "Rep: received request '" + rep_sock.recv() + "'"
+        rep_sock.send("Polo!")
+    rep_sock.close()
+
+def push_coroutine(context, uri, times):
+    """ The push_function of PushPull.py.
+    """
+    push_sock = context.socket(zmq.PUSH)
+    push_sock.bind(uri)
+    yield 0.1                                   # Let the pullers connect
+    for i in range(times):
+        push_sock.send(str(i + 1) + " Potato")
+    yield 0.1                                   # Let the messages leave before closing
+    push_sock.close()
+
+def pull_coroutine(context, uri, num, times):
+    """ The pull_function of PushPull.py.
+    """
+    pull_sock = context.socket(zmq.PULL)
+    pull_sock.connect(uri)
+    for i in range(times):
+        yield pull_sock
+        print "Pull" + str(num) + ": I recieved a message '" + pull_sock.recv() + "'"
+    pull_sock.close()
+
+def pub_coroutine(context, uri, times):
+    """ The pub_function of PubSub.py.
+    """
+    pub_sock = context.socket(zmq.PUB)
+    pub_sock.bind(uri)
+    for i in range(times):
+        yield 0.1                               # Sleep without blocking the other coroutines
+        pub_sock.send_multipart(["Important", "Find Time Machine"])
+        pub_sock.send_multipart(["Useless", "Drink Brawndo"])
+    pub_sock.close()
+
+def sub_coroutine(context, uri, num, topic, times):
+    """ The sub_function of PubSub.py.
+    """
+    sub_sock = context.socket(zmq.SUB)
+    sub_sock.setsockopt(zmq.SUBSCRIBE, topic)
+    sub_sock.connect(uri)
+    for i in range(times):
+        yield sub_sock
+        topic_received, body = sub_sock.recv_multipart()
+        print "S" + str(num) + ": topic " + topic_received + ", body " + body
+    sub_sock.close()
+
+def ready_to_learn(context, student_num):
+    """ The ready_to_learn student of ClassroomStudent.py, to be run against ClassroomTeacher.py.
+    """
+    subscriber = context.socket(zmq.SUB)
+    subscriber.connect("tcp://127.0.0.1:2202")
+    subscriber.setsockopt(zmq.SUBSCRIBE, "")
+    req_sock = context.socket(zmq.REQ)
+    req_sock.connect("tcp://127.0.0.1:2201")
+    req_sock.send("Hello Teacher!")
+    yield req_sock
+    req_sock.recv()
+    while True:
+        yield subscriber
+        lesson = subscriber.recv()
+        if lesson == 'END':
+            break
+        print "Student " + str(student_num) + " thoughts : {" + lesson + "}"
+    subscriber.close()
+    req_sock.close()
+
+# Benchmark: N REQ/REP pairs, each REQ socket sending requests to its own REP socket
+
+def bench_echo_thread(rep_sock, times):
+    for i in range(times):
+        rep_sock.send(rep_sock.recv())
+
+def bench_request_thread(req_sock, times):
+    for i in range(times):
+        req_sock.send("ping")
+        req_sock.recv()
+
+def bench_echo_coroutine(rep_sock, times):
+    for i in range(times):
+        yield rep_sock
+        rep_sock.send(rep_sock.recv())
+
+def bench_request_coroutine(req_sock, times):
+    for i in range(times):
+        req_sock.send("ping")
+        yield req_sock
+        req_sock.recv()
+
+def bench(model, pairs, times):
+    """ Run the REQ/REP pairs with the given model and print the requests/sec and the peak memory.
+    """
+    context = zmq.Context()
+    context.set(zmq.MAX_SOCKETS, 2 * pairs + 10)
+    sockets = []
+    for i in range(pairs):
+        rep_sock = context.socket(zmq.REP)
+        rep_sock.bind("inproc://bench-" + str(i))
+        req_sock = context.socket(zmq.REQ)
+        req_sock.connect("inproc://bench-" + str(i))
+        sockets.append((req_sock, rep_sock))
+
+    start = time.time()
+    if model == "threads":
+        threads = []
+        for req_sock, rep_sock in sockets:
+            threads.append(threading.Thread(target=bench_echo_thread, args=(rep_sock, times)))
+            threads.append(threading.Thread(target=bench_request_thread, args=(req_sock, times)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        loop = EventLoop()
+        for req_sock, rep_sock in sockets:
+            loop.spawn(bench_echo_coroutine(rep_sock, times))
+            loop.spawn(bench_request_coroutine(req_sock, times))
+        loop.run()
+    elapsed = time.time() - start
+
+    for req_sock, rep_sock in sockets:
+        req_sock.close()
+        rep_sock.close()
+    context.term()
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0   # KB on Linux
+    print "%-7s %6d sockets %10.0f requests/sec %8.1f MB peak memory" % (
+        model, 2 * pairs, pairs * times / elapsed, peak_memory)
+
+if __name__ == "__main__":                          # Start the logic
+
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        # Every measure runs in its own process, so the peak memory of one doesn't hide the other
+        for pairs in [100, 1000, 2500]:
+            for model in ["threads", "loop"]:
+                subprocess.call([sys.executable, sys.argv[0], "bench-run", model, str(pairs), "20"])
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "bench-run":
+        bench(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+        sys.exit(0)
+
+    context = zmq.Context()
+    try:
+        loop = EventLoop()
+        if len(sys.argv) > 1 and sys.argv[1] == "students":
+            for i in [1, 2, 3]:
+                loop.spawn(ready_to_learn(context, i))
+        else:
+            # ReqRep.py: two REQ sockets and one REP socket
+            loop.spawn(rep_coroutine(context, "inproc://simplereqrep", 2))
+            for i in [0, 1]:
+                loop.spawn(req_coroutine(context, "inproc://simplereqrep", i, 1))
+
+            # PushPull.py: one PUSH socket and two PULL sockets
+            loop.spawn(push_coroutine(context, "inproc://push-pull-queue", 6))
+            for i in [0, 1]:
+                loop.spawn(pull_coroutine(context, "inproc://push-pull-queue", i, 3))
+
+            # PubSub.py: one PUB socket and three SUB sockets
+            loop.spawn(pub_coroutine(context, "inproc://pushpub", 10))
+            for i in range(3):
+                loop.spawn(sub_coroutine(context, "inproc://pushpub", i, "Important" if i % 2 == 0 else "Useless", 5))
+
+        loop.run()                                  # Everything above runs in this thread
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        context.term()                                      # End the ZeroMQ context before to leave
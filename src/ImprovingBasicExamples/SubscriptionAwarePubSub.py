@@ -0,0 +1,126 @@
+#!/usr/bin/env python2
+# This example expands the features of the previous PubSub exercise.
+#
+# pub_function in PubSub.py builds and sends its 'Important' and 'Useless' messages whether someone
+# subscribed to them or not. The PUB socket filters them and drops the ones nobody wants, but by then
+# we have already paid for building them. If building a message is expensive (a query, a big
+# serialization...) and the subscriptions are sparse, most of that work is wasted.
+#
+# An XPUB socket is a PUB socket that also lets us read the subscriptions. Every time a subscriber
+# subscribes to a new prefix we receive a message '\x01' + prefix, and when the last subscriber of a
+# prefix leaves, '\x00' + prefix. With them we keep a live index of the prefixes someone wants, and
+# the publisher asks it "does anyone want this topic?" before doing the expensive work.
+#
+#                        xpub_sock  <-- subscribe/unsubscribe events
+#                         /       \
+#                  sub_sock1     sub_sock2
+#                 'Important'   'Useless' (joins later and leaves)
+#
+
+import threading
+import time
+import zmq
+
+class SubscriptionIndex(object):
+    """ The topic prefixes someone is subscribed to, built from the XPUB subscription events.
+    """
+    def __init__(self):
+        self.prefixes = set()
+        self.cache = {}                     # topic -> wanted, valid until the subscriptions change
+
+    def update(self, event):
+        """ Apply a subscription event received from an XPUB socket.
+        """
+        if event[0] == "\x01":
+            self.prefixes.add(event[1:])
+        elif event[0] == "\x00":
+            self.prefixes.discard(event[1:])
+        self.cache.clear()
+
+    def wants(self, topic):
+        """ Is anyone subscribed to a prefix of this topic?
+        """
+        wanted = self.cache.get(topic)
+        if wanted is None:
+            wanted = self.cache[topic] = any(topic.startswith(prefix) for prefix in self.prefixes)
+        return wanted
+
+class SubscriptionAwarePublisher(object):
+    """ An XPUB socket plus the index of its subscriptions.
+    """
+    def __init__(self, context, uri):
+        self.xpub_sock = context.socket(zmq.XPUB)
+        self.xpub_sock.bind(uri)
+        self.index = SubscriptionIndex()
+        self.stats = {"sent": 0, "skipped": 0}
+
+    def update(self):
+        """ Read all the pending subscription events. Call it before asking wants().
+        """
+        while self.xpub_sock.poll(0):
+            self.index.update(self.xpub_sock.recv())
+
+    def wants(self, topic):
+        self.update()
+        wanted = self.index.wants(topic)
+        if not wanted:
+            self.stats["skipped"] = self.stats["skipped"] + 1
+        return wanted
+
+    def send(self, topic, body):
+        self.xpub_sock.send_multipart([topic, body])
+        self.stats["sent"] = self.stats["sent"] + 1
+
+    def close(self):
+        self.xpub_sock.close()
+
+def build_message(text):
+    """ Pretend that building a message is expensive.
+    """
+    time.sleep(0.05)
+    return text
+
+def pub_function(uri, rounds):
+    """ Definition of the publisher. It only builds the messages someone is subscribed to.
+    """
+    publisher = SubscriptionAwarePublisher(context, uri)
+    for i in range(rounds):
+        if publisher.wants("Important"):
+            publisher.send("Important", build_message("Find Time Machine"))
+        if publisher.wants("Useless"):
+            print "P: someone wants Useless messages, building one"
+            publisher.send("Useless", build_message("Drink Brawndo"))
+        time.sleep(0.1)
+    print "P: " + str(publisher.stats["sent"]) + " messages built and sent, " + \
+          str(publisher.stats["skipped"]) + " skipped because nobody wanted them"
+    publisher.close()
+
+def sub_function(uri, num, subs_message, times):
+    """ Definition of the SUB socket. It leaves after receiving some messages.
+    """
+    print "S" + str(num) + ": Subscribing to messages with topic " + subs_message
+    sub_sock = context.socket(zmq.SUB)
+    sub_sock.setsockopt(zmq.SUBSCRIBE, subs_message)
+    sub_sock.connect(uri)
+    for i in range(times):
+        topic, body = sub_sock.recv_multipart()
+        print "S" + str(num) + ": I received a message! The topic was " + topic + ", the body " + body
+    print "S" + str(num) + ": leaving"
+    sub_sock.close()
+
+if __name__ == "__main__":                          # Start the logic
+
+    context = zmq.Context()
+    context.setsockopt(zmq.LINGER, 0)
+    try:
+        uri = "inproc://subscription-aware-pub-sub"
+        publisher = threading.Thread(target=pub_function, args=(uri, 30))
+        publisher.start()
+        threading.Thread(target=sub_function, args=(uri, 0, "Important", 20)).start()
+        time.sleep(1)
+        threading.Thread(target=sub_function, args=(uri, 1, "Useless", 3)).start()   # Joins later, leaves soon
+        publisher.join()
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        context.term()                                      # End the ZeroMQ context before to leave
@@ -0,0 +1,195 @@
+#!/usr/bin/env python2
+# This example expands the features of the previous PushPull and ReqRep exercises for big payloads.
+#
+# By default send() copies the python string into a ZeroMQ message, and recv() copies the ZeroMQ message
+# into a new python string. For a few bytes it doesn't matter, but when we push multi-megabyte arrays
+# through a pipeline those copies take most of the CPU time.
+#
+# pyzmq can avoid both copies:
+#
+#   - send(obj, copy=False) accepts any object with the buffer interface (str, buffer, memoryview,
+#     numpy arrays...) and gives ZeroMQ a pointer to its memory. pyzmq keeps a reference to the object
+#     until ZeroMQ has sent it, so don't modify it after sending (use track=True to know when it's done).
+#   - recv(copy=False) returns a zmq.Frame. It has the buffer interface too, so memoryview() or
+#     numpy.frombuffer() give a view of the ZeroMQ message without materializing a string.
+#
+# To send numpy arrays we add a header frame with the dtype and the shape, so the receiver can build
+# an array view on top of the data frame:
+#
+#                      push_sock                          req_sock
+#                          |                                  |
+#               [header | array data]  --->         [header | array data]
+#                          |                                  |
+#                      pull_sock                          rep_sock
+#                 numpy view of the frame                  (returns a view too)
+#
+# Running 'python ZeroCopyPushPull.py bench' compares both ways from 1KB to 64MB and shows the
+# payload size where the zero-copy path starts to win.
+
+import json
+import sys
+import threading
+import time
+import zmq
+
+try:
+    import numpy
+except ImportError:
+    numpy = None                            # The array functions need numpy, the buffer ones don't
+
+PAGE_SIZE = 4096                            # The bench receiver reads one byte of every page
+
+def zero_copy_socket(socket_type):
+    """ Create a socket that never copies the payloads.
+
+        pyzmq still copies the messages smaller than copy_threshold (64KB) because it is cheaper
+        than tracking them. We set it to 0 so every send() with copy=False is really zero-copy.
+    """
+    sock = context.socket(socket_type)
+    sock.copy_threshold = 0
+    return sock
+
+def send_buffer(sock, payload, flags=0):
+    """ Send any object with the buffer interface without copying it.
+    """
+    return sock.send(payload, flags, copy=False)
+
+def recv_buffer(sock):
+    """ Receive a message as a read-only view of the ZeroMQ message.
+    """
+    return memoryview(sock.recv(copy=False))
+
+def send_array(sock, array, flags=0):
+    """ Send a numpy array as a JSON header with its dtype and shape, followed by its data.
+    """
+    header = json.dumps({"dtype": str(array.dtype), "shape": array.shape})
+    sock.send(header, flags | zmq.SNDMORE)
+    return sock.send(numpy.ascontiguousarray(array), flags, copy=False)
+
+def recv_array(sock):
+    """ Receive a numpy array sent by send_array. The array is a view of the ZeroMQ message.
+    """
+    header, data = sock.recv_multipart(copy=False)
+    header = json.loads(header.bytes)
+    return numpy.frombuffer(data, dtype=header["dtype"]).reshape(header["shape"])
+
+def push_function(arrays):
+    """ Definition of the push socket. It sends every array without copying it.
+    """
+    push_sock = zero_copy_socket(zmq.PUSH)
+    push_sock.bind("inproc://zero-copy-push-pull")
+    for array in arrays:
+        print "Push: sending an array of shape " + str(array.shape)
+        send_array(push_sock, array)
+    push_sock.close()
+
+def pull_function(times):
+    """ Definition of the pull socket. It receives array views and uses them as any other array.
+    """
+    pull_sock = zero_copy_socket(zmq.PULL)
+    pull_sock.connect("inproc://zero-copy-push-pull")
+    for i in range(times):
+        array = recv_array(pull_sock)
+        print "Pull: received a %s view of shape %s, sum %s" % (array.dtype, array.shape, array.sum())
+    pull_sock.close()
+
+def rep_function(times):
+    """ Definition of the response socket. It answers every request with the transposed array.
+    """
+    rep_sock = zero_copy_socket(zmq.REP)
+    rep_sock.bind("inproc://zero-copy-req-rep")
+    for i in range(times):
+        array = recv_array(rep_sock)
+        send_array(rep_sock, array.T)       # Not contiguous, send_array makes it contiguous once
+    rep_sock.close()
+
+def req_function(array):
+    """ Definition of the request socket.
+    """
+    req_sock = zero_copy_socket(zmq.REQ)
+    req_sock.connect("inproc://zero-copy-req-rep")
+    send_array(req_sock, array)
+    reply = recv_array(req_sock)
+    print "Req: sent shape " + str(array.shape) + ", received the transposed shape " + str(reply.shape)
+    req_sock.close()
+
+def checksum(data):
+    """ Add one byte of every page, so the receiver really reads the memory it got.
+    """
+    return sum(ord(data[i]) for i in xrange(0, len(data), PAGE_SIZE))
+
+def bench_receiver(uri, times, zero_copy, done):
+    pull_sock = context.socket(zmq.PULL)
+    pull_sock.connect(uri)
+    for i in range(times):
+        if zero_copy:
+            data = recv_buffer(pull_sock)
+        else:
+            data = pull_sock.recv()
+        checksum(data)                          # Over inproc the zero-copy message is the sender's
+                                                # memory: reading it is all the work left
+    pull_sock.close()
+    done.set()
+
+def bench(transport, size, zero_copy):
+    """ Push messages of the given size through inproc or tcp and return the MB/sec.
+    """
+    times = max(20, min(10000, (256 << 20) // size))
+    payload = "\0" * size                  # Built once: only the copies of pyzmq are measured
+    push_sock = zero_copy_socket(zmq.PUSH) if zero_copy else context.socket(zmq.PUSH)
+    if transport == "tcp":
+        uri = "tcp://127.0.0.1:" + str(push_sock.bind_to_random_port("tcp://127.0.0.1"))
+    else:
+        uri = "inproc://zero-copy-bench-%d-%d" % (size, zero_copy)
+        push_sock.bind(uri)
+    done = threading.Event()
+    receiver = threading.Thread(target=bench_receiver, args=(uri, times, zero_copy, done))
+    receiver.start()
+    start = time.time()
+    for i in range(times):
+        if zero_copy:
+            send_buffer(push_sock, payload)
+        else:
+            push_sock.send(payload)
+    done.wait()
+    elapsed = time.time() - start
+    receiver.join()
+    push_sock.setsockopt(zmq.LINGER, 0)
+    push_sock.close()
+    return times * size / elapsed / 1e6
+
+if __name__ == "__main__":                          # Start the logic
+
+    context = zmq.Context()
+    try:
+        if len(sys.argv) > 1 and sys.argv[1] == "bench":
+            for transport in ["inproc", "tcp"]:
+                print "Transport " + transport + "://"
+                crossover = None
+                size = 1024
+                while size <= 64 << 20:
+                    copying = bench(transport, size, False)
+                    zero_copy = bench(transport, size, True)
+                    if crossover is None and zero_copy > copying:
+                        crossover = size
+                    print "  %9d bytes: copying %8.1f MB/sec, zero-copy %8.1f MB/sec" % (size, copying, zero_copy)
+                    size = size * 4
+                print "  zero-copy wins from " + (str(crossover) + " bytes" if crossover else "no size")
+        elif numpy is None:
+            print "This example needs numpy, try 'bench' to use plain buffers"
+        else:
+            arrays = [numpy.arange(12, dtype=numpy.float64).reshape(3, 4),
+                      numpy.ones((1024, 1024), dtype=numpy.int32)]
+            pull = threading.Thread(target=pull_function, args=(len(arrays), ))
+            pull.start()
+            push_function(arrays)
+            pull.join()
+
+            rep = threading.Thread(target=rep_function, args=(1, ))
+            rep.start()
+            req_function(numpy.zeros((2000, 500), dtype=numpy.float32))
+            rep.join()
+    except (KeyboardInterrupt, SystemExit):
+        print "Received keyboard interrupt, system exiting"
+    finally:
+        context.term()                                      # End the ZeroMQ context before to leave